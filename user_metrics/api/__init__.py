@@ -11,7 +11,7 @@ from multiprocessing import Lock
 
 query_mod = nested_import(settings.__query_module__)
 
-# Lock for request notification callback operations
+# Lock for compound operations on the shared job table
 # defined in request_manager.py
 REQ_NCB_LOCK = Lock()
 
@@ -30,6 +30,13 @@ error_codes = {
     3: 'Could not find User ID.',
     4: 'Bad metric name.',
     5: 'Failed to retrieve users.',
+    6: 'Job cancelled.',
+    7: 'Job timed out.',
+    8: 'Job exited unexpectedly.',
+    9: 'Job is not running.',
+    10: 'Bad time series window.',
+    11: 'Bad cohort expression.',
+    12: 'Could not upload cohort.',
 }
 
 
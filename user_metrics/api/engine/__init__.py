@@ -13,17 +13,28 @@
     This set of methods allows boolean expressions of cohort IDs to be
     synthesized and interpreted in the portion of the URL path that is
     bound to the user cohort name.  This set of methods, invoked at the top
-    level via ``parse_cohorts`` takes an expression of the form::
-
-        http://metrics-api.wikimedia.org/cohorts/1&2~3~4/bytes_added
-
-    The portion of the path ``1&2~3~4``, resolves to the boolean expression
-    "1 AND 2 OR 3 OR 4".  The cohorts that correspond to the numeric ID values
-    in ``usertags_meta`` are resolved to sets of user ID longs which are then
-    operated on with union and intersect operations to yield a custom user
-    list.  The power of this functionality lies in that it allows subsets of
-    users to be selected based on prior conditions that includes them in a
-    given cohort.
+    level via ``data.evaluate_cohort_expression`` takes an expression of the
+    form::
+
+        http://metrics-api.wikimedia.org/cohorts/1&2~(3^4)/bytes_added
+
+    The portion of the path ``1&2~(3^4)``, resolves to the boolean expression
+    "1 AND 2 OR (3 AND NOT 4)".  AND (``&``) and AND NOT (``^``) bind more
+    tightly than OR (``~``) and parentheses group sub-expressions.  The
+    cohorts that correspond to the numeric ID values in ``usertags_meta`` are
+    resolved to sorted arrays of user IDs which are then operated on with
+    union, intersect and difference operations to yield a custom user list.
+    The power of this functionality lies in that it allows subsets of users
+    to be selected based on prior conditions that includes them in a given
+    cohort.
+
+    ``compile_cohort_expression`` parses an expression into a list of
+    ``CohortTerm`` objects, one per OR operand, and ``evaluate_cohorts``
+    evaluates a compiled expression given the members of each cohort it
+    refers to, see ``cohort_ids``.  Requests evaluate expressions with
+    ``data.evaluate_cohort_expression`` which works over cached cohort
+    members, fetching each distinct cohort once.  Requests are validated
+    with ``check_cohort_expression``.
 
     Method Definitions
     ~~~~~~~~~~~~~~~~~~
@@ -34,8 +45,10 @@ __email__ = "rfaulkner@wikimedia.org"
 __date__ = "january 11 2012"
 __license__ = "GPL (version 2 or later)"
 
-from re import search
-from user_metrics.api import MetricsAPIError, query_mod
+from re import search, findall
+from collections import namedtuple
+from numpy import array, int64, intersect1d, setdiff1d, union1d
+from user_metrics.api import MetricsAPIError
 
 #
 # Define remaining constants
@@ -59,63 +72,117 @@ DEFAULT_QUERY_VAL = 'present'
 # ======================
 
 # This regex must be matched to parse cohorts
-COHORT_REGEX = r'^([0-9]+[&~])*[0-9]+$'
+COHORT_REGEX = r'^[0-9(][0-9&~^()]*$'
+COHORT_TOKEN_REGEX = r'[0-9]+|[&~^()]'
 
 COHORT_OP_AND = '&'
 COHORT_OP_OR = '~'
-# COHORT_OP_NOT = '^'
+COHORT_OP_NOT = '^'
+
+# Operands of an AND term of a cohort expression.  Each operand is a cohort
+# id or a nested compiled expression.  Users are in the term if they are in
+# every ``include`` operand and in no ``exclude`` operand.
+CohortTerm = namedtuple('CohortTerm', 'include exclude')
 
 
-def parse_cohorts(expression):
+def check_cohort_expression(expression):
     """
-        Defines and parses boolean expressions of cohorts and returns a list
-        of user ids corresponding to the expression argument.
+        Raises ``MetricsAPIError`` if ``expression`` is built of cohort ids
+        and operators, see ``COHORT_REGEX``, but is malformed.  Other
+        expressions are taken as cohort names.
+    """
+    if search(COHORT_REGEX, expression):
+        compile_cohort_expression(expression)
 
-            Parameters:
-                - **expression**: str. Boolean expression built of
-                    cohort labels.
 
-            Return:
-                - List(str).  user ids corresponding to cohort expression.
+def compile_cohort_expression(expression):
+    """
+        Parses a cohort expression into a list of ``CohortTerm`` whose union
+        is the expression.  Raises ``MetricsAPIError`` if the expression is
+        malformed.
     """
-
-    # match expression
     if not search(COHORT_REGEX, expression):
-        raise MetricsAPIError()
-
-    # parse expression
-    return parse(expression)
-
-
-def parse(expression):
-    """ Top level parsing. Splits expression by OR then sub-expressions by
-        AND. returns a generator of ids included in the evaluated expression
+        raise MetricsAPIError('Bad cohort expression.', error_code=11)
+
+    tokens = findall(COHORT_TOKEN_REGEX, expression)
+    terms, pos = _parse_or(tokens, 0)
+    if pos != len(tokens):
+        raise MetricsAPIError('Bad cohort expression.', error_code=11)
+    return terms
+
+
+def _parse_or(tokens, pos):
+    terms = list()
+    while True:
+        term, pos = _parse_and(tokens, pos)
+        terms.append(term)
+        if pos < len(tokens) and tokens[pos] == COHORT_OP_OR:
+            pos += 1
+        else:
+            return terms, pos
+
+
+def _parse_and(tokens, pos):
+    term = CohortTerm(list(), list())
+    operand, pos = _parse_operand(tokens, pos)
+    term.include.append(operand)
+    while pos < len(tokens) and tokens[pos] in [COHORT_OP_AND,
+                                                COHORT_OP_NOT]:
+        op = tokens[pos]
+        operand, pos = _parse_operand(tokens, pos + 1)
+        if op == COHORT_OP_AND:
+            term.include.append(operand)
+        else:
+            term.exclude.append(operand)
+    return term, pos
+
+
+def _parse_operand(tokens, pos):
+    if pos < len(tokens) and tokens[pos].isdigit():
+        return int(tokens[pos]), pos + 1
+    if pos < len(tokens) and tokens[pos] == '(':
+        terms, pos = _parse_or(tokens, pos + 1)
+        if pos < len(tokens) and tokens[pos] == ')':
+            return terms, pos + 1
+    raise MetricsAPIError('Bad cohort expression.', error_code=11)
+
+
+def cohort_ids(terms):
+    """ Returns the set of distinct cohort ids in a compiled expression """
+    ids = set()
+    for term in terms:
+        for operand in term.include + term.exclude:
+            if isinstance(operand, list):
+                ids.update(cohort_ids(operand))
+            else:
+                ids.add(operand)
+    return ids
+
+
+def evaluate_cohorts(terms, members):
+    """
+        Evaluates a compiled cohort expression.  ``members`` maps each
+        cohort id of the expression to the sorted array of its distinct
+        user ids.  Returns the sorted array of user ids in the expression.
+        Intersections start from the smallest operand.
     """
-    user_ids_seen = set()
-    for sub_exp_1 in expression.split(COHORT_OP_OR):
-        for user_id in intersect_ids(sub_exp_1.split(COHORT_OP_AND)):
-            if not user_ids_seen.__contains__(user_id):
-                user_ids_seen.add(user_id)
-                yield user_id
-
-
-def intersect_ids(cohort_id_list):
-
-    user_ids = dict()
-    # only a single cohort id in the expression - return all users of this
-    # cohort
-    if len(cohort_id_list) == 1:
-        for id in query_mod.get_cohort_users(cohort_id_list[0]):
-            yield id
-    else:
-        for cid in cohort_id_list:
-            for id in query_mod.get_cohort_users(cid):
-                if id in user_ids:
-                    user_ids[id] += 1
-                else:
-                    user_ids[id] = 1
-                    # Executes only in the case that there was more than one
-                    # cohort id in the expression
-        for key in user_ids:
-            if user_ids[key] > 1:
-                yield key
+    users = array([], dtype=int64)
+    for term in terms:
+        included = sorted([_evaluate_operand(operand, members)
+                           for operand in term.include], key=len)
+        result = included[0]
+        for operand in included[1:]:
+            result = intersect1d(result, operand, assume_unique=True)
+        for operand in term.exclude:
+            if not len(result):
+                break
+            result = setdiff1d(result, _evaluate_operand(operand, members),
+                               assume_unique=True)
+        users = union1d(users, result)
+    return users
+
+
+def _evaluate_operand(operand, members):
+    if isinstance(operand, list):
+        return evaluate_cohorts(operand, members)
+    return members[operand]
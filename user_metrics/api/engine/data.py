@@ -14,6 +14,14 @@
         get_users(cohort_expr)
         get_cohort_id(utm_name)
         get_cohort_refresh_datetime(utm_id)
+        get_cohort_members(utm_id)
+
+    Cohort members are cached by ``get_cohort_members`` as sorted arrays of
+    integer user ids, one file per cohort under ``__data_file_dir__``, keyed
+    on the cohort id and its ``utm_touched`` timestamp.  The timestamp itself
+    is trusted for ``COHORT_TOUCHED_TTL`` seconds so that repeated requests
+    for a cohort do not query the database.  Cohort expressions are evaluated
+    over these arrays by ``evaluate_cohort_expression``.
 
     The other portion of data storage and retrieval is concerned with providing
     functionality that enables responses to be cached.  Request responses are
@@ -37,6 +45,14 @@
     using the key list and ``build_key_tree`` recursively builds a tree
     representation of all of the key paths in the hash reference.
 
+    Raw (unaggregated) metric results are cached separately for a short
+    period by ``set_raw_data`` and ``get_raw_data``.  These are keyed on the
+    request signature without the aggregator so that, for example, requesting
+    the mean and then the median of the same metric over the same cohort only
+    computes the metric once.  Each result is stored in its own file, see
+    ``write_keyed_data``, so that concurrent jobs never read a file that is
+    being written or rewrite each other's entries.
+
     .. _OrderedDict: http://docs.python.org/2/library/collections.html
 
 """
@@ -52,12 +68,17 @@ from datetime import datetime
 from re import search
 from collections import OrderedDict
 from hashlib import sha1
+from time import time
+from glob import glob
+from tempfile import mkstemp
+import os
 import cPickle
+import numpy
 
 import user_metrics.etl.data_loader as dl
 from user_metrics.config import logging
-from user_metrics.api.engine import COHORT_REGEX, parse_cohorts, \
-    DATETIME_STR_FORMAT
+from user_metrics.api.engine import COHORT_REGEX, DATETIME_STR_FORMAT, \
+    compile_cohort_expression, cohort_ids, evaluate_cohorts
 from user_metrics.api.engine.request_meta import REQUEST_META_QUERY_STR,\
     REQUEST_META_BASE
 from user_metrics.api import MetricsAPIError, query_mod
@@ -68,27 +89,174 @@ from user_metrics.config import settings
 # e.g. "metric <==> blocks"
 HASH_KEY_DELIMETER = "--"
 
+# Pickle file storing cached responses
+API_DATA_FILE = 'api_data.pkl'
+
+# Directory under ``__data_file_dir__`` holding one pickle file per raw
+# metric result
+RAW_DATA_DIR = 'raw/'
+
+# Raw metric results are only reused by requests that differ in these keys
+RAW_DATA_EXCLUDE_KEYS = ['aggregator']
+
+# 1. Number of seconds for which raw metric results may be reused
+# 2. Maximum size in bytes of the raw metric result files, the oldest are
+#    removed beyond it
+RAW_DATA_TTL = 1800
+RAW_DATA_MAX_BYTES = getattr(settings, '__raw_data_max_bytes__',
+                             256 * 1024 ** 2)
+
+# Errors raised by unpickling a file that is truncated or otherwise corrupt
+PICKLE_READ_ERRORS = (EOFError, ValueError, TypeError, IndexError,
+                      AttributeError, ImportError, KeyError,
+                      cPickle.UnpicklingError)
+
+# Directories under ``__data_file_dir__`` holding cohort member arrays and
+# one pickle file per cohort index entry, i.e. cohort ids and refresh times
+COHORT_MEMBERS_DIR = 'cohorts/'
+COHORT_INDEX_DIR = 'cohorts/index/'
+
+# 1. Number of seconds for which a cohort's id and ``utm_touched`` value are
+#    reused without querying ``usertags_meta``
+# 2. Maximum number of cohort member arrays held in memory by a process
+COHORT_TOUCHED_TTL = getattr(settings, '__cohort_touched_ttl__', 300)
+COHORT_MEMORY_MAX_ITEMS = 20
+
+# Cohort member arrays loaded by this process keyed on (utm_id, utm_touched)
+_cohort_members = OrderedDict()
+
 
 def get_users(cohort_expr):
     """ get users from cohort """
 
-    if search(COHORT_REGEX, cohort_expr):
-        logging.info(__name__ + ' :: Processing cohort by expression.')
-        users = [user for user in parse_cohorts(cohort_expr)]
-    else:
-        logging.info(__name__ + ' :: Processing cohort by tag name.')
-        try:
-            id = query_mod.get_cohort_id(cohort_expr)
-            users = [u for u in query_mod.get_cohort_users(id)]
-        except (IndexError, TypeError,
-                query_mod.UMQueryCallError) as e:
-            logging.error(__name__ + ' :: Could not retrieve users '
-                                     'for cohort {0}: {1}'.
-                format(cohort_expr, str(e)))
-            return []
+    try:
+        if search(COHORT_REGEX, cohort_expr):
+            logging.info(__name__ + ' :: Processing cohort by expression.')
+            users = evaluate_cohort_expression(cohort_expr).tolist()
+        else:
+            logging.info(__name__ + ' :: Processing cohort by tag name.')
+            id = get_cohort_id(cohort_expr)
+            users = get_cohort_members(id).tolist()
+    except (IndexError, TypeError, ValueError, MetricsAPIError,
+            query_mod.UMQueryCallError) as e:
+        logging.error(__name__ + ' :: Could not retrieve users '
+                                 'for cohort {0}: {1}'.
+            format(cohort_expr, str(e)))
+        return []
     return users
 
 
+def evaluate_cohort_expression(expression):
+    """
+        Evaluates a cohort expression, see ``compile_cohort_expression``,
+        and returns the sorted array of the ids of its users.  The members of
+        each distinct cohort in the expression are fetched once.
+    """
+    terms = compile_cohort_expression(expression)
+    members = dict((utm_id, get_cohort_members(utm_id))
+                   for utm_id in cohort_ids(terms))
+    return evaluate_cohorts(terms, members)
+
+
+def get_cohort_id(utm_name):
+    """
+        Returns the id of the cohort named ``utm_name``.  The id is read
+        from the cohort index if it was looked up within the last
+        ``COHORT_TOUCHED_TTL`` seconds.
+    """
+    key = 'name' + HASH_KEY_DELIMETER + utm_name
+    return _get_cohort_index_value(key, query_mod.get_cohort_id, utm_name)
+
+
+def get_cohort_touched(utm_id):
+    """
+        Returns the ``utm_touched`` timestamp of a cohort as returned by
+        ``get_cohort_refresh_datetime``.  The timestamp is read from the
+        cohort index if it was looked up within the last
+        ``COHORT_TOUCHED_TTL`` seconds.
+    """
+    key = 'touched' + HASH_KEY_DELIMETER + str(int(utm_id))
+    return _get_cohort_index_value(key, get_cohort_refresh_datetime, utm_id)
+
+
+def _get_cohort_index_value(key, method, arg):
+    """
+        Returns the value stored under ``key`` in the cohort index or, if
+        it is missing or expired, stores and returns ``method(arg)``.
+    """
+    if isinstance(key, unicode):
+        key = key.encode('utf-8')
+    key = sha1(key).hexdigest()
+    item = read_keyed_data(COHORT_INDEX_DIR, key)
+    now = time()
+    if item is not None and now - item[0] <= COHORT_TOUCHED_TTL:
+        return item[1]
+
+    value = method(arg)
+    if value is not None:
+        try:
+            write_keyed_data((now, value), COHORT_INDEX_DIR, key)
+        except (IOError, OSError, cPickle.PicklingError) as e:
+            logging.error(__name__ + ' :: Could not store cohort index '
+                                     'entry: {0}'.format(str(e)))
+    return value
+
+
+def get_cohort_members(utm_id):
+    """
+        Returns the sorted array of the ids of the users in cohort
+        ``utm_id``.  Members are queried from ``usertags`` only if no array
+        is stored for the cohort's current ``utm_touched`` value.  The
+        returned array is shared and must not be modified.
+    """
+    utm_id = int(utm_id)
+    key = (utm_id, get_cohort_touched(utm_id))
+
+    if key in _cohort_members:
+        members = _cohort_members.pop(key)
+    else:
+        members = _read_cohort_members(key)
+        if members is None:
+            logging.debug(__name__ + ' :: Querying users of cohort {0}.'.
+                          format(utm_id))
+            members = numpy.unique(numpy.fromiter(
+                (int(user) for user in query_mod.get_cohort_users(utm_id)),
+                dtype=numpy.int64))
+            _write_cohort_members(key, members)
+
+    while len(_cohort_members) >= COHORT_MEMORY_MAX_ITEMS:
+        _cohort_members.popitem(last=False)
+    _cohort_members[key] = members
+    return members
+
+
+def _cohort_members_file(utm_id, utm_touched='*'):
+    """ Path of the member array of a cohort at refresh ``utm_touched`` """
+    return '{0}{1}{2}_{3}.npy'.format(
+        settings.__data_file_dir__, COHORT_MEMBERS_DIR, utm_id,
+        ''.join(c for c in utm_touched if c.isdigit() or c == '*'))
+
+
+def _read_cohort_members(key):
+    try:
+        return numpy.load(_cohort_members_file(*key))
+    except (IOError, ValueError):
+        return None
+
+
+def _write_cohort_members(key, members):
+    """ Stores the members of a cohort, replacing older refreshes """
+    file_name = _cohort_members_file(*key)
+    try:
+        for old_file in glob(_cohort_members_file(key[0])):
+            if old_file != file_name:
+                _remove_file(old_file)
+        _write_file(file_name, lambda f: numpy.save(f, members))
+    except (IOError, OSError) as e:
+        logging.error(__name__ + ' :: Could not store users of cohort '
+                                 '{0}: {1}'.format(key[0], str(e)))
+
+
 def get_cohort_refresh_datetime(utm_id):
     """
         Get the latest refresh datetime of a cohort.  Returns current time
@@ -198,7 +366,7 @@ def find_item(hash_table_ref, key_sig):
             return None
 
 
-def build_key_signature(request_meta, hash_result=False):
+def build_key_signature(request_meta, hash_result=False, exclude=None):
     """
         Given a RequestMeta object contruct a hashkey.
 
@@ -207,7 +375,12 @@ def build_key_signature(request_meta, hash_result=False):
 
             request_meta : RequestMeta
                 Stores request data.
+
+            exclude : list
+                Optional query string keys to leave out of the signature.
     """
+    if exclude is None:
+        exclude = []
     key_sig = list()
 
     # Build the key signature -- These keys must exist
@@ -222,6 +395,8 @@ def build_key_signature(request_meta, hash_result=False):
             return ''
     # These keys may optionally exist
     for key_name in REQUEST_META_QUERY_STR:
+        if key_name in exclude:
+            continue
         if hasattr(request_meta, key_name):
             key = getattr(request_meta, key_name)
             if key:
@@ -252,19 +427,171 @@ def get_url_from_keys(keys, path_root):
     return url
 
 
-def read_pickle_data():
+def build_raw_key_signature(request_meta):
+    """
+        Builds the hash key under which the raw (unaggregated) results of a
+        request are stored.  Requests that differ only in the keys of
+        ``RAW_DATA_EXCLUDE_KEYS`` map to the same key.  The cohort generation
+        timestamp is included so that refreshed cohorts are recomputed.
+    """
+    key_sig = build_key_signature(request_meta, exclude=RAW_DATA_EXCLUDE_KEYS)
+    if not key_sig:
+        return ''
+    key_sig.append('cohort_gen_timestamp' + HASH_KEY_DELIMETER +
+                   str(request_meta.cohort_gen_timestamp))
+    return sha1(str(key_sig).encode('utf-8')).hexdigest()
+
+
+def get_raw_data(request_meta):
+    """
+        Returns the cached raw metric results for a request if they were
+        computed within the last ``RAW_DATA_TTL`` seconds, otherwise None.
+    """
+    key = build_raw_key_signature(request_meta)
+    if not key:
+        return None
+
+    item = read_keyed_data(RAW_DATA_DIR, key)
+    if item is not None:
+        timestamp, results = item
+        if time() - timestamp <= RAW_DATA_TTL:
+            logging.debug(__name__ + ' :: Reusing raw results for '
+                                     'COHORT {0}, METRIC {1}'.
+                          format(request_meta.cohort_expr,
+                                 request_meta.metric))
+            return results
+    return None
+
+
+def set_raw_data(results, request_meta):
+    """
+        Stores the raw metric results of a request.  Expired entries are
+        then removed, followed by the oldest entries until the cache holds
+        at most ``RAW_DATA_MAX_BYTES``.
+    """
+    key = build_raw_key_signature(request_meta)
+    if not key:
+        return
+    try:
+        write_keyed_data((time(), results), RAW_DATA_DIR, key)
+    except (IOError, OSError, cPickle.PicklingError) as e:
+        logging.error(__name__ + ' :: Could not store raw results for '
+                                 'COHORT {0}, METRIC {1}: {2}'.
+                      format(request_meta.cohort_expr, request_meta.metric,
+                             str(e)))
+        return
+    prune_raw_data()
+
+
+def prune_raw_data(max_bytes=RAW_DATA_MAX_BYTES):
+    """
+        Removes raw results older than ``RAW_DATA_TTL`` and then the oldest
+        results until their files total at most ``max_bytes``.
+    """
+    now = time()
+    entries = list()
+    for file_name in glob(_keyed_file(RAW_DATA_DIR, '*')):
+        try:
+            stat = os.stat(file_name)
+        except OSError:
+            # Removed by another job
+            continue
+        if now - stat.st_mtime > RAW_DATA_TTL:
+            _remove_file(file_name)
+        else:
+            entries.append((stat.st_mtime, stat.st_size, file_name))
+
+    total = sum(entry[1] for entry in entries)
+    for mtime, size, file_name in sorted(entries):
+        if total <= max_bytes:
+            break
+        _remove_file(file_name)
+        total -= size
+
+
+def _keyed_file(directory, key):
+    """ Path of the file storing ``key`` in ``directory`` """
+    return '{0}{1}{2}.pkl'.format(settings.__data_file_dir__, directory, key)
+
+
+def read_keyed_data(directory, key):
+    """
+        Returns the object stored under ``key`` in ``directory``, relative
+        to ``__data_file_dir__``, or None if there is none.
+    """
+    return _read_pickle(_keyed_file(directory, key))
+
+
+def write_keyed_data(obj, directory, key):
+    """
+        Stores ``obj`` under ``key`` in ``directory``, relative to
+        ``__data_file_dir__``.  The object is pickled to a temporary file
+        which then replaces the file of the key, so readers see either the
+        previous or the new object.
+    """
+    _write_file(_keyed_file(directory, key),
+                lambda f: cPickle.dump(obj, f, cPickle.HIGHEST_PROTOCOL))
+
+
+def read_pickle_data(file_name=API_DATA_FILE):
+    """
+        Returns the object pickled in ``file_name``, relative to
+        ``__data_file_dir__``, or an empty OrderedDict if there is none.
+    """
+    data = _read_pickle(settings.__data_file_dir__ + file_name)
+    return OrderedDict() if data is None else data
+
+
+def write_pickle_data(obj, file_name=API_DATA_FILE):
+    _write_file(settings.__data_file_dir__ + file_name,
+                lambda f: cPickle.dump(obj, f, cPickle.HIGHEST_PROTOCOL))
+
+
+def _read_pickle(file_name):
+    """
+        Unpickles ``file_name``.  Returns None if the file is missing or
+        can not be unpickled, e.g. as it was left truncated by a crash.
+    """
     try:
-        with open(settings.__data_file_dir__ +
-                  'api_data.pkl', 'rb') as pkl_file:
+        with open(file_name, 'rb') as pkl_file:
             return cPickle.load(pkl_file)
     except IOError:
-        with open(settings.__data_file_dir__ +
-                  'api_data.pkl', 'wb') as pkl_file:
-            data = OrderedDict()
-            cPickle.dump(data, pkl_file)
-            return data
-
-def write_pickle_data(obj):
-    with open(settings.__data_file_dir__ +
-              'api_data.pkl', 'wb') as pkl_file:
-        cPickle.dump(obj, pkl_file)
\ No newline at end of file
+        return None
+    except PICKLE_READ_ERRORS as e:
+        logging.error(__name__ + ' :: Could not read {0}: {1}'.
+                      format(file_name, repr(e)))
+        return None
+
+
+def _write_file(file_name, write):
+    """
+        Writes ``file_name`` by calling ``write`` on a temporary file in the
+        same directory, which is then renamed over ``file_name``.  The
+        rename is atomic so a reader never sees a partly written file.
+    """
+    directory = os.path.dirname(file_name)
+    if not os.path.isdir(directory):
+        try:
+            os.makedirs(directory)
+        except OSError:
+            # Created by another job
+            if not os.path.isdir(directory):
+                raise
+
+    fd, tmp_name = mkstemp(dir=directory, prefix='.tmp_')
+    try:
+        with os.fdopen(fd, 'wb') as tmp_file:
+            write(tmp_file)
+        # ``mkstemp`` creates files readable by their owner only
+        os.chmod(tmp_name, 0644)
+        os.rename(tmp_name, file_name)
+    except:
+        _remove_file(tmp_name)
+        raise
+
+
+def _remove_file(file_name):
+    try:
+        os.remove(file_name)
+    except OSError:
+        pass
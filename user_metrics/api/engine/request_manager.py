@@ -21,6 +21,13 @@
     state.  The job remains in either of these states until it is cleared
     from the process queue.
 
+    Identical requests are coalesced.  Requests are keyed on
+    ``build_key_signature`` and registered in the shared job table
+    before being queued (see ``req_cb_add_req_if_absent``), so a
+    request arriving while an identical one is pending or running attaches
+    to that job rather than starting another.  The job controller applies
+    the same check to the queue itself.
+
     Response Data
     ^^^^^^^^^^^^^
 
@@ -49,6 +56,14 @@
     Request data is mapped to a query via metric objects and hashed in the
     dictionary `api_data`.
 
+    Job status is kept in ``req_notification_jobs``, a dictionary served by
+    a ``multiprocessing.Manager`` and shared by the job controller, the
+    response handler and the views.  The ``req_cb_*`` wrappers read and
+    write it directly.  Running jobs report users processed, intervals
+    completed and queries issued to ``req_progress_jobs`` through
+    ``user_metrics.utils.progress``; ``req_cb_get_progress`` exposes these
+    along with an ETA and any completed time series intervals.
+
     Request Flow Management
     ^^^^^^^^^^^^^^^^^^^^^^^
 
@@ -85,18 +100,20 @@ from user_metrics.config import logging, settings
 from user_metrics.api import MetricsAPIError, error_codes, query_mod, \
     REQ_NCB_LOCK, REQUEST_PATH
 from user_metrics.api.engine.data import get_users, get_url_from_keys, \
-    build_key_signature
-from user_metrics.api.engine.request_meta import rebuild_unpacked_request
+    build_key_signature, get_raw_data, set_raw_data
+from user_metrics.api.engine.request_meta import rebuild_unpacked_request, \
+    get_metric_cost
+from user_metrics.api.engine import check_cohort_expression
 from user_metrics.metrics.users import MediaWikiUser
-from user_metrics.metrics.user_metric import UserMetricError
-from user_metrics.utils import unpack_fields
+from user_metrics.metrics.user_metric import UserMetricError, METRIC_COST
+from user_metrics.utils import unpack_fields, terminate_process_group
+import user_metrics.utils.progress as progress
 
 from multiprocessing import Process, Queue
 from collections import namedtuple
-from os import getpid
+from os import getpid, setpgid
 from sys import getsizeof
-from Queue import Empty
-from time import sleep
+from time import time
 
 
 # API JOB HANDLER
@@ -111,14 +128,19 @@ api_response_queue = Queue()
 #
 # 1. Determines maximum block size of queue item
 # 2. Number of maximum concurrently running jobs
-# 3. Time to block on waiting for a new request to appear in the queue
+# 3. Number of maximum concurrently running jobs of expensive metrics
+# 4. Time to block on waiting for a new request to appear in the queue
+# 5. Wall-clock seconds after which a running job is terminated
 MAX_BLOCK_SIZE = 5000
 MAX_CONCURRENT_JOBS = 1
+MAX_CONCURRENT_EXPENSIVE_JOBS = getattr(settings, '__max_expensive_jobs__', 1)
 QUEUE_WAIT = 5
+JOB_TIMEOUT = getattr(settings, '__job_timeout__', 7200)
 
 
 # Defines the job item type used to temporarily store job progress
-job_item_type = namedtuple('JobItem', 'id process request queue')
+job_item_type = namedtuple('JobItem',
+                           'id process request queue key started expensive')
 
 
 def job_control(request_queue, response_queue):
@@ -137,11 +159,16 @@ def job_control(request_queue, response_queue):
     job_queue = list()
     wait_queue = list()
 
+    # Key signatures of all pending and running jobs
+    in_flight = set()
+
     # Global job ID number
     job_id = 0
 
-    # Tallies the number of concurrently running jobs
+    # Tallies the number of concurrently running jobs, and of those the
+    # jobs computing expensive metrics
     concurrent_jobs = 0
+    expensive_jobs = 0
 
     log_name = '{0} :: {1}'.format(__name__, job_control.__name__)
 
@@ -187,18 +214,74 @@ def job_control(request_queue, response_queue):
                         response_queue.put(data, block=True)
 
                 del job_queue[job_queue.index(job_item)]
+                in_flight.discard(job_item.key)
+
+                # A cancel that arrived as the job completed must not
+                # cancel the next identical request
+                req_cb_clear_cancel(job_item.key)
 
                 concurrent_jobs -= 1
+                expensive_jobs -= job_item.expensive
 
                 logging.debug(log_name + ' :: RUN -> RESPONSE - Job ID {0}' \
                                          '\n\tConcurrent jobs = {1}'
                     .format(str(job_item.id), concurrent_jobs))
 
 
+        # Reclaim cancelled, timed out and dead jobs
+        # -----------------------------------------
+
+        for job_item in job_queue[:]:
+
+            if job_item.key in req_cancel_jobs:
+                error_code = 6
+            elif time() - job_item.started > JOB_TIMEOUT:
+                error_code = 7
+            elif not job_item.process.is_alive() and job_item.queue.empty():
+                error_code = 8
+            else:
+                continue
+
+            # Terminate the job along with any pools and time series
+            # workers it has spawned
+            terminate_process_group(job_item.process)
+
+            job_queue.remove(job_item)
+            in_flight.discard(job_item.key)
+            concurrent_jobs -= 1
+            expensive_jobs -= job_item.expensive
+            end_job(job_item.key, error_code)
+
+            logging.error(log_name + ' :: RUN -> {0} - Job ID {1}' \
+                                     '\n\tConcurrent jobs = {2}'
+                .format(error_codes[error_code], str(job_item.id),
+                        concurrent_jobs))
+
+        for wait_req in wait_queue[:]:
+            key_sig = build_key_signature(wait_req, hash_result=True)
+            if key_sig in req_cancel_jobs:
+                wait_queue.remove(wait_req)
+                in_flight.discard(key_sig)
+                end_job(key_sig, 6)
+
+                logging.debug(log_name + ' :: WAIT -> CANCELLED' \
+                                         '\n\tCOHORT = {0} - METRIC = {1}'
+                    .format(wait_req.cohort_expr, wait_req.metric))
+
+
         # Process pending jobs
         # --------------------
+        #
+        # Jobs of cheap metrics may start ahead of waiting expensive ones
+        # while the limit of expensive jobs is reached
+
+        for wait_req in wait_queue[:]:
+            expensive = get_metric_cost(wait_req.metric) == \
+                METRIC_COST.EXPENSIVE
+            if expensive and \
+                    expensive_jobs >= MAX_CONCURRENT_EXPENSIVE_JOBS:
+                continue
 
-        for wait_req in wait_queue:
             if concurrent_jobs <= MAX_CONCURRENT_JOBS:
                 # prepare job from item
 
@@ -206,12 +289,22 @@ def job_control(request_queue, response_queue):
                 proc = Process(target=process_metrics, args=(req_q, wait_req))
                 proc.start()
 
-                job_item = job_item_type(job_id, proc, wait_req, req_q)
+                # The job leads its own process group so that it can be
+                # terminated along with all of its descendants
+                try:
+                    setpgid(proc.pid, proc.pid)
+                except OSError:
+                    pass
+
+                job_item = job_item_type(job_id, proc, wait_req, req_q,
+                    build_key_signature(wait_req, hash_result=True), time(),
+                    expensive)
                 job_queue.append(job_item)
 
                 del wait_queue[wait_queue.index(wait_req)]
 
                 concurrent_jobs += 1
+                expensive_jobs += expensive
                 job_id += 1
 
                 logging.debug(log_name + ' :: WAIT -> RUN - Job ID {0}' \
@@ -228,14 +321,23 @@ def job_control(request_queue, response_queue):
 
             # Build the request item
             rm = rebuild_unpacked_request(req_item)
+            key_sig = build_key_signature(rm, hash_result=True)
+
+            # An identical request is already pending or running - the
+            # new request is served by that job
+            if key_sig in in_flight:
+                logging.debug(log_name + ' : REQUEST -> COALESCED ' \
+                                         '\n\tCOHORT = {0} - METRIC = {1}'
+                    .format(rm.cohort_expr, rm.metric))
+                continue
 
             logging.debug(log_name + ' : REQUEST -> WAIT ' \
                                      '\n\tCOHORT = {0} - METRIC = {1}'
                 .format(rm.cohort_expr, rm.metric))
             wait_queue.append(rm)
+            in_flight.add(key_sig)
 
             # Communicate with request notification callback about new job
-            key_sig = build_key_signature(rm, hash_result=True)
             url = get_url_from_keys(build_key_signature(rm), REQUEST_PATH)
             req_cb_add_req(key_sig, url, REQ_NCB_LOCK)
 
@@ -243,6 +345,25 @@ def job_control(request_queue, response_queue):
     logging.debug('{0} - FINISHING.'.format(log_name))
 
 
+def is_cohort_expression_valid(cohort_expr):
+    """ Whether a cohort expression passes ``check_cohort_expression`` """
+    try:
+        check_cohort_expression(cohort_expr)
+    except MetricsAPIError:
+        return False
+    return True
+
+
+def end_job(key, error_code):
+    """
+        Flags the job for ``key`` as complete without a response, recording
+        the reason in its progress entry.
+    """
+    req_cb_flag_job_complete(key)
+    progress.set_fields(req_progress_jobs, key, error=error_codes[error_code])
+    req_cb_clear_cancel(key)
+
+
 def process_metrics(p, request_meta):
     """
         Worker process for requests, forked from the job controller.  This
@@ -260,6 +381,16 @@ def process_metrics(p, request_meta):
                             ' -  PID = {2})'.
         format(request_meta.cohort_expr, request_meta.metric, getpid()))
 
+    # Lead a new process group, see ``job_control``
+    try:
+        setpgid(0, 0)
+    except OSError:
+        pass
+
+    # Bind the progress channel for this job and its workers
+    progress.set_channel(req_progress_jobs,
+                         build_key_signature(request_meta, hash_result=True))
+
     err_msg = __name__ + ' :: Request failed.'
     users = list()
 
@@ -288,9 +419,16 @@ def process_metrics(p, request_meta):
             valid = False
             err_msg = error_codes[5]
 
+    # Malformed cohort expressions would otherwise resolve to no users
+    elif not is_cohort_expression_valid(request_meta.cohort_expr):
+        valid = False
+        err_msg = error_codes[11]
+
     # "TYPICAL" COHORT PROCESSING
     else:
         users = get_users(request_meta.cohort_expr)
+        logging.info(__name__ + ' :: Cohort {0} resolved to {1} users.'.
+                     format(request_meta.cohort_expr, len(users)))
 
         # Default project is what is stored in usertags_meta
         project = query_mod.get_cohort_project_by_meta(
@@ -304,8 +442,19 @@ def process_metrics(p, request_meta):
         err_msg = ''
 
     if valid:
-        # process request
-        results = process_data_request(request_meta, users)
+        progress.set_totals(users_total=len(users))
+
+        # process request - the registration dates and revisions of the
+        # users are looked up once and shared by the metrics of the job.
+        # The revisions are loaded only if a metric is processed, i.e. not
+        # when its raw results are cached.
+        with shared_registration_dates(), \
+                shared_revision_frame(
+                    lambda: load_revision_frame(request_meta, users)):
+            if get_request_type(request_meta) == request_types.combined:
+                results = process_combined_request(request_meta, users)
+            else:
+                results = process_data_request(request_meta, users)
         results = str(results)
         response_size = getsizeof(results, None)
 
@@ -340,6 +489,8 @@ def process_metrics(p, request_meta):
 
 from dateutil.parser import parse as date_parse
 from copy import deepcopy
+from collections import OrderedDict
+from math import ceil
 
 from user_metrics.etl.data_loader import DataLoader
 import user_metrics.metrics.user_metric as um
@@ -348,7 +499,14 @@ from user_metrics.api.engine.request_meta import ParameterMapping
 from user_metrics.api.engine.response_meta import format_response
 from user_metrics.api.engine import DATETIME_STR_FORMAT
 from user_metrics.api.engine.request_meta import get_agg_key, \
-    get_aggregator_type, request_types
+    get_aggregator_type, request_types, get_request_type, split_request, \
+    get_metric_type
+from user_metrics.metrics.users import USER_METRIC_PERIOD_TYPE, \
+    get_registration_dates, shared_registration_dates
+from user_metrics.metrics.revision_frame import RevisionFrame, \
+    shared_revision_frame, get_revision_frame
+from user_metrics.utils import format_mediawiki_timestamp
+from datetime import datetime, timedelta
 
 INTERVALS_PER_THREAD = 10
 MAX_THREADS = 5
@@ -409,6 +567,14 @@ def process_data_request(request_meta, users):
         time_threads = max(1, int(total_intervals / INTERVALS_PER_THREAD))
         time_threads = min(MAX_THREADS, time_threads)
 
+        results['header'] = ['timestamp'] + \
+                            getattr(aggregator_func,
+                                    um.METRIC_AGG_METHOD_HEAD)
+        progress.set_totals(
+            intervals_total=int(ceil(total_intervals)),
+            users_total=len(users) * int(ceil(total_intervals)),
+            header=results['header'])
+
         logging.info(__name__ + ' :: Initiating time series for %(metric)s\n'
                                 '\tAGGREGATOR = %(agg)s\n'
                                 '\tFROM: %(start)s,\tTO: %(end)s.' %
@@ -424,6 +590,10 @@ def process_data_request(request_meta, users):
 
         new_kwargs = deepcopy(args)
 
+        # Load the revision frame before the time series workers are forked
+        # so that they share it
+        get_revision_frame()
+
         del new_kwargs['slice']
         del new_kwargs['aggregator']
         del new_kwargs['datetime_start']
@@ -440,13 +610,7 @@ def process_data_request(request_meta, users):
             log=True,
             **new_kwargs)
 
-        results['header'] = ['timestamp'] + \
-                            getattr(aggregator_func,
-                                    um.METRIC_AGG_METHOD_HEAD)
-        for row in out:
-            timestamp = date_parse(row[0][:19]).strftime(
-                DATETIME_STR_FORMAT)
-            results['data'][timestamp] = row[3:]
+        results['data'] = format_time_series_rows(out, results['data'])
 
     elif results['type'] == request_types.aggregator:
 
@@ -467,12 +631,9 @@ def process_data_request(request_meta, users):
                                     'end': str(end),
                                     })
 
+        progress.set_totals(users_total=len(users))
         try:
-            metric_obj.process(users,
-                               k_=USER_THREADS,
-                               kr_=REVISION_THREADS,
-                               log_=True,
-                               **args)
+            process_metric_obj(metric_obj, request_meta, users, args)
         except UserMetricError as e:
             logging.error(__name__ + ' :: Metrics call failed: ' + str(e))
             results['data'] = str(e)
@@ -491,12 +652,9 @@ def process_data_request(request_meta, users):
                                     'start': str(start),
                                     'end': str(end),
                                     })
+        progress.set_totals(users_total=len(users))
         try:
-            metric_obj.process(users,
-                               k_=USER_THREADS,
-                               kr_=REVISION_THREADS,
-                               log_=True,
-                               **args)
+            process_metric_obj(metric_obj, request_meta, users, args)
         except UserMetricError as e:
             logging.error(__name__ + ' :: Metrics call failed: ' + str(e))
             results['data'] = str(e)
@@ -508,164 +666,239 @@ def process_data_request(request_meta, users):
     return results
 
 
-# REQUEST NOTIFICATIONS
-# #####################
+def process_combined_request(request_meta, users):
+    """
+        Prepares results for a request combining several metrics over one
+        cohort, e.g. ``edit_count,edit_rate``.  Each metric is computed in
+        turn by ``process_data_request`` and its results are keyed by metric
+        handle.  The registration dates of the users are looked up once for
+        all metrics, and a metric also processed as part of another, such as
+        the EditCount computed by EditRate, is processed once.
+    """
+    results = OrderedDict()
+    results['type'] = request_types.combined
+    results['cohort'] = str(request_meta.cohort_expr)
+    results['cohort_last_generated'] = str(request_meta.cohort_gen_timestamp)
+    results['time_of_response'] = datetime.now().strftime(DATETIME_STR_FORMAT)
+    results['metric'] = str(request_meta.metric)
+    results['data'] = OrderedDict()
+
+    key = build_key_signature(request_meta, hash_result=True)
+
+    with shared_registration_dates(), um.shared_results():
+
+        # Look up registration dates before metrics fork their workers so
+        # that the workers share them
+        if request_meta.group != USER_METRIC_PERIOD_TYPE.INPUT:
+            get_registration_dates(users, request_meta.project)
+
+        for metric_request in split_request(request_meta):
+            logging.info(__name__ + ' :: Combined request for {0} - '
+                                    'computing {1}.'.format(
+                                        request_meta.metric,
+                                        metric_request.metric))
+
+            # Progress is reported for the metric being computed
+            progress.flush()
+            progress.set_fields(req_progress_jobs, key,
+                                metric=metric_request.metric, users=0,
+                                intervals=0, partial=list())
+
+            results['data'][metric_request.metric] = \
+                process_data_request(metric_request, users)
 
-from collections import OrderedDict
+    return results
 
-req_notification_queue_in = Queue()
-req_notification_queue_out = Queue()
 
-request_msg_type = namedtuple('RequestMessage', 'type hash url is_alive')
+def load_revision_frame(request_meta, users):
+    """
+        Loads the revisions of ``users`` over the periods of the metrics of
+        the request that compute from a ``RevisionFrame``.  Returns None if
+        there are no such metrics or the frame is not loaded.
+    """
+    start = end = None
+    for metric_request in split_request(request_meta):
+        metric_class = get_metric_type(metric_request.metric)
+        if not metric_class._revision_frame:
+            continue
 
+        metric_obj = metric_class(**ParameterMapping.map(metric_request))
+        metric_start = date_parse(format_mediawiki_timestamp(
+            metric_obj.datetime_start))
+        metric_end = date_parse(format_mediawiki_timestamp(
+            metric_obj.datetime_end))
 
-def requests_notification_callback(msg_queue_in, msg_queue_out):
+        # Registration periods end up to ``t`` hours after the range
+        if metric_obj.group != USER_METRIC_PERIOD_TYPE.INPUT:
+            metric_end += timedelta(hours=int(metric_obj.t))
+
+        start = min(start, metric_start) if start else metric_start
+        end = max(end, metric_end) if end else metric_end
+
+    if start is None or not users:
+        return None
+    try:
+        return RevisionFrame.load(users, request_meta.project, start, end)
+    except query_mod.UMQueryCallError as e:
+        logging.error(__name__ + ' :: Could not load revision frame: ' +
+                      str(e))
+        return None
+
+
+def format_time_series_rows(rows, data=None):
     """
-        Asynchronous callback.  Tracks status of requests and new requests.
-        This callback utilizes ``msg_queue_in`` & ``msg_queue_out`` to
-        manage request status.
+        Formats the rows produced by ``tspm.build_time_series`` as response
+        data mapping the interval timestamp to the aggregate values.
     """
-    log_name = '{0} :: {1}'.format(__name__,
-                                   requests_notification_callback.__name__)
-    logging.debug('{0}  - STARTING...'.format(log_name))
+    if data is None:
+        data = OrderedDict()
+    for row in rows:
+        timestamp = date_parse(row[0][:19]).strftime(
+            DATETIME_STR_FORMAT)
+        data[timestamp] = row[3:]
+    return data
 
-    # TODO - potentially extend with an in-memory cache
-    job_list = OrderedDict()
-    while 1:
 
-        try:
-            msg = msg_queue_in.get(True)
-        except IOError as e:
-            logging.error(__name__ + ' :: Could not block '
-                                     'on in queue: "{0}"'.format(e.message))
-            sleep(1)
-            continue
+def process_metric_obj(metric_obj, request_meta, users, args):
+    """
+        Populates the results of ``metric_obj`` for a raw or aggregate
+        request.  Raw results computed recently for a request that differs
+        only by aggregator are reused, otherwise the metric is processed and
+        its results are cached for subsequent requests.
+    """
+    raw_results = get_raw_data(request_meta)
+    if raw_results is not None:
+        metric_obj._results = raw_results
+        return metric_obj
+
+    metric_obj.process(users,
+                       k_=USER_THREADS,
+                       kr_=REVISION_THREADS,
+                       log_=True,
+                       **args)
+    if um.COLUMNAR_RESULTS:
+        metric_obj.to_columnar()
+    set_raw_data(metric_obj._results, request_meta)
+    return metric_obj
 
-        try:
-            type = msg[0]
-        except (KeyError, ValueError):
-            logging.error(log_name + ' - No valid type ' \
-                                     '{0}'.format(str(msg)))
-            continue
 
-        # Init request
-        if type == 0:
-            try:
-                job_list[msg[1]] = [True, msg[2]]
-                logging.debug(log_name + ' - Initialize Request: ' \
-                                         '{0}.'.format(str(msg)))
-            except Exception:
-                logging.error(log_name + ' - Initialize Request' \
-                                         ' failed: {0}'.format(str(msg)))
-
-        # Flag request complete - leave on queue
-        elif type == 1:
-            try:
-                job_list[msg[1]][0] = False
-                logging.debug(log_name + ' - Set request finished: ' \
-                                         '{0}.\n'.format(str(msg)))
-            except Exception:
-                logging.error(log_name + ' - Set request finished failed: ' \
-                                         '{0}\n'.format(str(msg)))
-
-        # Is the key in the cache and running?
-        elif type == 2:
-            try:
-                if msg[1] in job_list:
-                    msg_queue_out.put([job_list[msg[1]][0]], True)
-                else:
-                    msg_queue_out.put([False], True)
-                logging.debug(log_name + ' - Get request alive: ' \
-                                         '{0}.'.format(str(msg)))
-            except (KeyError, ValueError):
-                logging.error(log_name + ' - Get request alive failed: ' \
-                                         '{0}'.format(str(msg)))
-
-        # Get keys
-        elif type == 3:
-            msg_queue_out.put(job_list.keys(), True)
-
-        # Get url
-        elif type == 4:
-            try:
-                if msg[1] in job_list:
-                    msg_queue_out.put([job_list[msg[1]][1]], True)
-                else:
-                    logging.error(log_name + ' - Get URL failed: {0}'.
-                    format(str(msg)))
-            except (KeyError, ValueError):
-                logging.error(log_name + ' - Get URL failed: {0}'.format(str(msg)))
-        else:
-            logging.error(log_name + ' - Bad message: {0}'.format(str(msg)))
+# REQUEST NOTIFICATIONS
+# #####################
 
-    logging.debug('{0}  - SHUTTING DOWN...'.format(log_name))
+from multiprocessing import Manager
 
+# Job status is held in a dictionary served by a manager process.  Every
+# process forked from the API (job controller, response handler and the
+# flask views) reads and writes it directly through its proxy, so a status
+# lookup is a single call on the shared dictionary.  Entries are keyed by
+# request key signature and take the form ``(is_alive, url, timestamp)``.
+#
+# Values are replaced rather than mutated in place as changes to nested
+# objects are not propagated by the manager.
 
-# Wrapper Methods for working with Request Notifications
-# Use locks to enforce atomicity
+req_notification_manager = Manager()
+req_notification_jobs = req_notification_manager.dict()
 
-BLOCK_TIMEOUT = 1
+# Progress reported by running jobs, see ``user_metrics.utils.progress``
+req_progress_jobs = req_notification_manager.dict()
 
+# Keys of jobs flagged for cancellation, consumed by ``job_control``
+req_cancel_jobs = req_notification_manager.dict()
 
-def req_cb_get_url(key, lock):
-    lock.acquire()
-    req_notification_queue_in.put([4, key], block=True)
+
+# Wrapper Methods for working with Request Notifications
+#
+# Reads and single writes are atomic on the shared dictionary.  Locks are
+# only taken for compound check-and-set operations.
+
+
+def req_cb_get_url(key, lock=None):
     try:
-        val = req_notification_queue_out.get(True, timeout=BLOCK_TIMEOUT)[0]
-    except Empty:
+        return req_notification_jobs[key][1]
+    except KeyError:
         logging.error(__name__ + ' :: req_cb_get_url -'
-                                 ' Block time expired.')
-        val = ''
-    finally:
-        lock.release()
-    return val
+                                 ' No such request "{0}".'.format(key))
+        return ''
 
 
-def req_cb_get_cache_keys(lock):
-    lock.acquire()
-    req_notification_queue_in.put([3], block=True)
+def req_cb_get_cache_keys(lock=None):
+    return [job[0] for job in req_cb_get_jobs(lock)]
+
+
+def req_cb_get_jobs(lock=None):
+    """
+        Returns the list of ``(key, is_alive, url)`` tuples for all requests
+        in the order that they were added.  The job table is copied from
+        the manager in a single call.
+    """
+    jobs = sorted(req_notification_jobs.items(), key=lambda x: x[1][2])
+    return [(key, job[0], job[1]) for key, job in jobs]
+
+
+def req_cb_get_is_running(key, lock=None):
     try:
-        val =  req_notification_queue_out.get(block=True,
-                                              timeout=BLOCK_TIMEOUT)
-    except Empty:
-        logging.error(__name__ + ' :: req_cb_get_cache_keys -'
-                                 ' Block time expired.')
-        val = []
-    finally:
-        lock.release()
-    return val
+        return req_notification_jobs[key][0]
+    except KeyError:
+        return False
+
 
+def req_cb_add_req(key, url, lock=None):
+    req_notification_jobs[key] = (True, url, time())
 
-def req_cb_get_is_running(key, lock):
+
+def req_cb_add_req_if_absent(key, url, lock):
+    """
+        Registers a request unless an identical request is already running.
+        Returns True if the request was registered and should be queued.
+    """
     lock.acquire()
-    req_notification_queue_in.put([2, key], True)
     try:
-        val =  req_notification_queue_out.get(block=True,
-                                              timeout=BLOCK_TIMEOUT)[0]
-    except Empty:
-        logging.error(__name__ + ' :: req_cb_get_is_running -'
-                                 ' Block time expired.')
-        val = False
+        if req_cb_get_is_running(key):
+            return False
+        req_cb_add_req(key, url)
+        return True
     finally:
         lock.release()
-    return val
 
 
-def req_cb_add_req(key, url, lock):
-    lock.acquire()
+def req_cb_get_progress(key, partial=False):
+    """
+        Returns the progress of the job for ``key``.  If ``partial`` is set
+        the completed time series intervals are included as ``data``.
+    """
+    job = progress.get_progress(req_progress_jobs, key, partial=partial)
+    if job and partial:
+        job['data'] = format_time_series_rows(sorted(job.pop('partial')))
+    return job
+
+
+def req_cb_cancel_job(key):
+    """
+        Flags a pending or running job for cancellation.  Returns False if
+        the job is not running.
+    """
+    if not req_cb_get_is_running(key):
+        return False
+    req_cancel_jobs[key] = time()
+    return True
+
+
+def req_cb_clear_cancel(key):
+    """ Removes the cancellation flag of a job, if any """
     try:
-        req_notification_queue_in.put([0, key, url])
-    except Empty:
+        del req_cancel_jobs[key]
+    except KeyError:
         pass
-    finally:
-        lock.release()
 
 
-def req_cb_flag_job_complete(key, lock):
-    lock.acquire()
+def req_cb_flag_job_complete(key, lock=None):
     try:
-        req_notification_queue_in.put([1, key], True)
-    except Empty:
-        pass
-    finally:
-        lock.release()
+        job = req_notification_jobs[key]
+    except KeyError:
+        logging.error(__name__ + ' :: req_cb_flag_job_complete -'
+                                 ' No such request "{0}".'.format(key))
+        return
+    req_notification_jobs[key] = (False, job[1], job[2])
+
+    # Partial results are superseded by the full response
+    progress.clear_partial(req_progress_jobs, key)
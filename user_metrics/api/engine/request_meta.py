@@ -41,10 +41,12 @@ from user_metrics.utils.record_type import recordtype
 from user_metrics.api import MetricsAPIError
 from user_metrics.api.engine import DEFAULT_QUERY_VAL
 from user_metrics.metrics.users import USER_METRIC_PERIOD_TYPE
+from user_metrics.etl.time_series_process_methods import WINDOW_TYPES
 from collections import namedtuple, OrderedDict
 from flask import escape
 from user_metrics.config import logging
 from user_metrics.utils import unpack_fields
+import user_metrics.metrics.user_metric as um
 
 
 # DEFINE REQUEST META OBJECT, CREATION, AND PROCESSING
@@ -61,6 +63,25 @@ REQUEST_VALUE_MAPPING = {
     }
 }
 
+# Separates the metric handles of a request combining several metrics over
+# one cohort, e.g. ``/cohorts/<cohort>/edit_count,edit_rate``
+METRIC_DELIMITER = ','
+
+
+def get_metric_handles(metric_expr):
+    """
+        Returns the handles of the metrics requested by ``metric_expr``, in
+        order and without duplicates.  Requests for a single metric have a
+        single handle.
+    """
+    handles = list()
+    for handle in str(metric_expr).split(METRIC_DELIMITER):
+        handle = handle.strip()
+        if handle and handle not in handles:
+            handles.append(handle)
+    return handles
+
+
 def RequestMetaFactory(cohort_expr, cohort_gen_timestamp, metric_expr):
     """
         Dynamically builds a record type given a metric handle
@@ -71,16 +92,26 @@ def RequestMetaFactory(cohort_expr, cohort_gen_timestamp, metric_expr):
             **cohort_expr**             - string. Cohort id from url.
             **cohort_gen_timestamp**    - string. Timestamp of last cohort
             update.
-            **metric_expr**             - string. Metric id from url.
+            **metric_expr**             - string. Metric id from url.  A
+            combined request lists several metric handles separated by
+            ``METRIC_DELIMITER`` and accepts the parameters of each.
     """
     default_params = 'cohort_expr cohort_gen_timestamp metric '
     additional_params = ''
 
+    metric_params = list()
     try:
-        metric_params = ParameterMapping.QUERY_PARAMS_BY_METRIC[metric_expr]
+        for handle in get_metric_handles(metric_expr):
+            for mapping in ParameterMapping.get_params(handle):
+                if mapping.query_var not in [param.query_var for param in
+                                             metric_params]:
+                    metric_params.append(mapping)
     except KeyError:
         raise MetricsAPIError('Bad metric name.', error_code=4)
 
+    if not metric_params:
+        raise MetricsAPIError('Bad metric name.', error_code=4)
+
     for val in metric_params:
         additional_params += val.query_var + ' '
     additional_params = additional_params[:-1]
@@ -88,17 +119,39 @@ def RequestMetaFactory(cohort_expr, cohort_gen_timestamp, metric_expr):
 
     arg_list = ['cohort_expr', 'cohort_gen_timestamp', 'metric_expr'] +\
                ['None'] * \
-               len(ParameterMapping.QUERY_PARAMS_BY_METRIC[metric_expr])
+               len(metric_params)
     arg_str = "(" + ",".join(arg_list) + ")"
 
     rt = recordtype("RequestMeta", params)
     return eval('rt' + arg_str)
 
+
+def split_request(request_meta):
+    """
+        Returns a RequestMeta for each metric of a combined request holding
+        the parameters of the request accepted by that metric.  The
+        aggregator is kept only for metrics that define it, the others
+        return raw results.
+    """
+    fields = unpack_fields(request_meta)
+    requests = list()
+    for handle in get_metric_handles(request_meta.metric):
+        rm = RequestMetaFactory(request_meta.cohort_expr,
+                                request_meta.cohort_gen_timestamp, handle)
+        for key in fields:
+            if key != 'metric' and hasattr(rm, key):
+                setattr(rm, key, fields[key])
+        if not get_agg_key(rm.aggregator, handle):
+            rm.aggregator = None
+        requests.append(rm)
+    return requests
+
 # Defines what variables may be extracted from the query string
 REQUEST_META_QUERY_STR = ['aggregator', 'time_series', 'project', 'namespace',
                           'start', 'end', 'slice', 't', 'n',
                           'time_unit', 'time_unit_count', 'look_ahead',
-                          'look_back', 'threshold_type', 'group', 'is_user']
+                          'look_back', 'threshold_type', 'group', 'is_user',
+                          'window', 'window_len']
 
 # Defines which variables may be taken from the URL path
 REQUEST_META_BASE = ['cohort_expr', 'metric']
@@ -140,10 +193,23 @@ def format_request_params(request_meta):
     if not request_meta.group in REQUEST_VALUE_MAPPING:
         request_meta.group = DEFAULT_GROUP
 
-    # set the aggregator if there is one
-    agg_key = get_agg_key(request_meta.aggregator, request_meta.metric)
+    # Time series windows must be of a known type and span at least one
+    # interval
+    if request_meta.window and request_meta.window not in WINDOW_TYPES:
+        raise MetricsAPIError(error_code=10)
+    if request_meta.window_len:
+        try:
+            request_meta.window_len = int(request_meta.window_len)
+        except ValueError:
+            raise MetricsAPIError(error_code=10)
+        if request_meta.window_len < 1:
+            raise MetricsAPIError(error_code=10)
+
+    # set the aggregator if there is one for any of the metrics
+    agg_keys = [get_agg_key(request_meta.aggregator, handle)
+                for handle in get_metric_handles(request_meta.metric)]
     request_meta.aggregator = escape(request_meta.aggregator)\
-        if agg_key else None
+        if any(agg_keys) else None
     # @TODO Escape remaining input
 
     # MAP request values.
@@ -265,26 +331,20 @@ class ParameterMapping(object):
                      varMapping('aggregator', 'aggregator'),
                      varMapping('t', 't'),
                      varMapping('group', 'group'),
-                     varMapping('is_user', 'is_user')]
-
-    QUERY_PARAMS_BY_METRIC = {
-        'blocks': common_params,
-        'bytes_added': common_params,
-        'edit_count': common_params,
-        'edit_rate': common_params + [varMapping('time_unit', 'time_unit'),
-                                      varMapping('time_unit_count',
-                                                 'time_unit_count')],
-        'live_account': common_params,
-        'namespace_edits': common_params,
-        'revert_rate': common_params + [varMapping('look_back', 'look_back'),
-                                        varMapping('look_ahead',
-                                                   'look_ahead')],
-        'survival': common_params,
-        'pages_created': common_params,
-        'threshold': common_params + [varMapping('n', 'n')],
-        'time_to_threshold': common_params +
-        [varMapping('threshold_type', 'threshold_type_class')],
-    }
+                     varMapping('is_user', 'is_user'),
+                     varMapping('window', 'window'),
+                     varMapping('window_len', 'window_len')]
+
+    @classmethod
+    def get_params(cls, metric_handle):
+        """
+            Returns the parameter mappings of the metric registered under
+            ``metric_handle``: those common to all metrics followed by those
+            it registers.  Raises ``KeyError`` for unknown metrics.
+        """
+        return cls.common_params + [
+            cls.varMapping(*mapping)
+            for mapping in metric_dict[metric_handle]._query_params]
 
     @staticmethod
     def map(request_meta):
@@ -295,8 +355,7 @@ class ParameterMapping(object):
         args = unpack_fields(request_meta)
         new_args = OrderedDict()
 
-        for mapping in ParameterMapping.\
-                QUERY_PARAMS_BY_METRIC[request_meta.metric]:
+        for mapping in ParameterMapping.get_params(request_meta.metric):
             new_args[mapping.metric_var] = args[mapping.query_var]
         return new_args
 
@@ -304,59 +363,13 @@ class ParameterMapping(object):
 # DEFINE METRIC AND AGGREGATOR ENUMS ALLOWABLE IN REQUESTS
 # ########################################################
 
-from user_metrics.metrics.threshold import Threshold, threshold_editors_agg
-from user_metrics.metrics.blocks import Blocks, block_rate_agg
-from user_metrics.metrics.bytes_added import BytesAdded, ba_median_agg, \
-    ba_min_agg, ba_max_agg, ba_sum_agg, ba_mean_agg, ba_std_agg
-from user_metrics.metrics.survival import Survival, survival_editors_agg
-from user_metrics.metrics.revert_rate import RevertRate, revert_rate_avg
-from user_metrics.metrics.time_to_threshold import TimeToThreshold, \
-    ttt_avg_agg, ttt_stats_agg
-from user_metrics.metrics.edit_rate import EditRate, edit_rate_agg, \
-    er_stats_agg
-from user_metrics.metrics.namespace_of_edits import NamespaceEdits, \
-    namespace_edits_sum
-from user_metrics.metrics.live_account import LiveAccount, live_accounts_agg
-from user_metrics.metrics.pages_created import PagesCreated
-
+# Metrics are declared in ``um.metric_registry`` by the path of their class
+# so that listing or checking metric handles imports no metric module.  The
+# module of a metric, which registers its aggregators, is imported when the
+# metric or one of its aggregators is first looked up.
 
 # Registered metrics types
-metric_dict =\
-    {
-    'threshold': Threshold,
-    'survival': Survival,
-    'revert_rate': RevertRate,
-    'bytes_added': BytesAdded,
-    'blocks': Blocks,
-    'time_to_threshold': TimeToThreshold,
-    'edit_rate': EditRate,
-    'namespace_edits': NamespaceEdits,
-    'live_account': LiveAccount,
-    'pages_created': PagesCreated,
-    }
-
-# @TODO: let metric types handle this mapping themselves and obsolete this
-#            structure
-aggregator_dict =\
-    {
-    'sum+bytes_added': ba_sum_agg,
-    'mean+bytes_added': ba_mean_agg,
-    'std+bytes_added': ba_std_agg,
-    'sum+namespace_edits': namespace_edits_sum,
-    'proportion+threshold': threshold_editors_agg,
-    'proportion+survival': survival_editors_agg,
-    'proportion+live_account': live_accounts_agg,
-    'mean+revert_rate': revert_rate_avg,
-    'mean+edit_rate': edit_rate_agg,
-    'mean+time_to_threshold': ttt_avg_agg,
-    'median+bytes_added': ba_median_agg,
-    'min+bytes_added': ba_min_agg,
-    'max+bytes_added': ba_max_agg,
-    'dist+edit_rate': er_stats_agg,
-    'proportion+blocks': block_rate_agg,
-    'dist+time_to_threshold': ttt_stats_agg,
-    'dist+pages_created': ttt_stats_agg,
-    }
+metric_dict = um.metric_registry
 
 
 def get_metric_type(metric):
@@ -364,8 +377,10 @@ def get_metric_type(metric):
 
 
 def get_aggregator_type(agg):
+    """ Returns the aggregator keyed on '<aggregator>+<metric>' """
+    agg_handle, _, metric_handle = agg.partition('+')
     try:
-        return aggregator_dict[agg]
+        return metric_dict[metric_handle].get_aggregator(agg_handle)
     except KeyError:
         raise MetricsAPIError(__name__ + ' :: Bad aggregator name.')
 
@@ -376,8 +391,26 @@ def get_metric_names():
 
 
 def get_aggregator_names():
-    """ Returns the names of metric handles as defined by this module """
-    return aggregator_dict.keys()
+    """
+        Returns the '<aggregator>+<metric>' keys of the registered
+        aggregators.  This imports every metric module.
+    """
+    return ['+'.join([agg_handle, metric_handle])
+            for metric_handle in metric_dict
+            for agg_handle in sorted(metric_dict[metric_handle]._aggregators)]
+
+
+def get_metric_cost(metric_expr):
+    """
+        Returns the cost class of the metrics of a request, one of
+        ``um.METRIC_COST``.  Combined requests are as expensive as their
+        most expensive metric.
+    """
+    costs = [metric_dict[handle]._cost
+             for handle in get_metric_handles(metric_expr)]
+    if um.METRIC_COST.EXPENSIVE in costs:
+        return um.METRIC_COST.EXPENSIVE
+    return um.METRIC_COST.CHEAP
 
 
 def get_param_types(metric_handle):
@@ -388,9 +421,9 @@ def get_param_types(metric_handle):
 def get_agg_key(agg_handle, metric_handle):
     """ Compose the metric dependent aggregator handle """
     try:
-        agg_key = '+'.join([agg_handle, metric_handle])
-        if agg_key in aggregator_dict:
-            return agg_key
+        if metric_handle in metric_dict and \
+                agg_handle in metric_dict[metric_handle]._aggregators:
+            return '+'.join([agg_handle, metric_handle])
         else:
             return ''
     except TypeError:
@@ -403,12 +436,15 @@ def get_agg_key(agg_handle, metric_handle):
 # Enumeration to store request types
 request_types = enum(time_series='time_series',
     aggregator='aggregator',
-    raw='raw')
+    raw='raw',
+    combined='combined')
 
 
 def get_request_type(request_meta):
     """ Determines request type. """
-    if request_meta.aggregator and request_meta.time_series \
+    if len(get_metric_handles(request_meta.metric)) > 1:
+        return request_types.combined
+    elif request_meta.aggregator and request_meta.time_series \
        and request_meta.group and request_meta.slice and request_meta.start \
        and request_meta.end:
         return request_types.time_series
@@ -26,7 +26,7 @@ RESPONSE_TIMEOUT = 0.1
 # ####################
 
 
-def process_responses(response_queue, msg_in):
+def process_responses(response_queue):
     """ Pulls responses off of the queue. """
 
     log_name = '{0} :: {1}'.format(__name__, process_responses.__name__)
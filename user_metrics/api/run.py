@@ -47,16 +47,15 @@ import multiprocessing as mp
 
 from user_metrics.config import logging, settings
 from user_metrics.api.engine.request_manager import job_control, \
-    requests_notification_callback
+    req_notification_manager
 from user_metrics.api.engine.response_handler import process_responses
 from user_metrics.api.views import app
 from user_metrics.api.engine.request_manager import api_request_queue, \
-    req_notification_queue_out, req_notification_queue_in, api_response_queue
+    api_response_queue
 from user_metrics.utils import terminate_process_with_checks
 
 job_controller_proc = None
 response_controller_proc = None
-rm_callback_proc = None
 
 
 ######
@@ -74,27 +73,22 @@ def teardown():
     try:
         terminate_process_with_checks(job_controller_proc)
         terminate_process_with_checks(response_controller_proc)
-        terminate_process_with_checks(rm_callback_proc)
+        req_notification_manager.shutdown()
 
     except Exception:
         logging.error(__name__ + ' :: Could not shut down callbacks.')
 
 
-def setup_controller(req_queue, res_queue, msg_queue_in, msg_queue_out):
+def setup_controller(req_queue, res_queue):
     """
         Sets up the process that handles API jobs
     """
     job_controller_proc = mp.Process(target=job_control,
                                      args=(req_queue, res_queue))
     response_controller_proc = mp.Process(target=process_responses,
-                                          args=(res_queue,
-                                                msg_queue_in))
-    rm_callback_proc = mp.Process(target=requests_notification_callback,
-                                  args=(msg_queue_in,
-                                        msg_queue_out))
+                                          args=(res_queue,))
     job_controller_proc.start()
     response_controller_proc.start()
-    rm_callback_proc.start()
 
 ######
 #
@@ -104,8 +98,7 @@ def setup_controller(req_queue, res_queue, msg_queue_in, msg_queue_out):
 
 # initialize API data - get the instance
 
-setup_controller(api_request_queue, api_response_queue,
-                 req_notification_queue_in, req_notification_queue_out)
+setup_controller(api_request_queue, api_response_queue)
 
 app.config['SECRET_KEY'] = settings.__secret_key__
 
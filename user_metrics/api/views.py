@@ -25,13 +25,16 @@ from user_metrics.utils import unpack_fields
 from user_metrics.api.engine.data import get_cohort_refresh_datetime, \
     get_data, get_url_from_keys, build_key_signature, read_pickle_data
 from user_metrics.api import MetricsAPIError, error_codes, query_mod, \
-    REQ_NCB_LOCK
+    REQ_NCB_LOCK, REQUEST_PATH
 from user_metrics.api.engine.request_meta import filter_request_input, \
     format_request_params, RequestMetaFactory, \
     get_metric_names
 from user_metrics.api.engine.request_manager import api_request_queue, \
-    req_cb_get_cache_keys, req_cb_get_url, req_cb_get_is_running
+    req_cb_get_jobs, req_cb_add_req_if_absent, req_cb_get_progress, \
+    req_cb_get_is_running, req_cb_get_url, req_cb_cancel_job
+from user_metrics.api.engine import check_cohort_expression
 from user_metrics.metrics.users import MediaWikiUser
+import user_metrics.metrics.users as users_mod
 from user_metrics.api.session import APIUser
 
 # Instantiate flask app
@@ -173,6 +176,37 @@ def all_cohorts():
         return render_template('all_cohorts.html', data=o, error=error)
 
 
+def upload_cohort():
+    """ View creating a cohort from an uploaded CSV or TSV file of user ids,
+        posted as ``users`` along with the cohort ``name``, ``project`` and
+        optional ``notes``.  Responds with the number of users added. """
+
+    name = request.form.get('name', '')
+    project = request.form.get('project', 'enwiki')
+    users = request.files.get('users')
+
+    if not name or users is None:
+        response = make_response(jsonify(error=error_codes[12],
+                                         message='Missing cohort name or '
+                                                 'users file.'))
+        response.status_code = 400
+        return response
+
+    try:
+        count = users_mod.upload_cohort(name, users.stream, project,
+                                        notes=request.form.get('notes', ''))
+    except (users_mod.MediaWikiUserException,
+            query_mod.UMQueryCallError) as e:
+        logging.error(__name__ + ' :: Could not upload cohort "{0}": {1}'.
+                      format(name, str(e)))
+        response = make_response(jsonify(error=error_codes[12],
+                                         message=str(e)))
+        response.status_code = 400
+        return response
+
+    return make_response(jsonify(cohort=name, project=project, users=count))
+
+
 def cohort(cohort=''):
     """ View single cohort page """
     error = get_errors(request.args)
@@ -229,34 +263,65 @@ def output(cohort, metric):
                                      'in "{1}"'.format(cohort, project))
             return redirect(url_for('all_cohorts') + '?error=3')
     else:
-        # @TODO CALL COHORT VALIDATION HERE
-        pass
+        try:
+            check_cohort_expression(cohort)
+        except MetricsAPIError as e:
+            logging.error(__name__ + ' :: "{0}" is not a valid cohort '
+                                     'expression.'.format(cohort))
+            return redirect(url_for('all_cohorts') + '?error=' +
+                            str(e.error_code))
 
     # Determine if the request maps to an existing response.
     #
     # 1. The response already exists in the hash, return.
-    # 2. Otherwise, add the request tot the queue.
+    # 2. An identical request is running, attach to it.
+    # 3. Otherwise, add the request tot the queue.
     data = get_data(rm)
     key_sig = build_key_signature(rm, hash_result=True)
 
-    # Is the request already running?
-    is_running = req_cb_get_is_running(key_sig, REQ_NCB_LOCK)
-
     # Determine if request is already hashed
     if data and not refresh:
         return make_response(jsonify(data))
 
-    # Determine if the job is already running
-    elif is_running:
+    # Register the job before queueing it so that identical requests
+    # arriving in the meantime are coalesced with this one
+    url = get_url_from_keys(build_key_signature(rm), REQUEST_PATH)
+    status_url = url_for('job_status', key=key_sig)
+    if not req_cb_add_req_if_absent(key_sig, url, REQ_NCB_LOCK):
         return render_template('processing.html',
                                error=error_codes[0],
-                               url_str=str(rm))
+                               url_str=str(rm),
+                               status_url=status_url)
 
     # Add the request to the queue
-    else:
-        api_request_queue.put(unpack_fields(rm), block=True)
+    api_request_queue.put(unpack_fields(rm), block=True)
 
-    return render_template('processing.html', url_str=str(rm))
+    return render_template('processing.html', url_str=str(rm),
+                           status_url=status_url)
+
+
+def job_status(key):
+    """ View reporting the progress of a job as JSON.  The completed
+        intervals of a time series job are included with ``?partial``. """
+
+    partial = True if 'partial' in request.args else False
+    status = req_cb_get_progress(key, partial=partial)
+
+    if status is None:
+        status = {'status': 'No progress reported.'}
+    status['key'] = key
+    status['url'] = req_cb_get_url(key)
+    status['is_alive'] = req_cb_get_is_running(key)
+
+    return make_response(jsonify(status))
+
+
+def job_cancel(key):
+    """ View for cancelling a pending or running job """
+    if req_cb_cancel_job(key):
+        return redirect(url_for('job_queue') + '?error=6')
+    else:
+        return redirect(url_for('job_queue') + '?error=9')
 
 
 def job_queue():
@@ -265,21 +330,39 @@ def job_queue():
     error = get_errors(request.args)
 
     p_list = list()
-    p_list.append(Markup('<thead><tr><th>is_alive</th><th>url'
-                         '</th></tr></thead>\n<tbody>\n'))
+    p_list.append(Markup('<thead><tr><th>is_alive</th><th>url</th>'
+                         '<th>progress</th><th>eta</th><th>status</th>'
+                         '<th></th></tr></thead>\n<tbody>\n'))
+
+    for key, is_alive, url in req_cb_get_jobs():
 
-    keys = req_cb_get_cache_keys(REQ_NCB_LOCK)
-    for key in keys:
-        # Log the status of the job
-        url = req_cb_get_url(key, REQ_NCB_LOCK)
-        is_alive = str(req_cb_get_is_running(key, REQ_NCB_LOCK))
+        # Summarize the progress reported by running jobs
+        done, eta = '-', '-'
+        if is_alive:
+            status = req_cb_get_progress(key)
+            if status and status['fraction'] is not None:
+                done = '{0:.0f}%'.format(100 * status['fraction'])
+            if status and status['eta'] is not None:
+                eta = '{0:.0f}s'.format(status['eta'])
 
         p_list.append('<tr><td>')
         response_url = "".join(['<a href="',
                                 request.url_root,
                                 url + '">', url, '</a>'])
-        p_list.append("</td><td>".join([is_alive,
+        status_url = "".join(['<a href="',
+                              url_for('job_status', key=key),
+                              '">', key[:8], '</a>'])
+        cancel_url = "".join(['<form method="post" action="',
+                              url_for('job_cancel', key=key),
+                              '"><button type="submit" class="btn btn-link">',
+                              'cancel</button></form>']) if is_alive else ''
+
+        p_list.append("</td><td>".join([str(is_alive),
                                         escape(Markup(response_url)),
+                                        done,
+                                        eta,
+                                        escape(Markup(status_url)),
+                                        escape(Markup(cancel_url)),
                                         ]))
         p_list.append(Markup('</td></tr>'))
     p_list.append(Markup('\n</tbody>'))
@@ -349,8 +432,11 @@ view_list = {
     api_root.__name__: api_root,
     all_urls.__name__: all_urls,
     job_queue.__name__: job_queue,
+    job_status.__name__: job_status,
+    job_cancel.__name__: job_cancel,
     output.__name__: output,
     cohort.__name__: cohort,
+    upload_cohort.__name__: upload_cohort,
     all_cohorts.__name__: all_cohorts,
     metric.__name__: metric,
     all_metrics.__name__: all_metrics,
@@ -364,8 +450,12 @@ route_deco = {
     api_root.__name__: app.route('/'),
     all_urls.__name__: app.route('/all_requests'),
     job_queue.__name__: app.route('/job_queue/'),
+    job_status.__name__: app.route('/job_status/<string:key>'),
+    job_cancel.__name__: app.route('/job_cancel/<string:key>',
+                                   methods=['POST']),
     output.__name__: app.route('/cohorts/<string:cohort>/<string:metric>'),
     cohort.__name__: app.route('/cohorts/<string:cohort>'),
+    upload_cohort.__name__: app.route('/cohorts/upload', methods=['POST']),
     all_cohorts.__name__: app.route('/cohorts/', methods=['POST', 'GET']),
     metric.__name__: app.route('/metrics/<string:metric>'),
     all_metrics.__name__: app.route('/metrics/', methods=['POST', 'GET']),
@@ -379,8 +469,11 @@ login_req_deco = {
     api_root.__name__: False,
     all_urls.__name__: True,
     job_queue.__name__: True,
+    job_status.__name__: True,
+    job_cancel.__name__: True,
     output.__name__: True,
     cohort.__name__: True,
+    upload_cohort.__name__: True,
     all_cohorts.__name__: True,
     metric.__name__: True,
     all_metrics.__name__: False,
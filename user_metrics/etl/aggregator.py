@@ -41,6 +41,28 @@
     In this way aggregators and metrics can be combined freely.  New aggregator
     methods can be written to perform different types of aggregation.
 
+    Partial aggregates
+    ~~~~~~~~~~~~~~~~~~
+
+    Each aggregator method in this module also has a mergeable partial form,
+    a ``PartialAggregator`` stored on the method under the
+    ``METRIC_AGG_METHOD_PARTIAL`` attribute and carried over by
+    ``decorator_builder``.  A partial aggregate is a small state (counts,
+    sums, moments, extrema) computed from a subset of the results.  States
+    for disjoint subsets, e.g. worker chunks, time series intervals or
+    cached sub-results, are combined with ``merge_partials`` and the
+    aggregate is produced from the merged state with ``aggregate_partial``
+    without revisiting the per-user rows::
+
+        >>> states = [partial_aggregate(ba_sum_agg, m) for m in chunks]
+        >>> aggregate_partial(ba_sum_agg, merge_partials(ba_sum_agg, states),
+                              BytesAdded)
+
+    Medians are taken from the merged quantile sketches of their fields and
+    are approximate, see ``QUANTILE_OPS``.  Time series cohorts are
+    aggregated from partial aggregates over chunks of users (see
+    ``user_metrics.etl.time_series_process_methods``).
+
     Aggregator Methods
     ~~~~~~~~~~~~~~~~~~
 """
@@ -49,18 +71,44 @@ __author__ = "ryan faulkner"
 __date__ = "12/12/2012"
 __license__ = "GPL (version 2 or later)"
 
+import __builtin__
+import numpy
 from types import FloatType
 from collections import namedtuple
 from itertools import izip
+from operator import itemgetter
+from math import sqrt
 from numpy import array, transpose
+from user_metrics.config import settings
+from user_metrics.utils.quantile_sketch import KLLSketch
+from user_metrics.utils.columnar import ColumnarResults
 from user_metrics.metrics.user_metric import METRIC_AGG_METHOD_FLAG, \
     METRIC_AGG_METHOD_HEAD, \
     METRIC_AGG_METHOD_KWARGS, \
-    METRIC_AGG_METHOD_NAME
+    METRIC_AGG_METHOD_NAME, \
+    METRIC_AGG_METHOD_PARTIAL, \
+    aggregate_data_class
 
 # Type used to carry aggregator meta data
 AggregatorMeta = namedtuple('AggregatorMeta', 'field_name index op')
 
+# Type used to carry quantile aggregator meta data
+QuantileMeta = namedtuple('QuantileMeta', 'field_name index quantile')
+
+# Quantiles reported by default by ``quantile_sketch`` aggregators
+DEFAULT_QUANTILES = [0.1, 0.25, 0.5, 0.75, 0.9]
+
+# Size of the quantile sketches of ``quantile_sketch``.  Larger sketches
+# are more accurate, see ``user_metrics.utils.quantile_sketch``.
+SKETCH_K = getattr(settings, '__quantile_sketch_k__', 200)
+
+# Type used to carry the mergeable form of an aggregator.  Respectively:
+#
+# 1. method reducing an iterator over results to a state
+# 2. method combining a list of states into one
+# 3. method producing the aggregator output from a state
+PartialAggregator = namedtuple('PartialAggregator', 'partial merge final')
+
 
 def decorator_builder(header):
     """
@@ -80,11 +128,79 @@ def decorator_builder(header):
             else:
                 raise AggregatorError('This aggregator (%s) does not operate '
                                       'on this data type.' % f.__name__)
+        if hasattr(f, METRIC_AGG_METHOD_PARTIAL):
+            setattr(wrapper, METRIC_AGG_METHOD_PARTIAL,
+                    getattr(f, METRIC_AGG_METHOD_PARTIAL))
         return wrapper
     return eval_data_model
 
 
-def list_sum_indices(l, indices):
+def field_dtype(metric, indices):
+    """
+        Returns the NumPy dtype for the result fields ``indices`` of
+        ``metric`` as declared in its ``_data_model_meta``.  Fields of mixed
+        or undeclared type are floats.
+    """
+    meta = getattr(metric, '_data_model_meta', dict())
+    for field_type, dtype in [('integer_fields', numpy.int64),
+                              ('boolean_fields', numpy.bool_)]:
+        if all(i in meta.get(field_type, []) for i in indices):
+            return dtype
+    return numpy.float64
+
+
+def results_array(l, indices, dtype=None):
+    """
+        Converts the fields ``indices`` of the rows in ``l`` to a 2-D NumPy
+        array with one column per index.  The fields must cast
+        safely to ``dtype`` if it is given, e.g. floats are not truncated
+        to integers.  Raises TypeError or ValueError if the fields do not
+        convert and IndexError if a row is too short::
+
+            >>> results_array([['1',1,50],['2',4,1]], [1,2])
+            array([[ 1, 50],
+                   [ 4,  1]])
+    """
+    rows = _get_rows(l)
+    columns = [results_column(rows, index, dtype) for index in indices]
+    return numpy.column_stack(columns) if columns else \
+        numpy.empty((len(rows), 0), dtype=dtype)
+
+
+def results_column(rows, index, dtype=None):
+    """
+        Converts the field ``index`` of ``rows`` to a 1-D NumPy array.  The
+        column of ``ColumnarResults`` is returned without a copy where it
+        already has a suitable type.
+    """
+    rows = _get_rows(rows)
+    if isinstance(rows, ColumnarResults):
+        column = rows.column(index)
+        if dtype is not None:
+            column = column.astype(dtype, casting='safe', copy=False)
+        return column
+
+    column = array(map(itemgetter(index), rows))
+    if column.ndim != 1:
+        raise ValueError('Field {0} is not a scalar.'.format(index))
+    if dtype is not None:
+        column = column.astype(dtype, casting='safe')
+    return column
+
+
+def _get_rows(l):
+    """
+        Returns the rows of ``l``, a list, ``ColumnarResults`` or an
+        iterable over rows such as a metric, as a list or ``ColumnarResults``.
+    """
+    if isinstance(l, (list, ColumnarResults)):
+        return l
+    if isinstance(getattr(l, '_results', None), ColumnarResults):
+        return l._results
+    return list(l)
+
+
+def list_sum_indices(l, indices, dtype=None):
     """
         Sums the elements of list indicated by numeric list `indices`.  The
         elements must be summable (i.e. e1 + e2 is allowed for all e1 and e2)
@@ -96,9 +212,44 @@ def list_sum_indices(l, indices):
             >>> list_sum_indices(l,[1,2])
             [7, 57]
     """
-    return list(reduce(lambda x, y: x+y,
-                       [array([elem.__getitem__(i) for i in indices])
-                        for elem in l]))
+    if dtype is None and hasattr(l, '_data_model_meta'):
+        dtype = field_dtype(l, indices)
+    l = _get_rows(l)
+    if not len(l):
+        raise AggregatorError(__name__ + ' :: No results to sum.')
+    try:
+        return list(results_array(l, indices, dtype).sum(axis=0))
+    except (ValueError, TypeError):
+        # Elements that are summable but not numeric
+        return list(reduce(lambda x, y: x+y,
+                           [array([elem.__getitem__(i) for i in indices])
+                            for elem in l]))
+
+
+def _group_sums(l, group_index):
+    """
+        Returns the distinct keys at ``group_index`` of the rows in ``l``,
+        the rows of sums of the remaining fields for each key and the
+        number of rows for each key.  Each field keeps its own type and the
+        keys are returned unchanged in the order they are first seen.
+    """
+    if isinstance(l, ColumnarResults):
+        keys = l.column(group_index).tolist()
+    else:
+        keys = map(itemgetter(group_index), l)
+    positions = dict()
+    inverse = [positions.setdefault(key, len(positions)) for key in keys]
+    uniq = sorted(positions, key=positions.get)
+
+    columns = list()
+    for index in xrange(len(l[0])):
+        if index == group_index:
+            continue
+        values = results_column(l, index)
+        sums = numpy.zeros(len(uniq), dtype=values.dtype)
+        numpy.add.at(sums, inverse, values)
+        columns.append(sums.tolist())
+    return uniq, map(list, zip(*columns)), numpy.bincount(inverse)
 
 
 def list_sum_by_group(l, group_index):
@@ -112,49 +263,36 @@ def list_sum_by_group(l, group_index):
             e.g.
             >>> l = [[2,1],[1,4],[2,2]]
             >>> list_sum_by_group(l,0)
-            [[1,4], [2,3]]
+            [[2, 3], [1, 4]]
     """
-    d = dict()
-    for i in l:
-        summables = i[:group_index] + i[group_index+1:]
-        if i[group_index] in d:
-            d[i[group_index]] = map(sum, izip(summables, d[i[group_index]]))
-        else:
-            d[i[group_index]] = summables
-    return [d[k][:group_index] + [k] + d[k][group_index:] for k in d]
+    l = _get_rows(l)
+    if not len(l):
+        return list()
+    keys, sums, counts = _group_sums(l, group_index)
+    return [sums[i][:group_index] + [k] + sums[i][group_index:]
+            for i, k in enumerate(keys)]
 
 
 def list_average_by_group(l, group_index):
     """
         Computes the average of the elements of list keyed on `key_index`.
         The elements must be summable (i.e. e1 + e2 is allowed for all e1 and
-        e2).  All elements outside of key are summed on matching keys. This
-        duplicates the code of `list_sum_by_group` since it needs to compute
-        counts in the loop also::
+        e2).  All elements outside of key are summed on matching keys::
 
             Returns: <list of averaged and keyed elements>
 
             e.g.
             >>> l = [[2,1],[1,4],[2,2]]
-            >>> list_average(l,0)
-            [[1, 4.0], [2, 1.5]]
-    """
-    d = dict()
-    counts = dict()
-    for i in l:
-        summables = i[:group_index] + i[group_index+1:]
-        if i[group_index] in d:
-            d[i[group_index]] = map(sum,
-                                    izip(summables, d[i[group_index]]))
-            counts[i[group_index]] += 1
-        else:
-            d[i[group_index]] = summables
-            counts[i[group_index]] = 1
-
-    # use numpy array perform list operation
-    for k in counts:
-        d[k] = list(array(d[k]) / float(counts[k]))
-    return [d[k][:group_index] + [k] + d[k][group_index:] for k in d]
+            >>> list_average_by_group(l,0)
+            [[2, 1.5], [1, 4.0]]
+    """
+    l = _get_rows(l)
+    if not len(l):
+        return list()
+    keys, sums, counts = _group_sums(l, group_index)
+    averages = array(sums, dtype=float) / counts[:, None]
+    return [averages[i, :group_index].tolist() + [k] +
+            averages[i, group_index:].tolist() for i, k in enumerate(keys)]
 
 
 def boolean_rate(iter, **kwargs):
@@ -174,9 +312,20 @@ def boolean_rate(iter, **kwargs):
     cmp_method = kwargs['cmp_method'] if 'cmp_method' in kwargs \
         else cmp_method_default
 
-    total = 0
-    pos = 0
-    for r in iter.__iter__():
+    rows = _get_rows(iter)
+
+    # Compare the whole column at once for the default comparison
+    if 'cmp_method' not in kwargs:
+        try:
+            values = results_column(rows, val_idx, numpy.float64)
+            total, pos = len(rows), int((values > 0).sum())
+            rows = list()
+        except (IndexError, ValueError, TypeError):
+            total, pos = 0, 0
+    else:
+        total, pos = 0, 0
+
+    for r in rows:
         try:
             if cmp_method(r[val_idx]):
                 pos += 1
@@ -195,6 +344,18 @@ def weighted_rate(iter, **kwargs):
     """
         Computes a weighted rate over the elements of the iterator.
     """
+    count, total_weight, weighted_sum = _weighted_sums(iter, **kwargs)
+    if count:
+        return [count, total_weight, weighted_sum / count]
+    else:
+        return [count, total_weight, 0.0]
+
+
+def _weighted_sums(iter, **kwargs):
+    """
+        Returns the count, total weight and weighted sum of values of the
+        elements of the iterator for ``weighted_rate``.
+    """
 
     def weight_method_default(x):
         return 1
@@ -204,10 +365,24 @@ def weighted_rate(iter, **kwargs):
     weight_method = kwargs['weight_method'] if 'cmp_method' in kwargs else \
         weight_method_default
 
+    rows = _get_rows(iter)
+
+    # With the default weight the sums of columnar results are taken over
+    # whole columns.  Building the columns from rows costs as much as the
+    # loop below.
+    if 'cmp_method' not in kwargs and isinstance(rows, ColumnarResults):
+        try:
+            weights = results_column(rows, weight_idx, numpy.float64)
+            values = weights if val_idx == weight_idx else \
+                results_column(rows, val_idx, numpy.float64)
+            return len(rows), float(weights.sum()), float(values.sum())
+        except (IndexError, ValueError, TypeError):
+            pass
+
     count = 0
     total_weight = 0.0
     weighted_sum = 0.0
-    for r in iter.__iter__():
+    for r in rows:
         try:
             count += 1
             weight = weight_method(r[weight_idx])
@@ -217,10 +392,7 @@ def weighted_rate(iter, **kwargs):
             continue
         except TypeError:
             continue
-    if count:
-        return [count, total_weight, weighted_sum / count]
-    else:
-        return [count, total_weight, 0.0]
+    return count, total_weight, weighted_sum
 
 
 def numpy_op(iter, **kwargs):
@@ -235,6 +407,19 @@ def numpy_op(iter, **kwargs):
     agg_meta = kwargs['agg_meta']
     values = list()
 
+    # Columnar results are read field by field without conversion
+    if isinstance(getattr(iter, '_results', None), ColumnarResults):
+        for agg_meta_obj in agg_meta:
+            if not hasattr(agg_meta_obj, 'op') or \
+                    not hasattr(agg_meta_obj, 'index'):
+                raise AggregatorError(__name__ + ':: Use AggregatorMeta '
+                                                 'object to pass aggregator '
+                                                 'meta data.')
+            column = iter._results.column(agg_meta_obj.index)
+            values.append(agg_meta_obj.op(column.astype(FloatType,
+                                                        copy=False)))
+        return values
+
     # Convert data points to numpy array
     if hasattr(iter, '_results'):
         results = array(iter._results)
@@ -287,6 +472,351 @@ def build_agg_meta(op_list, field_prefix_names):
             for op in op_list]
 
 
+def quantile_sketch(iter, **kwargs):
+    """
+        Computes approximate quantiles of fields from an iterator exposing a
+        dataset.  Rows are streamed into a quantile sketch for each field so
+        that the dataset is never held in memory as a whole.  Rows whose
+        field is missing or not numeric are skipped.
+
+            **quantile_meta** - list of ``QuantileMeta`` objects.
+            **k** - size of the sketches, defaults to ``SKETCH_K``.
+    """
+    sketches = _quantile_sketches(iter, **kwargs)
+    return _quantile_values(sketches, kwargs['quantile_meta'])
+
+
+def _quantile_sketches(iter, **kwargs):
+    """
+        Returns a ``KLLSketch`` over each field of ``quantile_meta``.  The
+        sketches are seeded so that the same results give the same
+        quantiles.
+    """
+    k = kwargs['k'] if 'k' in kwargs else SKETCH_K
+    indices = sorted(set(q.index for q in kwargs['quantile_meta']))
+    sketches = dict((index, KLLSketch(k=k, seed=index)) for index in indices)
+
+    for r in iter.__iter__():
+        for index in indices:
+            try:
+                sketches[index].update(float(r[index]))
+            except (IndexError, TypeError, ValueError):
+                continue
+    return sketches
+
+
+def _quantile_values(sketches, quantile_meta):
+    return [sketches[q.index].quantile(q.quantile) for q in quantile_meta]
+
+
+def build_quantile_agg(quantiles, field_prefix_names, metric_header,
+                       method_handle, k=None):
+    """
+        Builder method for ``quantile_sketch`` aggregators.  ``quantiles``
+        is a list of fractions in [0, 1], e.g. 0.5 for the median, which
+        are computed for each field in ``field_prefix_names``.
+    """
+    quantile_meta = [QuantileMeta('{0}p{1:g}'.format(name, 100 * quantile),
+                                  index, quantile)
+                     for name, index in field_prefix_names.iteritems()
+                     for quantile in quantiles]
+
+    agg_method = quantile_sketch
+    agg_method = decorator_builder(metric_header)(agg_method)
+
+    setattr(agg_method, METRIC_AGG_METHOD_FLAG, True)
+    setattr(agg_method, METRIC_AGG_METHOD_NAME, method_handle)
+    setattr(agg_method, METRIC_AGG_METHOD_HEAD,
+            [q.field_name for q in quantile_meta])
+    setattr(agg_method, METRIC_AGG_METHOD_KWARGS,
+            {
+                'quantile_meta': quantile_meta,
+                'k': k or SKETCH_K,
+            }
+            )
+    return agg_method
+
+
+# PARTIAL AGGREGATES
+# ##################
+
+
+def partial_aggregate(agg_method, metric):
+    """
+        Computes the partial aggregate state of ``agg_method`` over the
+        results of ``metric``.
+    """
+    return _get_partial(agg_method).partial(
+        metric.__iter__(), **_get_agg_kwargs(agg_method, metric))
+
+
+def merge_partials(agg_method, states):
+    """ Combines a list of partial aggregate states of ``agg_method``. """
+    if not states:
+        raise AggregatorError(__name__ + ' :: No partial aggregates to '
+                                         'merge.')
+    return _get_partial(agg_method).merge(states)
+
+
+def aggregate_partial(agg_method, state, metric):
+    """
+        Produces the aggregate of ``agg_method`` from a partial aggregate
+        state.  The return value matches that of ``um.aggregator``.
+        ``metric`` is the metric class or object the state was computed
+        over.
+    """
+    data = _get_partial(agg_method).final(
+        state, **_get_agg_kwargs(agg_method, metric))
+
+    if hasattr(agg_method, METRIC_AGG_METHOD_FLAG) and getattr(
+            agg_method, METRIC_AGG_METHOD_FLAG):
+        agg_header = getattr(agg_method, METRIC_AGG_METHOD_HEAD) if hasattr(
+            agg_method, METRIC_AGG_METHOD_HEAD) else 'No header specified.'
+        data = [getattr(agg_method, METRIC_AGG_METHOD_NAME)] + data
+    else:
+        agg_header = ['type'] + [
+            metric.header()[i]
+            for i in metric._agg_indices[agg_method.__name__]]
+        data = [agg_method.__name__] + data
+    return aggregate_data_class(agg_header, data)
+
+
+def has_partial(agg_method):
+    """ Whether ``agg_method`` has a partial form """
+    return hasattr(agg_method, METRIC_AGG_METHOD_PARTIAL)
+
+
+def _get_partial(agg_method):
+    try:
+        return getattr(agg_method, METRIC_AGG_METHOD_PARTIAL)
+    except AttributeError:
+        raise AggregatorError(__name__ + ' :: Aggregator has no partial '
+                                         'form.')
+
+
+def _get_agg_kwargs(agg_method, metric):
+    """ Keyword args with which ``um.aggregator`` calls ``agg_method`` """
+    if hasattr(agg_method, METRIC_AGG_METHOD_FLAG) and getattr(
+            agg_method, METRIC_AGG_METHOD_FLAG):
+        return getattr(agg_method, METRIC_AGG_METHOD_KWARGS) if hasattr(
+            agg_method, METRIC_AGG_METHOD_KWARGS) else {}
+    return {'indices': metric._agg_indices[agg_method.__name__]}
+
+
+def merge_sums(states):
+    """ Merges partial aggregate states of summed counters. """
+    merged = dict(states[0])
+    for state in states[1:]:
+        for key, value in state.iteritems():
+            merged[key] += value
+    return merged
+
+
+def _list_sum_indices_partial(iter, indices):
+    rows = list(iter)
+    return {'sums': list_sum_indices(rows, indices) if rows else None}
+
+
+def _list_sum_indices_merge(states):
+    sums = None
+    for state in states:
+        if state['sums'] is None:
+            continue
+        sums = state['sums'] if sums is None else \
+            [x + y for x, y in izip(sums, state['sums'])]
+    return {'sums': sums}
+
+
+def _list_sum_indices_final(state, indices):
+    if state['sums'] is None:
+        raise AggregatorError(__name__ + ' :: No results to sum.')
+    return list(state['sums'])
+
+
+setattr(list_sum_indices, METRIC_AGG_METHOD_PARTIAL,
+        PartialAggregator(_list_sum_indices_partial,
+                          _list_sum_indices_merge,
+                          _list_sum_indices_final))
+
+
+def _boolean_rate_partial(iter, **kwargs):
+    total, pos = boolean_rate(iter, **kwargs)[:2]
+    return {'total': total, 'pos': pos}
+
+
+def _boolean_rate_final(state, **kwargs):
+    total, pos = state['total'], state['pos']
+    if total:
+        return [total, pos, float(pos) / total]
+    else:
+        return [total, pos, 0.0]
+
+
+setattr(boolean_rate, METRIC_AGG_METHOD_PARTIAL,
+        PartialAggregator(_boolean_rate_partial, merge_sums,
+                          _boolean_rate_final))
+
+
+def _weighted_rate_partial(iter, **kwargs):
+    count, total_weight, weighted_sum = _weighted_sums(iter, **kwargs)
+    return {'count': count, 'total_weight': total_weight,
+            'weighted_sum': weighted_sum}
+
+
+def _weighted_rate_final(state, **kwargs):
+    count = state['count']
+    if count:
+        return [count, state['total_weight'], state['weighted_sum'] / count]
+    else:
+        return [count, state['total_weight'], 0.0]
+
+
+setattr(weighted_rate, METRIC_AGG_METHOD_PARTIAL,
+        PartialAggregator(_weighted_rate_partial, merge_sums,
+                          _weighted_rate_final))
+
+
+# Ops of ``numpy_op`` computed from the moments and extrema of a field
+MOMENT_OPS = {
+    numpy.sum: 'sum',
+    numpy.mean: 'mean',
+    numpy.std: 'std',
+    numpy.min: 'min',
+    numpy.max: 'max',
+    __builtin__.sum: 'sum',
+    __builtin__.min: 'min',
+    __builtin__.max: 'max',
+}
+
+# Ops of ``numpy_op`` taken as quantiles of a quantile sketch of a field,
+# with the quantile of each
+QUANTILE_OPS = {
+    numpy.median: 0.5,
+}
+
+
+def _float_column(rows, index):
+    """ Returns the field ``index`` of ``rows`` as an array of floats """
+    if isinstance(rows, ColumnarResults):
+        return rows.column(index).astype(numpy.float64, copy=False)
+    return numpy.fromiter((float(row[index]) for row in rows),
+                          dtype=numpy.float64, count=len(rows))
+
+
+def _numpy_op_partial(iter, **kwargs):
+    rows = _get_rows(iter)
+
+    states = list()
+    for agg_meta_obj in kwargs['agg_meta']:
+        values = _float_column(rows, agg_meta_obj.index)
+        n = len(values)
+        mean = float(values.mean()) if n else 0.0
+        state = {
+            'n': n,
+            'sum': float(values.sum()),
+            'mean': mean,
+            'm2': float(((values - mean) ** 2).sum()),
+            'min': float(values.min()) if n else None,
+            'max': float(values.max()) if n else None,
+        }
+        if agg_meta_obj.op in QUANTILE_OPS:
+            sketch = KLLSketch(k=SKETCH_K, seed=agg_meta_obj.index)
+            for value in values.tolist():
+                sketch.update(value)
+            state['sketch'] = sketch.to_dict()
+        elif agg_meta_obj.op not in MOMENT_OPS:
+            raise AggregatorError(__name__ + ' :: {0} has no partial form.'.
+                                  format(agg_meta_obj.field_name))
+        states.append(state)
+    return {'fields': states}
+
+
+def _merge_moments(a, b):
+    """
+        Merges the counts, means and sums of squared deviations of two
+        fields (Chan et al.), and their quantile sketches if any.
+    """
+    if not a['n']:
+        return dict(b)
+    if not b['n']:
+        return dict(a)
+
+    n = a['n'] + b['n']
+    delta = b['mean'] - a['mean']
+    merged = {
+        'n': n,
+        'sum': a['sum'] + b['sum'],
+        'mean': a['mean'] + delta * b['n'] / n,
+        'm2': a['m2'] + b['m2'] + delta ** 2 * a['n'] * b['n'] / n,
+        'min': min(a['min'], b['min']),
+        'max': max(a['max'], b['max']),
+    }
+    if 'sketch' in a:
+        merged['sketch'] = KLLSketch.from_dict(a['sketch'], seed=n).merge(
+            KLLSketch.from_dict(b['sketch'])).to_dict()
+    return merged
+
+
+def _numpy_op_merge(states):
+    return {'fields': [reduce(_merge_moments, fields) for fields in
+                       izip(*[state['fields'] for state in states])]}
+
+
+def _numpy_op_final(state, **kwargs):
+    values = list()
+    for agg_meta_obj, field in izip(kwargs['agg_meta'], state['fields']):
+        op = MOMENT_OPS.get(agg_meta_obj.op)
+        if not field['n'] and op != 'sum':
+            values.append(0.0)
+        elif op == 'sum':
+            values.append(field['sum'])
+        elif op == 'mean':
+            values.append(field['mean'])
+        elif op == 'std':
+            values.append(sqrt(field['m2'] / field['n']))
+        elif op in ['min', 'max']:
+            values.append(field[op])
+        else:
+            values.append(KLLSketch.from_dict(field['sketch']).quantile(
+                QUANTILE_OPS[agg_meta_obj.op]))
+    return values
+
+
+setattr(numpy_op, METRIC_AGG_METHOD_PARTIAL,
+        PartialAggregator(_numpy_op_partial, _numpy_op_merge,
+                          _numpy_op_final))
+
+
+def _quantile_sketch_partial(iter, **kwargs):
+    sketches = _quantile_sketches(iter, **kwargs)
+    return {'sketches': dict((index, sketch.to_dict())
+                             for index, sketch in sketches.iteritems())}
+
+
+def _quantile_sketch_merge(states):
+    sketches = dict()
+    for state in states:
+        for index, sketch in state['sketches'].iteritems():
+            sketch = KLLSketch.from_dict(sketch, seed=index)
+            if index in sketches:
+                sketches[index].merge(sketch)
+            else:
+                sketches[index] = sketch
+    return {'sketches': dict((index, sketch.to_dict())
+                             for index, sketch in sketches.iteritems())}
+
+
+def _quantile_sketch_final(state, **kwargs):
+    sketches = dict((index, KLLSketch.from_dict(sketch))
+                    for index, sketch in state['sketches'].iteritems())
+    return _quantile_values(sketches, kwargs['quantile_meta'])
+
+
+setattr(quantile_sketch, METRIC_AGG_METHOD_PARTIAL,
+        PartialAggregator(_quantile_sketch_partial, _quantile_sketch_merge,
+                          _quantile_sketch_final))
+
+
 class AggregatorError(Exception):
     """ Basic exception class for aggregators """
     def __init__(self, message="Aggregation error."):
@@ -37,6 +37,14 @@ state of *_results_* is written to a csv file: ::
 
     output_file.close()
 
+Large separated value files are best read and written with
+*DataLoader.iter_from_xsv()* and *DataLoader.iter_to_xsv()* which stream rows
+through the ``csv`` module, optionally gzipped, rather than holding the file
+contents in memory: ::
+
+    rows = DataLoader().iter_from_xsv('user_id.txt', types=[int])
+    DataLoader().iter_to_xsv(rows, 'user_id.tsv.gz')
+
 The class family structure consists of a base class, DataLoader, which
 outlines the basic members and functionality.  This interface is extended
 for interaction with specific data sources via inherited classes.
@@ -54,10 +62,26 @@ __license__ = "GPL (version 2 or later)"
 from time import sleep
 import MySQLdb
 import operator
+import csv
+import gzip
+import io
+import os
 import user_metrics.config.settings as projSet
 
 from user_metrics.config import logging
 
+# Seconds to wait on a MySQL read before the query is abandoned, 0 waits
+# indefinitely.  Only MySQLdb versions whose ``connect`` accepts
+# ``read_timeout`` abandon reads, see ``Connector.set_connection``.
+QUERY_TIMEOUT = getattr(projSet, '__query_timeout__', 1800)
+
+# Whether the installed MySQLdb accepts ``read_timeout``.  None until a
+# connection is made with a query timeout.
+_read_timeout_supported = None
+
+# Buffer size in bytes for streamed xsv files
+XSV_BUFFER_SIZE = 1024 * 1024
+
 
 def read_file(file_path_name):
     """ reads a text file line by line """
@@ -80,6 +104,29 @@ class ConnectorError(Exception):
         Exception.__init__(self, message)
 
 
+def _connect(mysql_kwargs):
+    """
+        Opens a MySQL connection.  Older MySQLdb versions, e.g. MySQL-python
+        1.2.x, do not accept ``read_timeout``.  The connection is then made
+        without it, and so are later ones.
+    """
+    global _read_timeout_supported
+    if 'read_timeout' not in mysql_kwargs:
+        return MySQLdb.connect(**mysql_kwargs)
+    try:
+        db = MySQLdb.connect(**mysql_kwargs)
+    except TypeError:
+        if _read_timeout_supported:
+            raise
+        _read_timeout_supported = False
+        logging.error(__name__ + ' :: MySQLdb does not support read '
+                                 'timeouts, queries will not time out.')
+        del mysql_kwargs['read_timeout']
+        return MySQLdb.connect(**mysql_kwargs)
+    _read_timeout_supported = True
+    return db
+
+
 class Connector(object):
     """ This class implements the connection logic to MySQL """
 
@@ -103,9 +150,13 @@ class Connector(object):
                 mysql_kwargs[key] = projSet.connections[kwargs['instance']][
                                     key]
 
+            # Abandon reads that block longer than the query timeout
+            if QUERY_TIMEOUT and _read_timeout_supported is not False:
+                mysql_kwargs.setdefault('read_timeout', QUERY_TIMEOUT)
+
             while retries:
                 try:
-                    self._db_ = MySQLdb.connect(**mysql_kwargs)
+                    self._db_ = _connect(mysql_kwargs)
                     break
                 except MySQLdb.OperationalError as e:
                     logging.debug(__name__ + ' :: Connection dropped. '
@@ -150,6 +201,27 @@ class Connector(object):
         return [elem[0] for elem in column_data]
 
 
+def _open_xsv(xsv_name, mode, buffer_size=XSV_BUFFER_SIZE):
+    """
+        Opens a separated value file with a buffer of ``buffer_size`` bytes,
+        through gzip if the name ends in ``.gz``.  Relative names are taken
+        from the project data folder.
+    """
+    if not os.path.isabs(xsv_name):
+        xsv_name = projSet.__data_file_dir__ + xsv_name
+    if xsv_name.endswith('.gz'):
+        if 'r' in mode:
+            return io.BufferedReader(gzip.open(xsv_name, mode), buffer_size)
+        return io.BufferedWriter(gzip.open(xsv_name, mode), buffer_size)
+    return open(xsv_name, mode, buffer_size)
+
+
+def _encode_row(row):
+    """ Encodes the unicode values of a row as UTF-8 for ``csv`` """
+    return [value.encode('utf-8') if isinstance(value, unicode) else value
+            for value in row]
+
+
 class DataLoader(object):
     """ Singleton class for performing operations on data sets.
         ETL class for xsv and RDBMS data sources. """
@@ -340,6 +412,80 @@ class DataLoader(object):
             out.append([str(tokens[index]) for index in xrange(len(tokens))])
         return out
 
+    def iter_from_xsv(self, xsv_name, separator='\t', header=False,
+                      types=None, buffer_size=XSV_BUFFER_SIZE):
+        """
+            Generator over the rows of a separated value file, read with
+            the ``csv`` module.  Files ending in ``.gz`` are decompressed.
+
+            Parameters:
+                - **xsv_name**: String.  filename of the .xsv; relative
+                    names are taken from the project data folder
+                - **separator**: String.  The separating character in
+                    the file.  Default to tab.
+                - **header**: Boolean.  Flag indicating whether the
+                    file has a header.
+                - **types**: List(callable).  Conversion applied to each
+                    column, e.g. ``[int, str, float]``; None leaves a
+                    column as a string.
+                - **buffer_size**: Integer.  Read buffer size in bytes.
+
+            Return:
+                - Iterator(List).  Rows of the file.  Raises
+                    ``DataLoaderError`` if a value cannot be converted.
+        """
+        xsv_file = _open_xsv(xsv_name, 'rb', buffer_size)
+        try:
+            reader = csv.reader(xsv_file, delimiter=separator)
+            if header:
+                next(reader, None)
+            for row in reader:
+                if types:
+                    try:
+                        row = [types[i](value) if i < len(types) and
+                               types[i] else value
+                               for i, value in enumerate(row)]
+                    except ValueError as e:
+                        raise DataLoaderError(
+                            __name__ + ' :: Bad value on line %s of %s: %s' %
+                            (reader.line_num, xsv_name, str(e)))
+                yield row
+        finally:
+            xsv_file.close()
+
+    def iter_to_xsv(self, rows, outfile, separator='\t', header=None,
+                    buffer_size=XSV_BUFFER_SIZE):
+        """
+            Writes an iterable of rows to a separated value file with the
+            ``csv`` module, without holding the rows in memory.  Files
+            ending in ``.gz`` are compressed.
+
+            Parameters:
+                - **rows** - Iterable(List()).  Rows to write.
+                - **outfile** - String.  The output filename; relative
+                    names are taken from the project data folder.
+                - **separator**: String.  The separating character in the
+                    file.  Default to tab.
+                - **header** - List(String).  Column names written first.
+                - **buffer_size**: Integer.  Write buffer size in bytes.
+
+            Return:
+                - Integer.  The number of rows written.
+        """
+        count = 0
+        xsv_file = _open_xsv(outfile, 'wb', buffer_size)
+        try:
+            writer = csv.writer(xsv_file, delimiter=separator,
+                                lineterminator='\n')
+            if header:
+                writer.writerow(_encode_row(header))
+            for row in rows:
+                writer.writerow(_encode_row(row))
+                count += 1
+        finally:
+            xsv_file.close()
+        return count
+
     def list_to_xsv(self, nested_list, separator='\t', log=False,
                     outfile='list_to_xsv.out'):
         """
@@ -1,5 +1,21 @@
 """
     Handles logic for parsing log requests into a readable format
+
+    ``LineParseMethods.iter_parse`` reads one or more log files, plain or
+    gzipped, as a single stream and yields the parsed records lazily so that
+    memory use does not grow with the size of the logs.  Records may be
+    grouped with ``batches`` and passed to a ``TableLoader`` or written out
+    with ``write_records``. ::
+
+        >>> records = LineParseMethods.iter_parse(
+                ['click-tracking.log.2.gz', 'click-tracking.log.1.gz'],
+                LineParseMethods.e3_lm_log_parse)
+        >>> for batch in batches(records, 1000):
+        ...     loader.insert_row(batch)
+
+    ``parallel_parse`` does the same across a pool of processes.  Each log
+    file, or each ``SPLIT_SIZE`` byte range of a large uncompressed log, is
+    parsed by one worker and the records are yielded in input order.
 """
 
 __author__ = "Ryan Faulkner"
@@ -12,11 +28,213 @@ import re
 import logging
 import json
 import gzip
+import os
+from glob import glob
+from itertools import islice
+from multiprocessing import Pool, cpu_count
+from time import time
 import user_metrics.config.settings as projSet
 
 # CONFIGURE THE LOGGER
 logging.basicConfig(level=logging.DEBUG, stream=sys.stderr, format='%(asctime)s %(levelname)-8s %(message)s', datefmt='%b-%d %H:%M:%S')
 
+# Default number of records in a batch
+BATCH_SIZE = 1000
+
+# Uncompressed logs larger than this many bytes are split at line boundaries
+# into parts of about this size when parsed in parallel.  Gzipped logs cannot
+# be split and are parsed whole.
+SPLIT_SIZE = 64 * 1024 * 1024
+
+
+# Patterns used by the ``LineParseMethods`` parsers, compiled once.  The tokens
+# are literal substrings of the patterns checked before any regex work so that
+# unrelated lines are rejected cheaply.
+ACUX_CLIENT_TOKEN = 'accountCreationUX'
+ACUX_SERVER_TOKEN = 'ACUX'
+ACUX_SERVER_REGEX = re.compile(r'account_create.*userbuckets.*ACUX')
+CTA4_CLIENT_TOKEN = 'option6X-cta_signup_login-'
+CTA4_IMPRESSION_REGEX = re.compile(
+    r"ext.articleFeedbackv5@10-option6X-cta_signup_login-impression")
+CTA4_CLICK_REGEX = re.compile(
+    r"ext.articleFeedbackv5@10-option6X-cta_signup_login-button_signup_click")
+
+# Compiled client event patterns of each ACUX version
+_acux_client_regexes = dict()
+
+
+def _acux_client_regex(version):
+    if version not in _acux_client_regexes:
+        _acux_client_regexes[version] = re.compile(
+            r'ext.accountCreationUX.*@.*_%s' % version)
+    return _acux_client_regexes[version]
+
+
+def open_log(log_file):
+    """
+        Opens a log file for reading, decompressing it if it ends in
+        ``.gz``.  Relative paths are taken from the project data folder.
+    """
+    if not os.path.isabs(log_file):
+        log_file = projSet.__data_file_dir__ + log_file
+    if log_file.endswith('.gz'):
+        return gzip.open(log_file, 'rb')
+    return open(log_file, 'r')
+
+
+def iter_lines(log_files, header=False):
+    """
+        Generator over the lines of one or more log files read in order as
+        a single stream.  ``log_files`` is a filename, a glob pattern
+        (matches are read in sorted order) or a list of these.  If
+        ``header`` is set the first line of each file is skipped.
+    """
+    if isinstance(log_files, basestring):
+        log_files = [log_files]
+
+    for pattern in log_files:
+        for log_file in _expand_log_files(pattern):
+            file_obj = open_log(log_file)
+            try:
+                if header:
+                    file_obj.readline()
+                for line in file_obj:
+                    yield line
+            finally:
+                file_obj.close()
+
+
+def _expand_log_files(pattern):
+    """
+        Returns the sorted files matching a glob pattern, or the filename
+        itself if it is not a pattern.
+    """
+    if not re.search(r'[*?[]', pattern):
+        return [pattern]
+    if not os.path.isabs(pattern):
+        pattern = projSet.__data_file_dir__ + pattern
+    return sorted(glob(pattern))
+
+
+def batches(records, batch_size=BATCH_SIZE):
+    """
+        Generator grouping an iterable of records into lists of at most
+        ``batch_size`` records.
+    """
+    records = iter(records)
+    while True:
+        batch = list(islice(records, batch_size))
+        if not batch:
+            break
+        yield batch
+
+
+def write_records(records, file_obj, separator='\t'):
+    """
+        Writes records to an open file one line per record, fields joined
+        by ``separator``.  Returns the count.
+    """
+    count = 0
+    for batch in batches(records):
+        file_obj.writelines(separator.join(str(field) for field in record) +
+                            '\n' for record in batch)
+        count += len(batch)
+    return count
+
+
+def parallel_parse(log_files, parse_method, processes=None, header=False,
+                   version=1, skip_empty=False, split_size=SPLIT_SIZE):
+    """
+        Parallel version of ``LineParseMethods.iter_parse``.  Log files, and
+        parts of large uncompressed files, are parsed by a pool of
+        ``processes`` workers (default one per CPU) and the records are
+        yielded in the order of the input.  ``parse_method`` must be one of
+        the ``LineParseMethods`` parsers or a module level function so that
+        it can be sent to the workers.  The lines/sec of each worker are
+        logged when parsing completes.
+    """
+    if isinstance(log_files, basestring):
+        log_files = [log_files]
+    if getattr(LineParseMethods, parse_method.__name__, None) is parse_method:
+        parse_method = parse_method.__name__
+
+    tasks = list()
+    for pattern in log_files:
+        for log_file in _expand_log_files(pattern):
+            for start, end in _split_log(log_file, split_size):
+                tasks.append((log_file, start, end, parse_method, header,
+                              version, skip_empty))
+
+    pool = Pool(processes=processes or cpu_count())
+    worker_stats = dict()
+    try:
+        for pid, lines, elapsed, records in pool.imap(_parse_part, tasks):
+            stats = worker_stats.setdefault(pid, [0, 0.0])
+            stats[0] += lines
+            stats[1] += elapsed
+            for record in records:
+                yield record
+    finally:
+        pool.terminate()
+
+    for pid, (lines, elapsed) in sorted(worker_stats.iteritems()):
+        rate = lines / elapsed if elapsed else 0.0
+        logging.info('Worker %s parsed %s lines in %.1fs (%.0f lines/sec).' %
+                     (pid, lines, elapsed, rate))
+
+
+def _split_log(log_file, split_size):
+    """
+        Returns the ``(start, end)`` byte ranges into which a log is split.
+        ``end`` is None for the last part.
+    """
+    path = log_file
+    if not os.path.isabs(log_file):
+        path = projSet.__data_file_dir__ + log_file
+    if log_file.endswith('.gz') or not split_size:
+        return [(0, None)]
+    size = os.path.getsize(path)
+    starts = range(0, size, split_size) or [0]
+    return [(start, start + split_size if start + split_size < size else None)
+            for start in starts]
+
+
+def _parse_part(task):
+    """
+        Worker method of ``parallel_parse``.  Parses the lines of a log that
+        start within the byte range ``[start, end)``.  Returns the worker
+        pid, the number of lines read, the time taken and the records.
+    """
+    log_file, start, end, parse_method, header, version, skip_empty = task
+    if isinstance(parse_method, basestring):
+        parse_method = getattr(LineParseMethods, parse_method)
+
+    started = time()
+    file_obj = open_log(log_file)
+    records = list()
+    lines = 0
+    try:
+        if start:
+            # The line straddling ``start`` belongs to the previous part
+            file_obj.seek(start - 1)
+            file_obj.readline()
+        elif header:
+            file_obj.readline()
+
+        while end is None or file_obj.tell() < end:
+            line = file_obj.readline()
+            if not line:
+                break
+            lines += 1
+            record = parse_method(line, version=version)
+            if skip_empty and not record:
+                continue
+            records.append(record)
+    finally:
+        file_obj.close()
+    return os.getpid(), lines, time() - started, records
+
+
 class LineParseMethods():
     """
         Defines methods for processing lines of text primarily from log files.  Each method in this class takes one
@@ -30,24 +248,29 @@ class LineParseMethods():
     @classmethod
     def parse(cls, log_file, parse_method, header=False, version=1):
         """
-            Log processing wapper method.  This takes a log file as input and applies one of the parser methods to
-            the contents, storing the list results in a list.
+            Log processing wapper method.  This takes a log file as input
+            and applies one of the parser methods to the contents, storing
+            the list results in a list.  See ``iter_parse`` to process large
+            logs.
         """
-        # Open the data file - Process the header
-        if re.search('\.gz', log_file):
-            file_obj = gzip.open(projSet.__data_file_dir__ + log_file, 'rb')
-        else:
-            file_obj = open(projSet.__data_file_dir__ + log_file, 'r')
-
-        if header: file_obj.readline()
-
-        contents = list()
-        while 1:
-            line = file_obj.readline()
-            if not line: break
-            contents.append(parse_method(line, version=version))
-        return map(lambda x: x, contents)
+        return list(cls.iter_parse(log_file, parse_method, header=header,
+                                   version=version))
 
+    @classmethod
+    def iter_parse(cls, log_files, parse_method, header=False, version=1,
+                   skip_empty=False):
+        """
+            Generator version of ``parse``.  Yields the result of
+            ``parse_method`` for each line of ``log_files``, any number of
+            plain or gzipped logs read as one stream (see ``iter_lines``).
+            Empty results, i.e. lines the parse method rejects, are dropped
+            if ``skip_empty`` is set.
+        """
+        for line in iter_lines(log_files, header=header):
+            record = parse_method(line, version=version)
+            if skip_empty and not record:
+                continue
+            yield record
 
 
     @staticmethod
@@ -117,12 +340,11 @@ class LineParseMethods():
 
     @staticmethod
     def e3_acux_log_parse_client_event(line, version=1):
+        if ACUX_CLIENT_TOKEN not in line: return []
         line_bits = line.strip().split('\t')
         num_fields = len(line_bits)
 
-        regex_str = r'ext.accountCreationUX.*@.*_%s' % version
-
-        if num_fields == 10 and re.search(regex_str, line):
+        if num_fields == 10 and _acux_client_regex(version).search(line):
             # CLIENT EVENT - impression, assignment, and submit events
             fields = line_bits[0].split()
             project = fields[0]
@@ -145,18 +367,17 @@ class LineParseMethods():
 
     @staticmethod
     def e3_acux_log_parse_server_event(line, version=1):
-        line_bits = line.split('\t')
-        num_fields = len(line_bits)
-        server_event_regex = r'account_create.*userbuckets.*ACUX'
-        # handle both events generated from the server and client side via ACUX.  Discriminate the two cases based
-        # on the number of fields in the log
+        # handle both events generated from the server and client side via
+        # ACUX.  Discriminate the two cases based on the number of fields in
+        # the log.  Lines lacking the literal parts of the server event regex
+        # are rejected before any regex or query string work.
 
-        if num_fields == 1:
+        if '\t' not in line and ACUX_SERVER_TOKEN in line:
             # SERVER EVENT - account creation
             line_bits = line.split()
 
             try:
-                if re.search(server_event_regex,line):
+                if ACUX_SERVER_REGEX.search(line):
                     query_vars = urlparse.parse_qs(line_bits[1])
                     userbuckets = json.loads(query_vars['userbuckets'][0])
 
@@ -181,16 +402,18 @@ class LineParseMethods():
     def e3_cta4_log_parse_client(line, version=1):
         """ Parse logs for AFT5-CTA4 log requests """
 
+        if CTA4_CLIENT_TOKEN not in line:
+            return []
         line_bits = line.split('\t')
         num_fields = len(line_bits)
 
-        regex_1 = r"ext.articleFeedbackv5@10-option6X-cta_signup_login-impression"
-        regex_2 = r"ext.articleFeedbackv5@10-option6X-cta_signup_login-button_signup_click"
-
-        if num_fields == 10 and (re.search(regex_1, line) or re.search(regex_2, line)):
+        if num_fields == 10:
+            is_impression = CTA4_IMPRESSION_REGEX.search(line)
+            if not is_impression and not CTA4_CLICK_REGEX.search(line):
+                return []
 
             fields = line_bits[0].split()
-            if re.search(regex_1, line):
+            if is_impression:
                 fields.append('impression')
             else:
                 fields.append('click')
@@ -209,27 +432,30 @@ class LineParseMethods():
     def e3_cta4_log_parse_server(line, version=1):
         """ Parse logs for AFT5-CTA4 log requests """
 
-        line_bits = line.split('\t')
-        num_fields = len(line_bits)
+        # Only account creations with user buckets are parsed
+        if '\t' in line or 'account_create' not in line or \
+                'userbuckets' not in line:
+            return []
 
-        if num_fields == 1:
-            # SERVER EVENT - account creation
-            line_bits = line.split()
+        # SERVER EVENT - account creation
+        line_bits = line.split()
+
+        try:
             query_vars = urlparse.parse_qs(line_bits[1])
 
-            try:
-                # Ensure that the user is self made
-                if query_vars['self_made'][0] and query_vars['?event_id'][0] == 'account_create' \
-                and re.search(r'userbuckets',line) and 'campaign' in json.loads(query_vars['userbuckets'][0]):
+            # Ensure that the user is self made
+            if query_vars['self_made'][0] and \
+                    query_vars['?event_id'][0] == 'account_create' and \
+                    'campaign' in json.loads(query_vars['userbuckets'][0]):
 
-                    return [line_bits[0], query_vars['username'][0], query_vars['user_id'][0],
-                            query_vars['timestamp'][0], query_vars['?event_id'][0], query_vars['self_made'][0],
-                            query_vars['version'][0], query_vars['by_email'][0], query_vars['creator_user_id'][0]]
+                return [line_bits[0], query_vars['username'][0],
+                        query_vars['user_id'][0], query_vars['timestamp'][0],
+                        query_vars['?event_id'][0], query_vars['self_made'][0],
+                        query_vars['version'][0], query_vars['by_email'][0],
+                        query_vars['creator_user_id'][0]]
 
-                else:
-                    return []
+            else:
+                return []
 
-            except TypeError: return []
-            except KeyError: return []
-            except IndexError: return []
-        return []
\ No newline at end of file
+        except (TypeError, KeyError, IndexError):
+            return []
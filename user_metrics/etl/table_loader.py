@@ -5,8 +5,14 @@ __license__ = "GPL (version 2 or later)"
 
 # Import python base modules
 import data_loader as dl
+from itertools import islice
+from time import time
+from MySQLdb import ProgrammingError, OperationalError, IntegrityError
 from user_metrics.config import logging
 
+# Default number of records per multi-row insert and transaction
+INSERT_BATCH_SIZE = 1000
+
 
 def decorator_virtual_func_table_loader(f):
     """ This decorator is used to render certain functions virtual """
@@ -40,6 +46,70 @@ class TableLoader(dl.Connector):
         """ Try to insert a new record (s)into the table. """
         return
 
+    def insert_batch(self, records, table_name=None, columns=None,
+                     batch_size=INSERT_BATCH_SIZE):
+        """
+            Inserts an iterable of records into a table.  Records are
+            grouped into batches of ``batch_size`` and each batch is sent
+            as one multi-row INSERT and committed as one transaction.
+
+            Parmeters
+            ~~~~~~~~~
+                records : iterable
+                    Records to insert, each a sequence of column values
+                table_name : string
+                    Table to insert into, defaults to the loader table
+                columns : List(string)
+                    Column names of the record values *[optional]*
+                batch_size : int
+                    Number of records per INSERT and transaction
+
+            Returns the number of records inserted.  If a batch fails it
+            is rolled back and ``DataLoaderError`` is raised; earlier
+            batches remain committed.
+        """
+        table_name = table_name or self._table_name_
+        records = iter(records)
+        query = None
+        count = 0
+        start = time()
+
+        while True:
+            batch = [tuple(record) for record in islice(records, batch_size)]
+            if not batch:
+                break
+            if query is None:
+                query = self._build_insert_query(table_name, len(batch[0]),
+                                                 columns)
+            try:
+                self._cur_.executemany(query, batch)
+                self._db_.commit()
+            except (ProgrammingError, OperationalError, IntegrityError,
+                    TypeError) as e:
+                self._db_.rollback()
+                raise dl.DataLoaderError('Failed to insert into %s after %s '
+                                         'records: %s' % (table_name, count,
+                                                          str(e)))
+            count += len(batch)
+            logging.debug(__name__ + ' :: Inserted %s records into %s.' %
+                                     (count, table_name))
+
+        elapsed = time() - start
+        logging.info(__name__ + ' :: Inserted %s records into %s in %.1fs '
+                                '(%.0f rows/sec).' %
+                                (count, table_name, elapsed,
+                                 count / elapsed if elapsed else 0.0))
+        return count
+
+    @staticmethod
+    def _build_insert_query(table_name, num_values, columns=None):
+        """ Builds an INSERT statement for records of ``num_values`` """
+        column_str = ''
+        if columns:
+            column_str = ' (%s)' % ', '.join('`%s`' % c for c in columns)
+        return 'INSERT INTO %s%s VALUES (%s)' % (
+            table_name, column_str, ', '.join(['%s'] * num_values))
+
     @decorator_virtual_func_table_loader
     def delete_row(self, **kwargs):
         """ Try to delete a record() from the table. """
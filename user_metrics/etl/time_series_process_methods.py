@@ -1,6 +1,29 @@
 
 """
     This module contains custom methods to extract time series data.
+
+    Where a metric supports it (see ``UserMetric.process_intervals``) the
+    series is computed incrementally: the metric is processed once for the
+    whole range and the results are bucketed into intervals.  Otherwise the
+    metric is processed separately for each interval.  Intervals are queued
+    as tasks and pulled by a pool of worker processes as they become free,
+    so that a run of expensive intervals does not hold up the others.
+
+    Data-points may also be measured over rolling or cumulative windows of
+    intervals (see ``WINDOW_TYPE``).  For metrics with additive results the
+    windows are summed from a single pass over the intervals rather than
+    processing each window in full.
+
+    Large cohorts are processed in chunks of ``USER_CHUNK`` users.  The
+    results over each chunk are reduced to a partial aggregate (see
+    ``user_metrics.etl.aggregator``) before the next chunk is processed, so
+    that the per-user results of at most one chunk are held at a time.
+
+    The number of processes in use is bounded by ``MAX_PROCESSES``.  Each
+    worker's metric calls fork up to ``k_`` processes over users, each of
+    which may fork ``kr_`` processes over revisions, and these nested
+    counts are scaled down along with the number of workers to fit the
+    bound (see ``allocate_processes``).
 """
 
 __author__ = "ryan faulkner"
@@ -8,24 +31,46 @@ __date__ = "12/10/2012"
 __license__ = "GPL (version 2 or later)"
 
 import datetime
-import time
 import os
+from collections import OrderedDict
 from copy import deepcopy
 from dateutil.parser import parse as date_parse
 import operator
 import json
+from itertools import izip
 
 from user_metrics.config import settings
 import user_metrics.metrics.user_metric as um
-from user_metrics.utils import format_mediawiki_timestamp
+import user_metrics.etl.aggregator as agg
+import user_metrics.utils.progress as progress
+from user_metrics.utils import format_mediawiki_timestamp, enum
 from multiprocessing import Process, Queue
+from Queue import Empty
 
 from user_metrics.config import logging
 
-# Determines the amount of time to wait before picking completed threads off
-# of the queue
+# Respectively:
+#
+# 1. Default number of time series worker processes
+# 2. Maximum number of processes, including those forked by metrics, in use
+#    by a time series
+# 3. Seconds the listener blocks on worker data before checking that the
+#    workers are still alive
 MAX_THREADS = settings.__time_series_thread_max__
-PROCESS_SLEEP_TIME = 4
+MAX_PROCESSES = getattr(settings, '__time_series_process_max__', 200)
+EVENT_WAIT = 1
+
+# Number of users of a cohort processed at a time, see ``_aggregate_chunks``.
+# 0 processes the whole cohort at once.
+USER_CHUNK = getattr(settings, '__time_series_user_chunk__', 20000)
+
+# Types of window over which each data-point is measured.  Fixed windows
+# are the intervals themselves, rolling windows span the last
+# ``window_len`` intervals and cumulative windows span all intervals from
+# the start of the series.
+WINDOW_TYPE = enum(FIXED='fixed', ROLLING='rolling', CUMULATIVE='cumulative')
+WINDOW_TYPES = [WINDOW_TYPE.FIXED, WINDOW_TYPE.ROLLING,
+                WINDOW_TYPE.CUMULATIVE]
 
 
 def _get_timeseries(date_start, date_end, interval):
@@ -45,6 +90,37 @@ def _get_timeseries(date_start, date_end, interval):
         yield c
 
 
+def _get_intervals(date_start, date_end, interval):
+    """
+        Returns the list of ``(start, end)`` datetime pairs for consecutive
+        intervals given a start date, end date, and interval
+    """
+    time_series = list(_get_timeseries(date_start, date_end, interval))
+    return zip(time_series[:-1], time_series[1:])
+
+
+def _get_windows(intervals, window, window_len):
+    """
+        Returns the list of ``(start, end)`` datetime pairs for the windows
+        ending on each of ``intervals``.  Rolling windows at the start of
+        the series span fewer than ``window_len`` intervals.
+    """
+    if window == WINDOW_TYPE.CUMULATIVE:
+        return [(intervals[0][0], ts_e) for ts_s, ts_e in intervals]
+    elif window == WINDOW_TYPE.ROLLING:
+        return [(intervals[max(0, i - window_len + 1)][0], ts_e)
+                for i, (ts_s, ts_e) in enumerate(intervals)]
+    return intervals
+
+
+def _get_labels(intervals):
+    """
+        Maps the end of each interval to its start.  Windows are labelled
+        by the start of the interval that they end on.
+    """
+    return dict((str(ts_e), str(ts_s)) for ts_s, ts_e in intervals)
+
+
 def build_time_series(start, end, interval, metric, aggregator, cohort,
                       **kwargs):
     """
@@ -72,6 +148,12 @@ def build_time_series(start, end, interval, metric, aggregator, cohort,
             cohort : list(str).
                 list of user IDs
 
+            window : str.
+                one of ``WINDOW_TYPE``.  Each data-point is measured over
+                its interval (fixed), the last ``window_len`` intervals
+                (rolling) or all intervals since ``start`` (cumulative),
+                and is labelled by the start of its last interval.
+
         e.g.
 
         >>> cohort = ['156171','13234584']
@@ -84,38 +166,64 @@ def build_time_series(start, end, interval, metric, aggregator, cohort,
 
     """
 
-    log = bool(kwargs['log']) if 'log' in kwargs else False
+    # Determine the window type and length in intervals
+    window = kwargs.pop('window', None) or WINDOW_TYPE.FIXED
+    window_len = int(kwargs.pop('window_len', None) or 1)
+    if window not in WINDOW_TYPES or window_len < 1:
+        raise TimeSeriesException('Bad window "{0}" of length {1}.'.
+                                  format(window, window_len))
 
     # Get datetime types, and the number of threads
     start = date_parse(format_mediawiki_timestamp(start))
     end = date_parse(format_mediawiki_timestamp(end))
     k = kwargs['kt_'] if 'kt_' in kwargs else MAX_THREADS
 
-    # Compute window size and ensure that all the conditions
-    # necessary to generate a proper time series are met
-    num_intervals = int((end - start).total_seconds() / (3600 * interval))
-    intervals_per_thread = num_intervals / k
+    intervals = _get_intervals(start, end, interval)
+    windows = _get_windows(intervals, window, window_len)
+    labels = _get_labels(intervals)
+
+    # Compute all windows in a single pass where the metric allows it
+    kwargs = _allocate_metric_threads(1, kwargs)[1]
+    data = time_series_incremental(windows, intervals, metric, aggregator,
+                                   cohort, kwargs)
 
-    # Compose the sets of time series lists
-    f = lambda t, i:  t + datetime.timedelta(
-        hours=int(intervals_per_thread * interval * i))
-    time_series = [_get_timeseries(f(start, i),
-                   f(start, i+1), interval) for i in xrange(k)]
-    if f(start, k) < end:
-        time_series.append(_get_timeseries(f(start, k), end, interval))
+    # Otherwise queue a task for each window
+    if data is None:
+        k, kwargs = _allocate_metric_threads(min(k, len(windows)), kwargs)
+        data = _time_series_pool(windows, labels, metric, aggregator,
+                                 cohort, k, kwargs)
+    return sorted(data, key=operator.itemgetter(0))
+
+
+def _time_series_pool(windows, labels, metric, aggregator, cohort, k,
+                      kwargs):
+    """
+        Computes time series data for ``windows``, labelled with
+        ``labels``, with ``k`` worker processes.  Returns the data sorted
+        by timestamp.
+    """
+    log = bool(kwargs['log']) if 'log' in kwargs else False
+
+    # Queue a task for each window followed by a sentinel for each worker
+    task_queue = Queue()
+    for task in windows:
+        task_queue.put(task)
+    for i in xrange(k):
+        task_queue.put(None)
 
     event_queue = Queue()
     process_queue = list()
 
-    if log:
+    if log and windows:
         logging.info(__name__ + ' :: Spawning procs\n'
-                                '\t%s - %s, interval = %s\n'
-                                '\tthreads = %s ... ' % (str(start), str(end),
-                                                       interval, k))
-    for i in xrange(len(time_series)):
+                                '\t%s - %s, windows = %s\n'
+                                '\tthreads = %s ... ' % (str(windows[0][0]),
+                                                       str(windows[-1][1]),
+                                                       len(windows), k))
+    for i in xrange(k):
         p = Process(target=time_series_worker,
-                    args=(time_series[i], metric, aggregator,
-                          cohort, event_queue, kwargs))
+                    args=(task_queue, metric, aggregator,
+                          cohort, event_queue, kwargs, i, labels))
         p.start()
         process_queue.append(p)
 
@@ -123,11 +231,188 @@ def build_time_series(start, end, interval, metric, aggregator, cohort,
     return time_series_listener(process_queue, event_queue)
 
 
+def allocate_processes(kt, k, kr, max_processes=MAX_PROCESSES):
+    """
+        Fits the number of time series workers ``kt``, and the number of
+        processes each metric call forks over users ``k`` and revisions
+        ``kr``, into ``max_processes``.  Each worker accounts for itself
+        plus ``k * (1 + kr)`` processes.  The nested counts are halved
+        until a single worker fits, then the number of workers is reduced.
+        Returns the ``(kt, k, kr)`` tuple.
+    """
+    k, kr = max(1, k), max(0, kr)
+    while 1 + k * (1 + kr) > max_processes and (k > 1 or kr > 1):
+        if k >= kr:
+            k = max(1, k / 2)
+        else:
+            kr = max(1, kr / 2)
+    kt = max(1, min(kt, max_processes / (1 + k * (1 + kr))))
+    return kt, k, kr
+
+
+def _allocate_metric_threads(kt, kwargs):
+    """
+        Applies ``allocate_processes`` to ``kt`` workers running metrics with
+        the thread counts in ``kwargs``.  Returns the number of workers and
+        a copy of ``kwargs`` with the thread counts adjusted.
+    """
+    new_kwargs = deepcopy(kwargs)
+    threads = json.loads(new_kwargs['metric_threads']) if \
+        'metric_threads' in new_kwargs else dict()
+
+    k = threads['k_'] if 'k_' in threads else \
+        new_kwargs.get('k_', settings.__user_thread_max__)
+    kr = threads['kr_'] if 'kr_' in threads else \
+        new_kwargs.get('kr_', settings.__rev_thread_max__)
+
+    kt, threads['k_'], threads['kr_'] = allocate_processes(kt, k, kr)
+    new_kwargs['metric_threads'] = json.dumps(threads)
+    return kt, new_kwargs
+
+
+def time_series_incremental(windows, intervals, metric, aggregator, cohort,
+                            kwargs):
+    """
+        Computes time series data for all ``windows`` from a single pass
+        with ``metric.process_intervals``.  Rolling and cumulative windows
+        that the metric can not compute directly are summed from the
+        results over ``intervals`` where the metric is additive (see
+        ``_sum_windows``).  Returns None if the metric can not be decomposed
+        in either way.
+    """
+    log = bool(kwargs['log']) if 'log' in kwargs else False
+    if not windows:
+        return None
+
+    metric_kwargs = _get_metric_kwargs(kwargs)
+
+    def process(users):
+        metric_objs = metric.process_intervals(windows, users,
+                                               **metric_kwargs)
+        if metric_objs is None and windows != intervals:
+            metric_objs = _sum_windows(windows, intervals, metric, users,
+                                       metric_kwargs)
+        return metric_objs
+
+    aggregates = _aggregate_chunks(aggregator, metric, cohort, process)
+    if aggregates is None:
+        if log:
+            logging.info(__name__ + ' :: {0} can not be computed '
+                                    'incrementally.'.format(metric.__name__))
+        return None
+
+    labels = _get_labels(intervals)
+    data = list()
+    for (ts_s, ts_e), r in zip(windows, aggregates):
+        data.append([labels[str(ts_e)], str(ts_e)] + r.data)
+        progress.report_interval(data[-1])
+
+    if log:
+        logging.info(__name__ + ' :: Computed {0} intervals incrementally '
+                                'for {1}.'.format(len(data), metric.__name__))
+    return data
+
+
+def _aggregate_chunks(aggregator, metric, cohort, process):
+    """
+        Aggregates the metric objects returned by ``process``, one for each
+        window, over ``cohort``.  Cohorts of more than ``USER_CHUNK`` users
+        are processed in chunks and the partial aggregates of each window
+        are merged across chunks.  Returns the list of aggregates, or None
+        if ``process`` returns None.
+    """
+    if not USER_CHUNK or len(cohort) <= USER_CHUNK or \
+            not agg.has_partial(aggregator):
+        metric_objs = process(cohort)
+        if metric_objs is None:
+            return None
+        return [um.aggregator(aggregator, metric_obj, metric.header())
+                for metric_obj in metric_objs]
+
+    states = None
+    for index in xrange(0, len(cohort), USER_CHUNK):
+        metric_objs = process(cohort[index:index + USER_CHUNK])
+        if metric_objs is None:
+            return None
+        chunk_states = [agg.partial_aggregate(aggregator, metric_obj)
+                        for metric_obj in metric_objs]
+        states = chunk_states if states is None else \
+            [agg.merge_partials(aggregator, pair)
+             for pair in izip(states, chunk_states)]
+    return [agg.aggregate_partial(aggregator, state, metric)
+            for state in states]
+
+
+def _sum_windows(windows, intervals, metric, cohort, metric_kwargs):
+    """
+        Builds metric objects for ``windows`` from the results over
+        ``intervals`` for metrics whose fields are all additive.  Each
+        window ends on the corresponding interval.  User totals are kept
+        as running sums, adding the newest interval and, for rolling
+        windows, subtracting the interval that leaves the window.  Returns
+        None if the metric is not additive or can not be decomposed over
+        ``intervals``.
+    """
+    fields = metric._additive_fields
+    if not fields or len(fields) != len(metric.header()) - 1:
+        return None
+
+    interval_objs = metric.process_intervals(intervals, cohort,
+                                             **metric_kwargs)
+    if interval_objs is None:
+        return None
+
+    # Users are keyed on ID with a count of the intervals in the window
+    # holding a row for them
+    totals = OrderedDict()
+    counts = dict()
+
+    def add_rows(rows, sign):
+        for row in rows:
+            user = str(row[0])
+            if user not in totals:
+                totals[user] = [row[0]] + [0] * len(fields)
+                counts[user] = 0
+            for index in fields:
+                totals[user][index] += sign * row[index]
+            counts[user] += sign
+            if not counts[user]:
+                del totals[user]
+                del counts[user]
+
+    metric_objs = list()
+    first = 0
+    for i, (ts_s, ts_e) in enumerate(windows):
+        add_rows(interval_objs[i], 1)
+
+        # Drop the intervals that have left a rolling window
+        while intervals[first][0] < ts_s:
+            add_rows(interval_objs[first], -1)
+            first += 1
+
+        metric_obj = metric(datetime_start=ts_s, datetime_end=ts_e,
+                            **metric_kwargs)
+        metric_obj._results = [row[:] for row in totals.itervalues()]
+        metric_objs.append(metric_obj)
+    return metric_objs
+
+
+def _get_metric_kwargs(kwargs):
+    """ Re-map keyword args relating to thread counts for metric calls """
+    new_kwargs = deepcopy(kwargs)
+    if 'metric_threads' in new_kwargs:
+        d = json.loads(new_kwargs['metric_threads'])
+        for key in d:
+            new_kwargs[key] = d[key]
+        del new_kwargs['metric_threads']
+    return new_kwargs
+
+
 def time_series_listener(process_queue, event_queue):
     """
-        Listener for ``time_series_worker``.  Blocks and logs until all
-        processes computing time series data are complete.  Returns time
-        dependent data from metrics.
+        Listener for ``time_series_worker``.  Blocks on data from the worker
+        processes as it arrives, one message per interval, until each worker
+        has sent its sentinel.  Returns time dependent data from metrics.
 
         Parameters
         ~~~~~~~~~~
@@ -136,47 +421,60 @@ def time_series_listener(process_queue, event_queue):
                 List of active processes computing metrics data.
 
             event_queue : multiprocessing.Queue
-                Asynchronous data coming in from worker processes.
+                Asynchronous data coming in from worker processes.  Messages
+                are ``(worker index, row)`` pairs, where a row of None
+                signals that the worker has finished.
     """
     data = list()
+    active = set(xrange(len(process_queue)))
 
-    while 1:
-        # sleep before checking worker threads
-        time.sleep(PROCESS_SLEEP_TIME)
-
-        logging.info(__name__ + ' :: Time series process queue\n'
-                                '\t{0} threads. (PID = {1})'.
-            format(str(len(process_queue)), os.getpid()))
-
-        while not event_queue.empty():
-            data.extend(event_queue.get())
-        for p in process_queue:
-            if not p.is_alive():
-                p.terminate()
-                process_queue.remove(p)
-
-        # exit if all process have finished
-        if not len(process_queue):
-            break
+    while active:
+        try:
+            index, row = event_queue.get(True, timeout=EVENT_WAIT)
+        except Empty:
+            # Stop waiting on workers that exited without a sentinel
+            for index in list(active):
+                if not process_queue[index].is_alive() and \
+                        event_queue.empty():
+                    logging.error(__name__ + ' :: Time series worker exited '
+                                             'unexpectedly. (PID = {0})'.
+                        format(process_queue[index].pid))
+                    active.discard(index)
+            continue
+
+        if row is None:
+            active.discard(index)
+            logging.info(__name__ + ' :: Time series process queue\n'
+                                    '\t{0} threads. (PID = {1})'.
+                format(str(len(active)), os.getpid()))
+        else:
+            data.append(row)
+
+    # All data is in - the workers exit once their queue buffers flush
+    for p in process_queue:
+        p.join()
 
     # sort
     return sorted(data, key=operator.itemgetter(0), reverse=False)
 
 
-def time_series_worker(time_series,
+def time_series_worker(task_queue,
                        metric,
                        aggregator,
                        cohort,
                        event_queue,
-                       kwargs):
+                       kwargs,
+                       index=0,
+                       labels=None):
     """
         Worker thread which computes time series data for a set of points
 
         Parameter
         ~~~~~~~~~
 
-            time_series : list(datetime)
-                Datetimes defining series.
+            task_queue : multiprocessing.Queue
+                Intervals to compute as ``(start, end)`` datetime pairs.  The
+                worker pulls intervals until it receives None.
 
             metric : string
                 Metric name.
@@ -189,46 +487,46 @@ def time_series_worker(time_series,
 
             event_queue : multiporcessing.Queue
                 Asynchronous data-structure to communicate with parent proc.
+
+            index : int
+                Identifies the worker in its messages to the listener.
+
+            labels : dict
+                Labels of the rows keyed by the end of their interval, see
+                ``_get_labels``.  Rows are labelled by the start of their
+                interval by default.
     """
     log = bool(kwargs['log']) if 'log' in kwargs else False
 
-    data = list()
-    ts_s = time_series.next()
-    new_kwargs = deepcopy(kwargs)
+    new_kwargs = _get_metric_kwargs(kwargs)
 
-    # re-map some keyword args relating to thread counts
-    if 'metric_threads' in new_kwargs:
-        d = json.loads(new_kwargs['metric_threads'])
-        for key in d:
-            new_kwargs[key] = d[key]
-        del new_kwargs['metric_threads']
+    # Send each interval as it completes, always ending with a sentinel
+    try:
+        for ts_s, ts_e in iter(task_queue.get, None):
 
-    while 1:
-        try:
-            ts_e = time_series.next()
-        except StopIteration:
-            break
+            if log:
+                logging.info(__name__ + ' :: Processing thread:\n'
+                                        '\t{0}, {1} - {2} ...'.
+                    format(os.getpid(), str(ts_s), str(ts_e)))
 
-        if log:
-            logging.info(__name__ + ' :: Processing thread:\n'
-                                    '\t{0}, {1} - {2} ...'.format(os.getpid(),
-                                                                  str(ts_s),
-                                                                  str(ts_e)))
+            def process(users):
+                return [metric(datetime_start=ts_s, datetime_end=ts_e,
+                               **new_kwargs).process(users, **new_kwargs)]
 
-        metric_obj = metric(datetime_start=ts_s, datetime_end=ts_e, **new_kwargs).\
-            process(cohort, **new_kwargs)
+            r = _aggregate_chunks(aggregator, metric, cohort, process)[0]
 
-        r = um.aggregator(aggregator, metric_obj, metric.header())
+            if log:
+                logging.info(__name__ + ' :: Processing complete:\n'
+                                        '\t{0}, {1} - {2} ...'.
+                    format(os.getpid(), str(ts_s), str(ts_e)))
+            row = [(labels or {}).get(str(ts_e), str(ts_s)), str(ts_e)] + \
+                r.data
+            event_queue.put((index, row))
 
-        if log:
-            logging.info(__name__ + ' :: Processing complete:\n'
-                                    '\t{0}, {1} - {2} ...'.format(os.getpid(),
-                                                                  str(ts_s),
-                                                                  str(ts_e)))
-        data.append([str(ts_s), str(ts_e)] + r.data)
-        ts_s = ts_e
-
-    event_queue.put(data)
+            # Expose the completed interval to the job progress channel
+            progress.report_interval(row)
+    finally:
+        event_queue.put((index, None))
 
 
 class TimeSeriesException(Exception):
@@ -10,107 +10,232 @@
         (u'[[Category:People from Palermo]] [[Category:Sportspeople from
         Sicily|Palermo]] [[Category:Sport in Palermo|People]] [[Category:
         Sportspeople by city in Italy|Palermo]]', True    )
+
+    Many revisions are best fetched together, concurrently and cached: ::
+
+        >>> api = WPAPI.WPAPI(cache_file='diffs.db')
+        >>> added = api.getAddeds([515866670, 515866671, 515866672])
 """
 
 __author__ = "Ryan Faulkner and Aaron Halfaker"
 __date__ = "October 3rd, 2012"
 __license__ = "GPL (version 2 or later)"
 
-import sys
 import types
 import re
 import time
 import urllib
 import urllib2
 import json
+import shelve
 import htmlentitydefs
+from threading import Lock
+from multiprocessing.pool import ThreadPool
 from user_metrics.config import logging
 
+# 1. Maximum number of revision ids per API request
+# 2. Number of concurrent API requests
+# 3. Maximum API requests per second across all threads
+# 4. Number of attempts made at each API request
+# 5. Maximum number of seconds to wait between attempts
+# 6. Seconds before an API request times out
+BATCH_SIZE = 50
+THREADS = 4
+RATE_LIMIT = 10.0
+RETRIES = 8
+MAX_RETRY_WAIT = 60
+REQUEST_TIMEOUT = 60
+
+
+class WPAPIError(Exception):
+    """ Basic exception class for WPAPI requests """
+    def __init__(self, message="MediaWiki API request failed."):
+        Exception.__init__(self, message)
+
+
+class RateLimiter(object):
+    """ Spaces calls to ``wait`` across threads at most ``rate`` per second """
+
+    def __init__(self, rate=RATE_LIMIT):
+        self.interval = 1.0 / rate if rate else 0.0
+        self._next = 0.0
+        self._lock = Lock()
+
+    def wait(self):
+        with self._lock:
+            now = time.time()
+            delay = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
 
 class WPAPI:
     """
         The class itself implements functionality that allows a user to
         examine revision text.  The initializerallows the user ot specify
         the particular API.
+
+        ``getDiffs`` and ``getAddeds`` fetch many revisions at once.  The
+        revision ids are requested ``batch_size`` at a time over ``threads``
+        concurrent requests, at most ``rate_limit`` requests per second.
+        If ``cache_file`` is given diffs are kept in a shelve file keyed by
+        revision id and are only requested once.  ``uri`` may point to any
+        server implementing the API, e.g. a local stub for testing.
     """
 
     DIFF_ADD_RE = re.compile(
         r'<td class="diff-addedline"><div>(.+)</div></td>')
 
-    def __init__(self, uri='http://en.wikipedia.org/w/api.php'):
+    def __init__(self, uri='http://en.wikipedia.org/w/api.php',
+                 cache_file=None, batch_size=BATCH_SIZE, threads=THREADS,
+                 rate_limit=RATE_LIMIT):
         self.uri = uri
+        self.batch_size = batch_size
+        self.threads = threads
+        self._limiter = RateLimiter(rate_limit)
+        self._cache = shelve.open(cache_file) if cache_file else dict()
 
-    def getDiff(self, revId, retries=20):
-        attempt = 0
-        is_content = False
+    def close(self):
+        """ Closes the diff cache """
+        if hasattr(self._cache, 'close'):
+            self._cache.close()
+
+    def getDiff(self, revId, retries=RETRIES):
+        """
+            Returns the diff of a revision from its parent as a tuple of the
+            diff html and a flag that is True if the revision had no parent,
+            in which case its content is returned instead.  Returns None if
+            the revision could not be retrieved.
+        """
+        return self.getDiffs([revId], retries=retries).get(int(revId))
 
-        while attempt < retries:
+    def getDiffs(self, revIds, retries=RETRIES):
+        """
+            Returns a dict mapping revision ids to the ``(diff, is_content)``
+            tuples of ``getDiff``.  Revisions that could not be retrieved
+            are left out.
+        """
+        revIds = sorted(set(int(revId) for revId in revIds))
+        diffs = dict()
+        missing = list()
+        for revId in revIds:
+            if str(revId) in self._cache:
+                diffs[revId] = self._cache[str(revId)]
+            else:
+                missing.append(revId)
+
+        batches = [missing[i:i + self.batch_size]
+                   for i in xrange(0, len(missing), self.batch_size)]
+        if len(batches) > 1 and self.threads > 1:
+            pool = ThreadPool(min(self.threads, len(batches)))
             try:
+                results = pool.map(lambda batch:
+                                   self._fetch_diffs(batch, retries), batches)
+            finally:
+                pool.terminate()
+        else:
+            results = [self._fetch_diffs(batch, retries) for batch in batches]
+
+        for result in results:
+            for revId, diff in result.iteritems():
+                self._cache[str(revId)] = diff
+            diffs.update(result)
+        return diffs
+
+    def _fetch_diffs(self, revIds, retries):
+        """ Requests the diffs of a batch of revisions """
+        diffs = dict()
+        try:
+            # e.g. url: http://en.wikipedia.org/w/api.php?format=xml&
+            # action=query&prop=revisions&revids=472419240|472419241&
+            # rvprop=ids&rvdiffto=prev&format=json
+            revisions = self._query_revisions(revIds, retries,
+                                              rvprop='ids', rvdiffto='prev')
+
+            # The API computes a limited number of uncached diffs per
+            # request.  The remaining ones are requested on their own and
+            # are left out if they are still not computed.
+            for revision in revisions:
+                diff = revision.get('diff', {})
+                if 'notcached' not in diff:
+                    diffs[revision['revid']] = (diff.get('*', ''), False)
+                elif len(revIds) > 1:
+                    diffs.update(self._fetch_diffs([revision['revid']],
+                                                   retries))
+                else:
+                    logging.error(__name__ + ' :: Diff of revision {0} was '
+                                             'not computed by the API.'.
+                                  format(revision['revid']))
+
+            # The diff will not exist if it included the creation of the
+            # user talk page in this case simply load the content of the
+            # page at this revision
+            created = [revId for revId, (text, _) in diffs.iteritems()
+                       if type(text) not in types.StringTypes or text == '']
+            if created:
                 # e.g. url: http://en.wikipedia.org/w/api.php?format=xml&
-                # action=query&prop=revisions&revids=472419240&rvprop=ids&
-                # rvdiffto=prev&format=json
-                response = urllib2.urlopen(
-                    self.uri,
-                    urllib.urlencode({
-                        'action': 'query',
-                        'prop': 'revisions',
-                        'revids': revId,
-                        'rvprop': 'ids',
-                        'rvdiffto': 'prev',
-                        'format': 'json'
-                    })
-                )
+                # action=query&prop=revisions&revids=474338555&format=json&
+                # rvprop=content
+                for revision in self._query_revisions(created, retries,
+                                                      rvprop='ids|content'):
+                    content = revision.get('*', '')
+                    if type(content) not in types.StringTypes:
+                        content = ''
+                    diffs[revision['revid']] = (content, True)
+        except WPAPIError as e:
+            logging.error(__name__ + ' :: Could not retrieve revisions '
+                                     '{0}: {1}'.format(revIds, str(e)))
+        return diffs
+
+    def _query_revisions(self, revIds, retries, **params):
+        """ Returns the revisions listed by a ``prop=revisions`` query """
+        params.update({
+            'action': 'query',
+            'prop': 'revisions',
+            'revids': '|'.join(str(revId) for revId in revIds),
+            'format': 'json'
+        })
+        result = self._request(params, retries)
+        try:
+            pages = result['query']['pages'].values()
+        except (KeyError, AttributeError, TypeError):
+            raise WPAPIError('Unexpected response: %s' % str(result)[:200])
+        return [revision for page in pages
+                for revision in page.get('revisions', [])]
 
-                result = json.load(response)
-
-                diff = result['query']['pages'].values()[0][
-                    'revisions'][0]['diff']['*']
-
-                # The diff will not exist if it included the creation of the
-                # user talk page in this case simply load the content of the
-                # page at this revision
-                if type(diff) not in types.StringTypes or diff == '':
-
-                    # e.g. url: http://en.wikipedia.org/w/api.php?format=xml&
-                    # action=query&prop=revisions&revids=474338555&format=json&
-                    # rvprop=content
-                    response = urllib2.urlopen(
-                        self.uri,
-                        urllib.urlencode({
-                            'action': 'query',
-                            'prop': 'revisions',
-                            'revids': revId,
-                            'rvprop': 'content',
-                            'format': 'json'
-                        })
-                    )
-
-                    result = json.load(response)
-                    try:
-                        diff = result['query']['pages'].\
-                            values()[0]['revisions'][0]['*']
-                    except KeyError:
-                        sys.stderr.write("x")
-                        diff = ''
-                        pass
-
-                    # Add the diff tags such that the content is parsed as if
-                    # it were a diff
-                    if type(diff) not in types.StringTypes:
-                        diff = ''
-
-                    is_content = True
-
-                return diff, is_content
-            except urllib2.HTTPError as e:
-                time.sleep(2**attempt)
+    def _request(self, params, retries):
+        """
+            Posts a request to the API under the rate limit.  Failed
+            requests are retried with exponential backoff of at most
+            ``MAX_RETRY_WAIT`` seconds.
+        """
+        attempt = 0
+        while True:
+            self._limiter.wait()
+            try:
+                response = urllib2.urlopen(self.uri,
+                                           urllib.urlencode(params),
+                                           REQUEST_TIMEOUT)
+                return json.load(response)
+            except (urllib2.URLError, ValueError, IOError) as e:
                 attempt += 1
+                if attempt >= retries:
+                    raise WPAPIError(str(e))
+                wait = min(2 ** attempt, MAX_RETRY_WAIT)
                 logging.error("HTTP Error: %s.  Retry #%s in %s seconds..." % (
-                    e, attempt, 2**attempt))
+                    e, attempt, wait))
+                time.sleep(wait)
 
     def getAdded(self, revId):
-        diff, is_content = self.getDiff(revId)
+        return self._added(*self.getDiff(revId))
+
+    def getAddeds(self, revIds):
+        """ Returns a dict mapping revision ids to the text they added """
+        return dict((revId, self._added(*diff))
+                    for revId, diff in self.getDiffs(revIds).iteritems())
 
+    def _added(self, diff, is_content):
         if is_content:
             return diff
         else:
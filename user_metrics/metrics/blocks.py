@@ -11,6 +11,8 @@ from user_metrics.metrics import query_mod
 from user_metrics.etl.aggregator import weighted_rate, decorator_builder
 
 
+@um.register_metric('blocks',
+    aggregators={'proportion': 'block_rate_agg'})
 class Blocks(um.UserMetric):
     """
         Adapted from Aaron Hafaker's implementation -- uses the logging table
@@ -5,17 +5,25 @@ __license__ = "GPL (version 2 or later)"
 
 from user_metrics.config import logging
 
+import numpy
 from numpy import median, min, max, mean, std
 from collections import namedtuple
 import user_metric as um
 import os
 from user_metrics.etl.aggregator import list_sum_by_group, \
-    build_numpy_op_agg, build_agg_meta
+    build_numpy_op_agg, build_agg_meta, build_quantile_agg, DEFAULT_QUANTILES
 import user_metrics.utils.multiprocessing_wrapper as mpw
 from user_metrics.metrics import query_mod
-from user_metrics.metrics.users import UMP_MAP
+from user_metrics.metrics.users import UMP_MAP, USER_METRIC_PERIOD_TYPE
+from user_metrics.metrics.revision_frame import NULL_LEN, RevisionFrame, \
+    get_revision_frame, shared_revision_frame
 
 
+@um.register_metric('bytes_added',
+    aggregators={'sum': 'ba_sum_agg', 'mean': 'ba_mean_agg',
+                 'std': 'ba_std_agg', 'median': 'ba_median_agg',
+                 'min': 'ba_min_agg', 'max': 'ba_max_agg',
+                 'quantiles': 'ba_quantiles_agg'})
 class BytesAdded(um.UserMetric):
     """
         Produces a float value that reflects the rate of edit behaviour:
@@ -74,6 +82,10 @@ class BytesAdded(um.UserMetric):
             _data_model_meta['float_fields'],
         }
 
+    _registration_decomposable = True
+    _additive_fields = [1, 2, 3, 4, 5]
+    _revision_frame = True
+
     @um.pre_metrics_init
     def __init__(self, **kwargs):
         super(BytesAdded, self).__init__(**kwargs)
@@ -84,13 +96,59 @@ class BytesAdded(um.UserMetric):
         return ['user_id', 'bytes_added_net', 'bytes_added_absolute',
                 'bytes_added_pos', 'bytes_added_neg', 'edit_count']
 
+    def _empty_row(self, user):
+        return [user, 0, 0, 0, 0, 0]
+
+    @classmethod
+    def process_intervals(cls, intervals, users, **kwargs):
+        """
+            Extends ``UserMetric.process_intervals``.  Under the ``INPUT``
+            period each interval is computed from a ``RevisionFrame`` of the
+            full range: the frame bound for the job if it holds the
+            revisions, otherwise one loaded for the purpose.  Returns None
+            if the frame can not be loaded.
+        """
+        group = kwargs['group'] if 'group' in kwargs and kwargs['group'] \
+            else USER_METRIC_PERIOD_TYPE.REGISTRATION
+        if group != USER_METRIC_PERIOD_TYPE.INPUT:
+            return super(BytesAdded, cls).process_intervals(intervals, users,
+                                                            **kwargs)
+
+        metric_obj = cls(datetime_start=intervals[0][0],
+                         datetime_end=intervals[-1][1], **kwargs)
+        frame = get_revision_frame()
+        if frame is None or not frame.covers(
+                metric_obj.project, users,
+                list(UMP_MAP[group](users, metric_obj))):
+            try:
+                frame = RevisionFrame.load(users, metric_obj.project,
+                                           metric_obj.datetime_start,
+                                           metric_obj.datetime_end)
+            except query_mod.UMQueryCallError as e:
+                logging.error(__name__ + ' :: Could not load revision '
+                                         'frame: ' + str(e))
+                return None
+            if frame is None:
+                return None
+
+        with shared_revision_frame(frame):
+            return [cls(datetime_start=start, datetime_end=end,
+                        **kwargs).process(users, **kwargs)
+                    for start, end in intervals]
+
     @um.UserMetric.pre_process_metric_call
     def process(self, users, **kwargs):
         """ Setup metrics gathering using multiprocessing """
 
+        frame, periods = self._frame_periods(users)
+        if frame is not None:
+            return self._set_columns(_process_frame(frame, periods, users,
+                                                    self.namespace))
+
         # get revisions
         args = self._pack_params()
-        revs = mpw.build_thread_pool(users, _get_revisions, self.k_, args)
+        revs = mpw.build_thread_pool(users, _get_revisions, self.k_, args,
+                                     report_users=True)
 
         # Start worker threads and aggregate results for bytes added
 
@@ -109,6 +167,30 @@ class BytesAdded(um.UserMetric):
         return self
 
 
+def _process_frame(frame, periods, users, namespace):
+    """
+        Determine the bytes added by ``users`` from a ``RevisionFrame``.
+        As in ``_process_help`` the parent length of new pages is 0 and
+        revisions whose length or parent length is unknown are ignored.
+        Returns the columns of the results.
+    """
+    parent_len = numpy.where(frame.column('parent_id') == 0, 0,
+                             frame.column('parent_len'))
+    mask = frame.period_mask(periods) & frame.namespace_mask(namespace) & \
+        (frame.column('len') != NULL_LEN) & (parent_len != NULL_LEN)
+    bytes_added = frame.column('len') - parent_len
+
+    columns = [frame.sum_by_user(bytes_added, mask),
+               frame.sum_by_user(numpy.abs(bytes_added), mask),
+               frame.sum_by_user(numpy.where(bytes_added > 0,
+                                             bytes_added, 0), mask),
+               frame.sum_by_user(numpy.where(bytes_added > 0,
+                                             0, bytes_added), mask),
+               frame.count_by_user(mask)]
+    return [users] + [frame.select_users(column, users)
+                      for column in columns]
+
+
 def _get_revisions(args):
     """ Retrieve total set of revision records for users within timeframe """
     um.log_pool_worker_start(__name__, _get_revisions.__name__, args[0], args[1])
@@ -273,6 +355,10 @@ ba_min_agg = build_numpy_op_agg(build_agg_meta([min], field_prefixes),
 ba_max_agg = build_numpy_op_agg(build_agg_meta([max], field_prefixes),
                                 metric_header, 'ba_max_agg')
 
+# Build approximate "quantiles" decorator
+ba_quantiles_agg = build_quantile_agg(DEFAULT_QUANTILES, field_prefixes,
+                                      metric_header, 'ba_quantiles_agg')
+
 
 # Used for testing
 if __name__ == "__main__":
@@ -7,11 +7,13 @@ from os import getpid
 from collections import namedtuple
 import user_metric as um
 from user_metrics.metrics import query_mod
-from user_metrics.metrics.users import UMP_MAP
+from user_metrics.metrics.users import UMP_MAP, USER_METRIC_PERIOD_TYPE
 from user_metrics.utils import multiprocessing_wrapper as mpw
 from user_metrics.config import logging
+from user_metrics.utils import format_mediawiki_timestamp
 
 
+@um.register_metric('edit_count')
 class EditCount(um.UserMetric):
     """
         Produces a count of edits as well as the total number of bytes added
@@ -53,6 +55,14 @@ class EditCount(um.UserMetric):
         _data_model_meta['float_fields'],
     }
 
+    _registration_decomposable = True
+    _additive_fields = [1]
+    _revision_frame = True
+
+    # Length in seconds of the intervals of bucketed counts, see
+    # ``process_intervals``
+    _interval_len = None
+
     @um.pre_metrics_init
     def __init__(self, **kwargs):
         super(EditCount, self).__init__(**kwargs)
@@ -61,6 +71,78 @@ class EditCount(um.UserMetric):
     def header():
         return ['user_id', 'edit_count']
 
+    def _empty_row(self, user):
+        return [long(user), 0]
+
+    @classmethod
+    def process_intervals(cls, intervals, users, **kwargs):
+        """
+            Extends ``UserMetric.process_intervals``.  Under the ``INPUT``
+            period edit counts over equal length intervals are bucketed by
+            the database in a single pass over the full range.  The
+            intervals must be contiguous.
+        """
+        group = kwargs['group'] if 'group' in kwargs and kwargs['group'] \
+            else USER_METRIC_PERIOD_TYPE.REGISTRATION
+        if group != USER_METRIC_PERIOD_TYPE.INPUT:
+            return super(EditCount, cls).process_intervals(intervals, users,
+                                                           **kwargs)
+
+        interval_len = (intervals[0][1] - intervals[0][0]).total_seconds()
+        for index, (start, end) in enumerate(intervals):
+            if (end - start).total_seconds() != interval_len or \
+                    index and start != intervals[index - 1][1]:
+                return None
+
+        buckets = cls(datetime_start=intervals[0][0],
+                      datetime_end=intervals[-1][1], **kwargs)
+        buckets._interval_len = int(interval_len)
+        buckets._process_buckets(users, **kwargs)
+
+        # Rows are (user, interval index, count) - all users not appearing
+        # in an interval have an edit count of 0
+        counts = [dict() for i in xrange(len(intervals))]
+        for row in buckets:
+            try:
+                counts[int(row[1])][long(row[0])] = int(row[2])
+            except IndexError:
+                continue
+
+        user_ids = [long(user) for user in users]
+        metric_objs = list()
+        for index, (start, end) in enumerate(intervals):
+            metric_obj = cls(datetime_start=start, datetime_end=end,
+                             **kwargs)
+            metric_obj._set_columns([user_ids,
+                                     [counts[index].get(user, 0)
+                                      for user in user_ids]])
+            metric_objs.append(metric_obj)
+        return metric_objs
+
+    @um.UserMetric.pre_process_metric_call
+    def _process_buckets(self, users, **kwargs):
+        """
+            Counts the edits of ``users`` over consecutive intervals of
+            ``_interval_len`` seconds spanning the period of the metric.
+            Results are rows of (user, interval index, count).
+        """
+        args = [self._pack_params(),
+                format_mediawiki_timestamp(self.datetime_start),
+                format_mediawiki_timestamp(self.datetime_end),
+                self._interval_len]
+        self._results = mpw.build_thread_pool(users, _process_intervals_help,
+                                              self.k_, args,
+                                              report_users=True)
+        return self
+
+    def _results_key(self, users):
+        """
+            Extends ``UserMetric._results_key``.  Bucketed counts are told
+            apart from counts over the period by their interval length.
+        """
+        return super(EditCount, self)._results_key(users) + \
+            (self._interval_len,)
+
     @um.UserMetric.pre_process_metric_call
     def process(self, users, **kwargs):
         """
@@ -78,23 +160,26 @@ class EditCount(um.UserMetric):
                     stores user names or user ids
         """
 
+        user_ids = [long(user) for user in users]
+        frame, periods = self._frame_periods(users)
+        if frame is not None:
+            return self._set_columns([
+                user_ids,
+                frame.select_users(
+                    frame.count_by_user(frame.period_mask(periods)), users)])
+
         # Pack args, call thread pool
         args = self._pack_params()
         results = mpw.build_thread_pool(users, _process_help,
-                                        self.k_, args)
+                                        self.k_, args, report_users=True)
 
         # Get edit counts from query - all users not appearing have
         # an edit count of 0
-        user_set = set([long(user_id) for user_id in users])
-        edit_count = list()
-        for row in results:
-            edit_count.append([row[0], int(row[1])])
-            user_set.discard(row[0])
-        for user in user_set:
-            edit_count.append([user, 0])
-
-        self._results = edit_count
-        return self
+        edit_count = dict((long(row[0]), int(row[1])) for row in results)
+        del results
+        return self._set_columns([user_ids,
+                                  [edit_count.get(user, 0)
+                                   for user in user_ids]])
 
 
 def _process_help(args):
@@ -125,6 +210,26 @@ def _process_help(args):
     return results
 
 
+def _process_intervals_help(args):
+    """
+        Worker thread method for bucketed edit counts.
+    """
+
+    # Unpack args
+    users = args[0]
+    state, start, end, interval_len = args[1]
+
+    metric_params = um.UserMetric._unpack_params(state)
+    query_args_type = namedtuple('QueryArgs', 'date_start date_end interval')
+
+    logging.debug(__name__ + ':: Executing bucketed EditCount on '
+                             '%s users (PID = %s)' % (len(users), getpid()))
+
+    return query_mod.edit_count_intervals_user_query(
+        users, metric_params.project,
+        query_args_type(start, end, interval_len))
+
+
 # Rudimentary Testing
 if __name__ == '__main__':
     users = ['13234584', '13234503', '13234565', '13234585', '13234556']
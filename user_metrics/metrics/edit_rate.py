@@ -8,13 +8,18 @@ from dateutil.parser import parse as date_parse
 import user_metric as um
 import edit_count as ec
 from user_metrics.etl.aggregator import weighted_rate, decorator_builder, \
-    build_numpy_op_agg, build_agg_meta
+    build_numpy_op_agg, build_agg_meta, build_quantile_agg, DEFAULT_QUANTILES
 from numpy import median, min, max, mean, std
 from user_metrics.metrics.users import USER_METRIC_PERIOD_TYPE as umpt
 from user_metrics.utils import enum, format_mediawiki_timestamp
 from user_metrics.metrics.user_metric import METRIC_AGG_METHOD_KWARGS
 
 
+@um.register_metric('edit_rate',
+    query_params=[('time_unit', 'time_unit'),
+                  ('time_unit_count', 'time_unit_count')],
+    aggregators={'mean': 'edit_rate_agg', 'dist': 'er_stats_agg',
+                 'quantiles': 'er_quantiles_agg'})
 class EditRate(um.UserMetric):
     """
         Produces a float value that reflects the rate of edit behaviour
@@ -74,6 +79,9 @@ class EditRate(um.UserMetric):
         _data_model_meta['float_fields'],
     }
 
+    # Computed from EditCount
+    _revision_frame = True
+
     @um.pre_metrics_init
     def __init__(self, **kwargs):
         super(EditRate, self).__init__(**kwargs)
@@ -102,10 +110,39 @@ class EditRate(um.UserMetric):
         """
 
         # Extract edit count for given parameters
-        edit_rate = list()
         ec_kwargs = deepcopy(self.__dict__)
         e = ec.EditCount(**ec_kwargs).process(user_handle, **kwargs)
 
+        time_diff = self._time_diff()
+        edit_rate = [self._rate_row(i, time_diff) for i in e.__iter__()]
+        self._results = edit_rate
+        return self
+
+    @classmethod
+    def process_intervals(cls, intervals, users, **kwargs):
+        """
+            Extends ``UserMetric.process_intervals``.  Edit rates are derived
+            from the edit counts over each interval.
+        """
+        ec_objs = ec.EditCount.process_intervals(intervals, users, **kwargs)
+        if ec_objs is None:
+            return None
+
+        metric_objs = list()
+        for (start, end), e in zip(intervals, ec_objs):
+            metric_obj = cls(datetime_start=start, datetime_end=end, **kwargs)
+            time_diff = metric_obj._time_diff()
+            metric_obj._results = [metric_obj._rate_row(i, time_diff)
+                                   for i in e.__iter__()]
+            metric_objs.append(metric_obj)
+        return metric_objs
+
+    def _time_diff(self):
+        """
+            Compute the length of the measured period normalized by the
+            time unit.
+        """
+
         # Compute time difference between datetime objects and get the
         # integer number of seconds
 
@@ -131,15 +168,14 @@ class EditRate(um.UserMetric):
             time_diff = time_diff_sec / (60 * 60)
         else:
             time_diff = time_diff_sec
+        return time_diff
 
-        # Build the list of edit rate metrics
-        for i in e.__iter__():
-            new_i = i[:]  # Make a copy of the edit count element
-            new_i.append(new_i[1] / (time_diff * self.time_unit_count))
-            new_i.append(time_diff)
-            edit_rate.append(new_i)
-        self._results = edit_rate
-        return self
+    def _rate_row(self, row, time_diff):
+        """ Build an edit rate row from an edit count row """
+        new_i = row[:]  # Make a copy of the edit count element
+        new_i.append(new_i[1] / (time_diff * self.time_unit_count))
+        new_i.append(time_diff)
+        return new_i
 
 
 # ==========================
@@ -175,3 +211,7 @@ er_stats_agg = build_numpy_op_agg(build_agg_meta(op_list, field_prefixes),
 
 agg_kwargs = getattr(er_stats_agg, METRIC_AGG_METHOD_KWARGS)
 setattr(er_stats_agg, METRIC_AGG_METHOD_KWARGS, agg_kwargs)
+
+# Build approximate "quantiles" decorator
+er_quantiles_agg = build_quantile_agg(DEFAULT_QUANTILES, field_prefixes,
+                                      metric_header, 'er_quantiles_agg')
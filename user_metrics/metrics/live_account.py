@@ -16,6 +16,8 @@ from user_metrics.etl.aggregator import decorator_builder, boolean_rate
 from user_metrics.metrics import query_mod
 
 
+@um.register_metric('live_account',
+    aggregators={'proportion': 'live_accounts_agg'})
 class LiveAccount(um.UserMetric):
     """
         Skeleton class for "live account" metric:
@@ -88,7 +90,8 @@ class LiveAccount(um.UserMetric):
 
         args = self._pack_params()
         self._results = mpw.build_thread_pool(user_handle, _process_help,
-                                              self.k_, args)
+                                              self.k_, args,
+                                              report_users=True)
         return self
 
 
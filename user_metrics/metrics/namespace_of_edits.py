@@ -9,12 +9,15 @@ from user_metrics.config import logging
 import user_metric as um
 import user_metrics.utils.multiprocessing_wrapper as mpw
 from collections import namedtuple, OrderedDict
-from user_metrics.etl.aggregator import decorator_builder
+from user_metrics.etl.aggregator import decorator_builder, merge_sums, \
+    PartialAggregator
 from os import getpid
 from user_metrics.metrics import query_mod
 from user_metrics.metrics.users import UMP_MAP
 
 
+@um.register_metric('namespace_edits',
+    aggregators={'sum': 'namespace_edits_sum'})
 class NamespaceEdits(um.UserMetric):
     """
         Skeleton class for "namespace of edits" metric:
@@ -76,6 +79,9 @@ class NamespaceEdits(um.UserMetric):
         _data_model_meta['float_fields'],
     }
 
+    _registration_decomposable = True
+    _revision_frame = True
+
     @um.pre_metrics_init
     def __init__(self, **kwargs):
         super(NamespaceEdits, self).__init__(**kwargs)
@@ -91,13 +97,37 @@ class NamespaceEdits(um.UserMetric):
         if not hasattr(user_handle, '__iter__'):
             user_handle = [user_handle]
 
+        frame, periods = self._frame_periods(user_handle)
+        if frame is not None:
+            self._results = _process_frame(frame, periods)
+            return self
+
         # Multiprocessing vs. single processing execution
         args = self._pack_params()
         self._results = mpw.build_thread_pool(user_handle, _process_help,
-                                              self.k_, args)
+                                              self.k_, args,
+                                              report_users=True)
         return self
 
 
+def _process_frame(frame, periods):
+    """ Tally the namespace edits of users from a ``RevisionFrame`` """
+    mask = frame.period_mask(periods)
+    users = [period.user for period in periods]
+    namespaces = frame.column('namespace')
+
+    counts = OrderedDict()
+    for ns in NamespaceEdits.VALID_NAMESPACES:
+        counts[str(ns)] = frame.select_users(
+            frame.count_by_user(mask & (namespaces == ns)), users).tolist()
+
+    results = list()
+    for index, user in enumerate(users):
+        results.append((str(user), OrderedDict((ns, counts[ns][index])
+                                               for ns in counts)))
+    return results
+
+
 def _process_help(args):
     """
         Worker thread method for NamespaceOfEdits::process().
@@ -166,6 +196,28 @@ setattr(namespace_edits_sum, um.METRIC_AGG_METHOD_HEAD, ['type',
                                                          'total_editors',
                                                          'reverted_editors'])
 
+
+def _namespace_edits_partial(iter):
+    """ Partial form of ``namespace_edits_sum`` """
+    summed = dict((str(ns), 0) for ns in NamespaceEdits.VALID_NAMESPACES)
+    for r in iter:
+        try:
+            for ns in NamespaceEdits.VALID_NAMESPACES:
+                summed[str(ns)] += r[1][str(ns)]
+        except (IndexError, TypeError):
+            continue
+    return summed
+
+
+def _namespace_edits_final(state):
+    return ["namespace_edits_sum",
+            OrderedDict((str(ns), state[str(ns)])
+                        for ns in NamespaceEdits.VALID_NAMESPACES)]
+
+setattr(namespace_edits_sum, um.METRIC_AGG_METHOD_PARTIAL,
+        PartialAggregator(_namespace_edits_partial, merge_sums,
+                          _namespace_edits_final))
+
 if __name__ == "__main__":
     users = ['17792132', '17797320', '17792130', '17792131',
              '17792136', 13234584, 156171]
@@ -10,9 +10,11 @@ from numpy import mean, std, median
 import user_metrics.utils.multiprocessing_wrapper as mpw
 import user_metric as um
 from user_metrics.metrics import query_mod
-from user_metrics.metrics.users import UMP_MAP
+from user_metrics.metrics.users import UMP_MAP, USER_METRIC_PERIOD_DATA
 
 
+@um.register_metric('pages_created',
+    aggregators={'dist': 'pages_created_stats_agg'})
 class PagesCreated(um.UserMetric):
     """
     Skeleton class for "PagesCreated" metric:
@@ -50,6 +52,8 @@ class PagesCreated(um.UserMetric):
         'list_sum_indices': _data_model_meta['integer_fields'],
     }
 
+    _revision_frame = True
+
     @um.pre_metrics_init
     def __init__(self, **kwargs):
         super(PagesCreated, self).__init__(**kwargs)
@@ -61,13 +65,43 @@ class PagesCreated(um.UserMetric):
     @um.UserMetric.pre_process_metric_call
     def process(self, users, **kwargs):
 
+        # Pages are counted over the period of the metric, which the frame
+        # may not cover
+        frame, periods = self._frame_periods(users)
+        if frame is not None:
+            results = _process_frame(frame, periods, self)
+            if results is not None:
+                self._results = results
+                return self
+
         # Process results
         args = self._pack_params()
         self._results = mpw.build_thread_pool(users, _process_help,
-                                              self.k_, args)
+                                              self.k_, args,
+                                              report_users=True)
         return self
 
 
+def _process_frame(frame, periods, metric):
+    """
+        Count the pages created from a ``RevisionFrame``.  As in
+        ``pages_created_query`` pages are counted over the period of the
+        metric for each user with a period.
+    """
+    periods = [USER_METRIC_PERIOD_DATA(period.user, metric.datetime_start,
+                                       metric.datetime_end)
+               for period in periods]
+    if not frame.covers(metric.project, [], periods):
+        return None
+
+    mask = frame.period_mask(periods, closed='right') & \
+        frame.namespace_mask(metric.namespace) & \
+        (frame.column('parent_id') == 0)
+    users = [period.user for period in periods]
+    counts = frame.select_users(frame.count_by_user(mask), users)
+    return [(str(user), int(count)) for user, count in zip(users, counts)]
+
+
 def _process_help(args):
     """ Used by Threshold::process() for forking.
         Should not be called externally. """
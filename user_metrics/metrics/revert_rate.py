@@ -16,6 +16,10 @@ from user_metrics.metrics.users import UMP_MAP
 from user_metrics.utils import format_mediawiki_timestamp
 
 
+@um.register_metric('revert_rate',
+    query_params=[('look_back', 'look_back'), ('look_ahead', 'look_ahead')],
+    aggregators={'mean': 'revert_rate_avg'},
+    cost=um.METRIC_COST.EXPENSIVE)
 class RevertRate(um.UserMetric):
     """
         Skeleton class for "RevertRate" metric:
@@ -79,6 +83,8 @@ class RevertRate(um.UserMetric):
                              _data_model_meta['float_fields'],
         }
 
+    _registration_decomposable = True
+
     @um.pre_metrics_init
     def __init__(self, **kwargs):
         super(RevertRate, self).__init__(**kwargs)
@@ -95,7 +101,8 @@ class RevertRate(um.UserMetric):
 
         args = self._pack_params()
         self._results = mpw.build_thread_pool(user_handle, _process_help,
-                                              self.k_, args)
+                                              self.k_, args,
+                                              report_users=True)
 
         return self
 
@@ -0,0 +1,275 @@
+"""
+    This module defines a frame of the revisions made by a cohort which is
+    loaded once per API job and shared by the metrics computed in the job.
+    Metrics such as ``EditCount``, ``BytesAdded``, ``NamespaceEdits``,
+    ``Threshold`` and ``PagesCreated`` are reductions over the same
+    ``revision JOIN page`` rows.  Each otherwise queries these rows for
+    every user, and ``BytesAdded`` also queries every parent revision.
+    ``RevisionFrame`` loads the rows with one query per chunk of users and
+    stores them as one NumPy array per field::
+
+        user, timestamp, page, namespace, len, parent_len, parent_id
+
+    Timestamps are stored as integers, e.g. 20130101000000, and unknown
+    lengths as ``NULL_LEN``.  A job binds a frame, or a function loading
+    the frame when it is first used, with ``shared_revision_frame``.  While
+    it is bound, metrics that hold the revisions of their users over their
+    periods in the frame compute from it (see ``RevisionFrame.covers``).
+    Otherwise they query the database as before. ::
+
+        >>> frame = RevisionFrame.load(users, 'enwiki', '20130101000000',
+                                       '20130201000000')
+        >>> with shared_revision_frame(frame):
+        ...     EditCount(datetime_start='20130101000000', ...).process(users)
+
+    A frame loaded before metric worker processes are forked is shared with
+    the workers.
+"""
+
+__author__ = {
+    "ryan faulkner": "rfaulkner@wikimedia.org"
+}
+__date__ = "2013-06-20"
+__license__ = "GPL (version 2 or later)"
+
+import numpy
+from collections import namedtuple
+from contextlib import contextmanager
+from operator import itemgetter
+
+from user_metrics.config import logging, settings
+from user_metrics.metrics import query_mod
+from user_metrics.utils import format_mediawiki_timestamp
+
+# Fields of the frame, in the order of the columns of
+# ``revision_frame_query``
+FRAME_FIELDS = ['user', 'timestamp', 'page', 'namespace', 'len',
+                'parent_len', 'parent_id']
+
+# Stands for unknown values, e.g. the length of a parent revision that is
+# missing from the database
+NULL_LEN = -1
+
+# Number of users whose revisions are queried at a time
+FRAME_USER_CHUNK = 1000
+
+# Frames of more revisions are not loaded, the metrics of the job then
+# query the database themselves.  0 disables frames.
+FRAME_MAX_ROWS = getattr(settings, '__revision_frame_max_rows__', 5000000)
+
+# Frame bound for the job, see ``shared_revision_frame``
+_revision_frame = None
+
+
+@contextmanager
+def shared_revision_frame(frame):
+    """
+        Binds ``frame`` for the metrics processed within this block.
+        ``frame`` may instead be a function returning the frame, or None,
+        which is called when the frame is first used.
+    """
+    global _revision_frame
+    outer = _revision_frame
+    _revision_frame = frame
+    try:
+        yield frame
+    finally:
+        _revision_frame = outer
+
+
+def get_revision_frame():
+    """ Returns the frame bound for the job, or None """
+    global _revision_frame
+    if callable(_revision_frame):
+        _revision_frame = _revision_frame()
+    return _revision_frame
+
+
+def timestamp_value(timestamp):
+    """ Returns a timestamp as an integer, e.g. 20130101000000 """
+    return int(format_mediawiki_timestamp(timestamp))
+
+
+def _field_value(value):
+    return NULL_LEN if value is None else long(value)
+
+
+class RevisionFrame(object):
+    """
+        Revisions of a set of users between ``start`` and ``end``, both
+        inclusive, in one project.  Revisions are sorted by user and
+        timestamp.  Reductions by user, e.g. ``count_by_user``, return
+        arrays aligned with ``users``, the sorted IDs of the users of the
+        frame.  The frame is read only.
+    """
+
+    def __init__(self, project, users, start, end, columns):
+        if len(columns) != len(FRAME_FIELDS) or \
+                len(set(len(column) for column in columns)) > 1:
+            raise RevisionFrameError('Columns must match the frame fields '
+                                     'and have equal lengths.')
+        self.project = project
+        self.users = numpy.unique(numpy.array([long(user) for user in users],
+                                              dtype=numpy.int64))
+        self.start = timestamp_value(start)
+        self.end = timestamp_value(end)
+
+        columns = [numpy.asarray(column, dtype=numpy.int64)
+                   for column in columns]
+        order = numpy.lexsort((columns[1], columns[0]))
+        self._columns = dict((field, column[order])
+                             for field, column in zip(FRAME_FIELDS, columns))
+        self._user_index = numpy.searchsorted(self.users,
+                                              self._columns['user'])
+
+    @staticmethod
+    def _row_columns(rows):
+        """ Returns the field arrays of rows of ``revision_frame_query`` """
+        return [numpy.fromiter((_field_value(value) for value in
+                                map(itemgetter(index), rows)),
+                               dtype=numpy.int64, count=len(rows))
+                for index in xrange(len(FRAME_FIELDS))]
+
+    @classmethod
+    def from_rows(cls, rows, project, users, start, end):
+        """ Builds the frame from rows of ``revision_frame_query`` """
+        return cls(project, users, start, end, cls._row_columns(rows))
+
+    @classmethod
+    def load(cls, users, project, start, end, max_rows=FRAME_MAX_ROWS):
+        """
+            Queries the revisions of ``users`` between ``start`` and
+            ``end``.  Returns None if there are more than ``max_rows``.
+        """
+        if not max_rows:
+            return None
+        users = list(users)
+        args = namedtuple('QueryArgs', 'date_start date_end')(
+            format_mediawiki_timestamp(start), format_mediawiki_timestamp(end))
+
+        # The rows of each chunk are converted to arrays as they are fetched
+        # rather than held until all chunks are fetched
+        chunks = [cls._row_columns([])]
+        total = 0
+        for index in xrange(0, len(users), FRAME_USER_CHUNK):
+            rows = query_mod.revision_frame_query(
+                users[index:index + FRAME_USER_CHUNK], project, args)
+            total += len(rows)
+            if total > max_rows:
+                logging.info(__name__ + ' :: Revisions of {0} users exceed '
+                                        '{1} rows, not loading a frame.'.
+                             format(len(users), max_rows))
+                return None
+            chunks.append(cls._row_columns(rows))
+
+        columns = [numpy.concatenate(column) for column in zip(*chunks)]
+        frame = cls(project, users, start, end, columns)
+        logging.info(__name__ + ' :: Loaded {0} revisions of {1} users '
+                                '({2} bytes).'.format(len(frame),
+                                                      len(frame.users),
+                                                      frame.nbytes))
+        return frame
+
+    def __len__(self):
+        return len(self._columns['user'])
+
+    @property
+    def nbytes(self):
+        """ Bytes held by the column arrays """
+        return sum(column.nbytes for column in self._columns.itervalues())
+
+    def column(self, field):
+        """
+            Returns the array for ``field``, one of ``FRAME_FIELDS``.  The
+            array is not copied and must not be modified.
+        """
+        return self._columns[field]
+
+    def covers(self, project, users, periods):
+        """
+            Whether the frame holds the revisions of ``users`` and of the
+            users of ``periods``, ``USER_METRIC_PERIOD_DATA`` records, over
+            their periods.
+        """
+        if project != self.project:
+            return False
+        users = [long(user) for user in users] + \
+            [long(period.user) for period in periods]
+        if not numpy.in1d(users, self.users).all():
+            return False
+        return all(timestamp_value(period.start) >= self.start and
+                   timestamp_value(period.end) <= self.end
+                   for period in periods)
+
+    def period_mask(self, periods, closed='left'):
+        """
+            Flags the revisions made by each user within the user's period
+            in ``periods``, ``USER_METRIC_PERIOD_DATA`` records.  Periods
+            are closed on the ``'left'`` (start <= timestamp < end), as in
+            most revision queries, or on the ``'right'``
+            (start < timestamp <= end).
+        """
+        if not periods:
+            return numpy.zeros(len(self), dtype=bool)
+
+        period_users = numpy.array([long(p.user) for p in periods],
+                                   dtype=numpy.int64)
+        starts = numpy.array([timestamp_value(p.start) for p in periods],
+                             dtype=numpy.int64)
+        ends = numpy.array([timestamp_value(p.end) for p in periods],
+                           dtype=numpy.int64)
+        order = numpy.argsort(period_users, kind='mergesort')
+        period_users, starts, ends = \
+            period_users[order], starts[order], ends[order]
+
+        users = self._columns['user']
+        timestamps = self._columns['timestamp']
+        index = numpy.searchsorted(period_users, users).clip(
+            0, len(period_users) - 1)
+
+        if closed == 'left':
+            within = (timestamps >= starts[index]) & \
+                (timestamps < ends[index])
+        else:
+            within = (timestamps > starts[index]) & \
+                (timestamps <= ends[index])
+        return (period_users[index] == users) & within
+
+    def namespace_mask(self, namespace):
+        """
+            Flags the revisions of pages in ``namespace``, a list of
+            namespaces or a single one.  Any other value flags all
+            revisions, as ``query_calls_sql.format_namespace`` does.
+        """
+        namespaces = self._columns['namespace']
+        if hasattr(namespace, '__iter__'):
+            return numpy.in1d(namespaces, [int(ns) for ns in namespace])
+        try:
+            return namespaces == int(namespace)
+        except (TypeError, ValueError):
+            return numpy.ones(len(self), dtype=bool)
+
+    def count_by_user(self, mask):
+        """ Counts the flagged revisions of each user """
+        return numpy.bincount(self._user_index[mask],
+                              minlength=len(self.users))
+
+    def sum_by_user(self, values, mask):
+        """ Sums the flagged ``values``, aligned with the rows, by user """
+        return numpy.bincount(self._user_index[mask], weights=values[mask],
+                              minlength=len(self.users)).round().astype(
+                                  numpy.int64)
+
+    def select_users(self, values, users):
+        """
+            Returns the elements of ``values``, aligned with ``self.users``,
+            for ``users`` which must be users of the frame.
+        """
+        return values[numpy.searchsorted(self.users,
+                                         [long(user) for user in users])]
+
+
+class RevisionFrameError(Exception):
+    """ Basic exception class for revision frames """
+    def __init__(self, message="Could not build revision frame."):
+        Exception.__init__(self, message)
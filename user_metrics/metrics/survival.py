@@ -8,6 +8,8 @@ import threshold as th
 from user_metrics.etl.aggregator import decorator_builder, boolean_rate
 
 
+@um.register_metric('survival',
+    aggregators={'proportion': 'survival_editors_agg'})
 class Survival(um.UserMetric):
     """
         Boolean measure of the retention of editors. Editors are considered
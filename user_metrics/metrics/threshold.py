@@ -13,6 +13,9 @@ from user_metrics.metrics import query_mod
 from user_metrics.metrics.users import UMP_MAP
 
 
+@um.register_metric('threshold',
+    query_params=[('n', 'n')],
+    aggregators={'proportion': 'threshold_editors_agg'})
 class Threshold(um.UserMetric):
     """
         Boolean measure: Did an editor reach some threshold of activity (e.g.
@@ -63,6 +66,9 @@ class Threshold(um.UserMetric):
         'list_sum_indices': _data_model_meta['boolean_fields'],
     }
 
+    _registration_decomposable = True
+    _revision_frame = True
+
     @um.pre_metrics_init
     def __init__(self, **kwargs):
         super(Threshold, self).__init__(**kwargs)
@@ -90,13 +96,33 @@ class Threshold(um.UserMetric):
                 determine survival rather than a threshold metric
         """
 
+        # Survival counts revisions after the period, beyond any frame
+        frame, periods = self._frame_periods(users) if not self.survival_ \
+            else (None, None)
+        if frame is not None:
+            return self._set_columns(_process_frame(frame, periods,
+                                                    self.namespace, self.n))
+
         # Process results
         args = self._pack_params()
         self._results = mpw.build_thread_pool(users, _process_help,
-                                              self.k_, args)
+                                              self.k_, args,
+                                              report_users=True)
         return self
 
 
+def _process_frame(frame, periods, namespace, n):
+    """
+        Determine from a ``RevisionFrame`` whether users reached ``n``.
+        Returns the columns of the results.
+    """
+    mask = frame.period_mask(periods, closed='right') & \
+        frame.namespace_mask(namespace)
+    users = [long(period.user) for period in periods]
+    counts = frame.select_users(frame.count_by_user(mask), users)
+    return [users, (counts >= int(n)).astype(int)]
+
+
 def _process_help(args):
     """ Used by Threshold::process() for forking.
         Should not be called externally. """
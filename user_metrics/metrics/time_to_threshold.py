@@ -10,7 +10,7 @@ from os import getpid
 from dateutil.parser import parse as date_parse
 import user_metric as um
 from user_metrics.etl.aggregator import weighted_rate, decorator_builder, \
-    build_numpy_op_agg, build_agg_meta
+    build_numpy_op_agg, build_agg_meta, build_quantile_agg, DEFAULT_QUANTILES
 from user_metrics.metrics import query_mod
 from numpy import median, min, max
 import user_metrics.utils.multiprocessing_wrapper as mpw
@@ -20,6 +20,11 @@ LAST_EDIT = -1
 REGISTRATION = 0
 
 
+@um.register_metric('time_to_threshold',
+    query_params=[('threshold_type', 'threshold_type_class')],
+    aggregators={'mean': 'ttt_avg_agg', 'dist': 'ttt_stats_agg',
+                 'quantiles': 'ttt_quantiles_agg'},
+    cost=um.METRIC_COST.EXPENSIVE)
 class TimeToThreshold(um.UserMetric):
     """
         Produces an integer value representing the number of minutes taken to
@@ -92,7 +97,8 @@ class TimeToThreshold(um.UserMetric):
 
         args = self._pack_params()
         self._results = mpw.build_thread_pool(users, _process_help,
-                                              self.k_, args)
+                                              self.k_, args,
+                                              report_users=True)
 
         return self
 
@@ -200,6 +206,10 @@ ttt_stats_agg = build_numpy_op_agg(build_agg_meta(op_list, field_prefixes),
                                    metric_header,
                                    'ttt_stats_agg')
 
+# Build approximate "quantiles" decorator
+ttt_quantiles_agg = build_quantile_agg(DEFAULT_QUANTILES, field_prefixes,
+                                       metric_header, 'ttt_quantiles_agg')
+
 
 if __name__ == "__main__":
     for i in TimeToThreshold(threshold_type_class='edit_count_threshold',
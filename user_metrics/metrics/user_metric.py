@@ -51,10 +51,22 @@ __license__ = "GPL (version 2 or later)"
 from user_metrics.config import logging
 
 import user_metrics.etl.data_loader as dl
+import user_metrics.utils.progress as progress
 from collections import namedtuple
-from user_metrics.metrics.users import USER_METRIC_PERIOD_TYPE
-from user_metrics.utils import build_namedtuple
+from user_metrics.metrics.users import USER_METRIC_PERIOD_TYPE, \
+    get_registration_dates, UMP_MAP
+from user_metrics.metrics.revision_frame import get_revision_frame
+from dateutil.parser import parse as date_parse
+from user_metrics.utils import build_namedtuple, format_mediawiki_timestamp, \
+    enum
+from user_metrics.utils.columnar import ColumnarResults, ColumnarResultsError
+from user_metrics.utils.registry import LazyRegistry, RegistryError
+from contextlib import contextmanager
+from importlib import import_module
 from os import getpid
+from sys import modules
+import ast
+import pkgutil
 import user_metrics.config.settings as conf
 
 
@@ -70,6 +82,137 @@ def pre_metrics_init(init_f):
 
     return wrapper
 
+
+# METRIC REGISTRATION
+# ###################
+
+# Relative cost of computing a metric.  The API runs a limited number of
+# expensive metric jobs at once, see ``request_manager.job_control``.
+METRIC_COST = enum(CHEAP='cheap', EXPENSIVE='expensive')
+
+# Package holding the metric modules.  Further modules defining metrics may
+# be listed in the ``__metric_modules__`` setting.
+METRIC_PACKAGE = 'user_metrics.metrics'
+
+
+def _metric_declarations(module_name):
+    """
+        Returns the ``(handle, class path)`` pairs of the classes decorated
+        with ``register_metric`` in a module.  The source of the module is
+        parsed, the module is not imported.
+    """
+    loader = pkgutil.get_loader(module_name)
+    source = loader.get_source(module_name) if loader else None
+    if source is None:
+        raise ImportError('No source for module "{0}"'.format(module_name))
+
+    declarations = list()
+    for node in ast.parse(source).body:
+        if not isinstance(node, ast.ClassDef):
+            continue
+        for decorator in node.decorator_list:
+            func = getattr(decorator, 'func', None)
+            name = getattr(func, 'attr', getattr(func, 'id', None))
+            if name == register_metric.__name__ and decorator.args and \
+                    isinstance(decorator.args[0], ast.Str):
+                declarations.append((decorator.args[0].s,
+                                     module_name + '.' + node.name))
+    return declarations
+
+
+def _declare_metrics(registry):
+    """
+        Declares the metrics registered in the metric modules by reading
+        their source, so that metrics are discovered without importing them
+    """
+    package = import_module(METRIC_PACKAGE)
+    module_names = [METRIC_PACKAGE + '.' + name for _, name, is_pkg in
+                    pkgutil.iter_modules(package.__path__) if not is_pkg]
+    module_names += list(getattr(conf, '__metric_modules__', []))
+
+    for module_name in module_names:
+        try:
+            for handle, path in _metric_declarations(module_name):
+                registry.declare(handle, path)
+        except (ImportError, SyntaxError) as e:
+            logging.error(__name__ + ' :: Could not read metric module '
+                                     '"{0}": {1}'.format(module_name, e))
+
+# Metric classes keyed by API handle.  Metrics are declared by the path of
+# their class, found in the source of the metric modules, so that listing or
+# checking handles imports nothing.  The module of a metric is imported when
+# the metric is first looked up, and its ``register_metric`` decorator then
+# records the metric's registration.
+metric_registry = LazyRegistry(loader=_declare_metrics)
+
+
+def register_metric(handle, query_params=None, aggregators=None,
+                    cost=METRIC_COST.CHEAP):
+    """
+        Class decorator registering a ``UserMetric`` subclass with the API
+        under ``handle``::
+
+            **query_params** - list of (query string var, metric param)
+                pairs accepted in addition to the parameters common to all
+                metrics.
+            **aggregators** - dict of aggregator handles, e.g. 'mean', to
+                the names of the aggregators in the module of the metric.
+            **cost** - one of ``METRIC_COST``, used to schedule requests.
+
+        e.g. ::
+
+            @um.register_metric('threshold', query_params=[('n', 'n')],
+                                aggregators={'proportion':
+                                             'threshold_editors_agg'})
+            class Threshold(um.UserMetric):
+                ...
+
+        The class must be the one declared for ``handle``, see
+        ``metric_registry``, or ``RegistryError`` is raised.
+    """
+    def register(cls):
+        path = cls.__module__ + '.' + cls.__name__
+        if metric_registry.get_path(handle) != path:
+            raise RegistryError('Metric "{0}" is declared as {1}, not {2}.'.
+                                format(handle,
+                                       metric_registry.get_path(handle),
+                                       path))
+        cls._handle = handle
+        cls._query_params = list(query_params or [])
+        cls._aggregators = dict(aggregators or {})
+        cls._cost = cost
+        metric_registry.register(handle, cls)
+        return cls
+
+    return register
+
+
+# Store metric results as typed columns, see ``UserMetric.to_columnar``.
+# Metrics that compute their results column by column store them so
+# directly.
+COLUMNAR_RESULTS = getattr(conf, '__columnar_results__', True)
+
+# Results of the metrics processed within a ``shared_results`` block keyed
+# on metric type, parameters and users.  None outside of such a block.
+_shared_results = None
+
+
+@contextmanager
+def shared_results():
+    """
+        Within this block a metric processed again over the same users with
+        the same parameters reuses its earlier results, e.g. the EditCount
+        computed by EditRate when both are requested in one API job.
+    """
+    global _shared_results
+    outer = _shared_results
+    if outer is None:
+        _shared_results = dict()
+    try:
+        yield
+    finally:
+        _shared_results = outer
+
 # Define aggregator processing methods, method attributes, and namedtuple
 # class for packaging aggregate data
 
@@ -79,10 +222,12 @@ def pre_metrics_init(init_f):
 # 2. header attribute for a type of metric aggregation methods
 # 3. name attribute for a type of metric aggregation methods
 # 4. keyword arg attribute for a type of metric aggregation methods
+# 5. mergeable partial form of metric aggregation methods
 METRIC_AGG_METHOD_FLAG = 'metric_agg_flag'
 METRIC_AGG_METHOD_HEAD = 'metric_agg_head'
 METRIC_AGG_METHOD_NAME = 'metric_agg_name'
 METRIC_AGG_METHOD_KWARGS = 'metric_agg_kwargs'
+METRIC_AGG_METHOD_PARTIAL = 'metric_agg_partial'
 
 # Class for storing aggregate data
 aggregate_data_class = namedtuple("AggregateData", "header data")
@@ -107,7 +252,7 @@ def aggregator(agg_method, metric, data_header):
         # Generic aggregators that are metric agnostic
         agg_header = ['type'] + [
             data_header[i] for i in metric._agg_indices[agg_method.__name__]]
-        data = [agg_method.__name__] + agg_method(metric.__iter__(),
+        data = [agg_method.__name__] + agg_method(metric,
                                                   metric._agg_indices[
                                                   agg_method.__name__])
     return aggregate_data_class(agg_header, data)
@@ -154,6 +299,25 @@ class UserMetric(object):
     _data_model_meta = dict()
     _agg_indices = dict()
 
+    # Registration of the metric with the API, see ``register_metric``
+    _handle = None
+    _query_params = []
+    _aggregators = dict()
+    _cost = METRIC_COST.CHEAP
+
+    # Flags metrics whose result for a user depends only on the period
+    # defined by that user's registration.  See ``process_intervals``.
+    _registration_decomposable = False
+
+    # Flags metrics that may compute from the revision frame of a job, see
+    # ``_frame_periods``
+    _revision_frame = False
+
+    # Indices of result fields that sum over consecutive periods, e.g. edit
+    # counts.  A metric whose fields are all additive may be measured over
+    # a window by summing its results over the intervals in the window.
+    _additive_fields = []
+
     # Structure that defines parameters for UserMetric class
     _param_types = {
         'init': {
@@ -253,6 +417,34 @@ class UserMetric(object):
     def __iter__(self):
         return (r for r in self._results)
 
+    def to_columnar(self):
+        """
+            Converts the results to a ``ColumnarResults`` container, one
+            typed array per header field.  Iteration over the metric is
+            unchanged.  Results that do not fit the header are left as
+            rows.
+        """
+        if not isinstance(self._results, ColumnarResults):
+            try:
+                self._results = ColumnarResults.from_rows(
+                    self._results, self.header(), self._data_model_meta)
+            except ColumnarResultsError as e:
+                logging.debug(__name__ + ' :: Keeping results of {0} as '
+                                         'rows: {1}'.format(
+                                             self.__class__.__name__, e))
+        return self
+
+    def _set_columns(self, columns):
+        """
+            Sets the results from ``columns``, one sequence of values per
+            header field, without building a row for each user.  They are
+            stored as rows if ``COLUMNAR_RESULTS`` is not set.
+        """
+        results = ColumnarResults.from_columns(columns, self.header(),
+                                               self._data_model_meta)
+        self._results = results if COLUMNAR_RESULTS else results.to_rows()
+        return self
+
     @classmethod
     def _construct_data_point(cls):
         return namedtuple(cls.__name__, cls.header())
@@ -273,6 +465,71 @@ class UserMetric(object):
     def header():
         raise NotImplementedError()
 
+    @classmethod
+    def get_aggregator(cls, agg_handle):
+        """
+            Returns the aggregator registered for the metric under
+            ``agg_handle``.  Raises ``KeyError`` if there is none.
+        """
+        return getattr(modules[cls.__module__], cls._aggregators[agg_handle])
+
+    def _empty_row(self, user):
+        """
+            The row reported for a user that has no period over which the
+            metric is measured.  None if such users are omitted from the
+            results.
+        """
+        return None
+
+    @classmethod
+    def process_intervals(cls, intervals, users, **kwargs):
+        """
+            Computes the metric for each of ``intervals``, a list of
+            ``(start, end)`` datetime pairs, without processing each interval
+            separately.  Returns a list of processed metric objects, one for
+            each interval, or None if the metric cannot be decomposed in this
+            way.  In that case each interval must be processed separately.
+
+            Under the ``REGISTRATION`` period a user's result does not depend
+            on the interval, it only determines whether the user registered
+            within it.  For metrics that flag ``_registration_decomposable``
+            the metric is computed once over the full range and each result
+            is assigned to the intervals containing the user's registration.
+        """
+        group = kwargs['group'] if 'group' in kwargs and kwargs['group'] \
+            else USER_METRIC_PERIOD_TYPE.REGISTRATION
+        if not cls._registration_decomposable or \
+                group != USER_METRIC_PERIOD_TYPE.REGISTRATION:
+            return None
+
+        metric_obj = cls(datetime_start=intervals[0][0],
+                         datetime_end=intervals[-1][1],
+                         **kwargs).process(users, **kwargs)
+        results = dict((str(row[0]), row) for row in metric_obj)
+
+        reg = dict((str(row[0]), date_parse(row[1])) for row in
+                   get_registration_dates(users, metric_obj.project))
+
+        metric_objs = list()
+        for start, end in intervals:
+            interval_obj = cls(datetime_start=start, datetime_end=end,
+                               **kwargs)
+            start = date_parse(format_mediawiki_timestamp(start))
+            end = date_parse(format_mediawiki_timestamp(end))
+
+            for user in users:
+                user = str(user)
+                if user in results and user in reg and \
+                        start <= reg[user] <= end:
+                    interval_obj._results.append(results[user])
+                else:
+                    row = interval_obj._empty_row(user)
+                    if row is not None:
+                        interval_obj._results.append(row)
+            metric_objs.append(interval_obj)
+
+        return metric_objs
+
     @staticmethod
     def pre_process_metric_call(proc_func):
         def wrapper(self, users, **kwargs):
@@ -291,8 +548,52 @@ class UserMetric(object):
             if hasattr(self, 'log_') and self.log_:
                 logging.info(__name__ + ' :: parameters = ' + str(kwargs))
 
-            return proc_func(self, users, **kwargs)
+            results_key = self._results_key(users) \
+                if _shared_results is not None else None
+            if results_key is not None and results_key in _shared_results:
+                logging.info(__name__ + ' :: Reusing results of {0}.'.format(
+                    self.__class__.__name__))
+                self._results = _shared_results[results_key]
+                progress.report(users=len(users))
+                return self
+
+            reported = progress.reported('users')
+            metric_obj = proc_func(self, users, **kwargs)
+            if results_key is not None:
+                _shared_results[results_key] = metric_obj._results
+
+            # Report the users processed to the job progress channel that
+            # the metric's worker pools have not reported
+            progress.report(users=max(0, len(users) -
+                                      (progress.reported('users') - reported)))
+            return metric_obj
         return wrapper
 
+    def _frame_periods(self, users):
+        """
+            Returns the revision frame bound for the job and the periods of
+            ``users`` if the frame holds their revisions over those periods,
+            otherwise None and None.  Metrics flagging ``_revision_frame``
+            compute from the frame in that case rather than querying the
+            revisions of each user.
+        """
+        frame = get_revision_frame()
+        if frame is None:
+            return None, None
+
+        periods = list(UMP_MAP[self.group](users, self))
+        if not frame.covers(self.project, users, periods):
+            return None, None
+
+        logging.info(__name__ + ' :: Computing {0} from the revision '
+                                'frame.'.format(self.__class__.__name__))
+        return frame, periods
+
+    def _results_key(self, users):
+        """ Identifies the results of the metric over ``users`` """
+        params = tuple((name, str(getattr(self, name)))
+                       for name in sorted(self._param_types['init']))
+        return self.__class__, params, tuple(users)
+
     def process(self, users, **kwargs):
         raise NotImplementedError()
@@ -35,6 +35,7 @@ from user_metrics.etl.data_loader import Connector
 from datetime import datetime, timedelta
 from user_metrics.metrics import query_mod
 from collections import namedtuple
+from contextlib import contextmanager
 from user_metrics.utils import enum, format_mediawiki_timestamp
 from dateutil.parser import parse as date_parse
 from user_metrics.query.query_calls_sql import sub_tokens, escape_var
@@ -168,11 +169,77 @@ def generate_test_cohort(project,
                                 format(utm_name,
                                        settings.__cohort_db__,
                                        len(users)))
-        query_mod.add_cohort_data(utm_name, users, project)
+        query_mod.add_cohort_data(utm_name, [row[0] for row in users],
+                                  project)
 
     return users
 
 
+def read_cohort_ids(stream, column=0, delimiter=None):
+    """
+        Reads and validates the user ids of a cohort from a CSV or TSV
+        stream, one user per line.  The delimiter is detected from the first
+        line if not given.  A first line whose id field is not numeric is
+        treated as a header.  Blank lines are skipped and duplicate ids are
+        dropped.
+
+        Raises ``MediaWikiUserException`` naming the line of the first
+        invalid id, before anything is written.  Returns the list of user
+        ids in order of first appearance.
+    """
+    users = list()
+    seen = set()
+    for line_number, line in enumerate(stream, 1):
+        line = line.strip()
+        if not line:
+            continue
+        if delimiter is None:
+            delimiter = '\t' if '\t' in line else ','
+
+        try:
+            field = line.split(delimiter)[column].strip().strip('"')
+        except IndexError:
+            field = ''
+        if not field.isdigit() or not int(field):
+            if line_number == 1 and not field.isdigit():
+                continue
+            raise MediaWikiUserException(
+                'Invalid user id "{0}" on line {1}.'.format(field,
+                                                            line_number))
+
+        user = int(field)
+        if user not in seen:
+            seen.add(user)
+            users.append(user)
+    return users
+
+
+def upload_cohort(utm_name, stream, project, notes='', column=0,
+                  delimiter=None, chunk_size=None, callback=None):
+    """
+        Creates the cohort ``utm_name`` from a CSV or TSV stream of user
+        ids, see ``read_cohort_ids``.  Users are inserted into
+        ``settings.__cohort_db__`` in chunks of ``chunk_size`` and
+        ``callback`` is called with the number of users inserted after each
+        chunk.  Returns the number of users added.  If the upload fails
+        part way the cohort is removed again, so it can be retried under
+        the same name.
+    """
+    users = read_cohort_ids(stream, column=column, delimiter=delimiter)
+    if not users:
+        raise MediaWikiUserException('No users found for cohort "{0}".'.
+                                     format(utm_name))
+    if query_mod.get_cohort_id(utm_name) is not None:
+        raise MediaWikiUserException('Cohort "{0}" already exists.'.
+                                     format(utm_name))
+
+    logging.info(__name__ + ' :: Uploading {0} users to cohort "{1}".'.
+                            format(len(users), utm_name))
+    return query_mod.add_cohort_data(utm_name, users, project, notes=notes,
+                                     chunk_size=chunk_size,
+                                     callback=callback)
+
+
 # User Classes
 # ============
 
@@ -265,6 +332,29 @@ USER_METRIC_PERIOD_TYPE = enum(REGISTRATION='REGISTRATION', INPUT='INPUT')
 USER_METRIC_PERIOD_DATA = namedtuple('UMPData', 'user start end')
 
 
+# Registration dates keyed by project and user ID within a
+# ``shared_registration_dates`` block, None outside of one
+_registration_dates = None
+
+
+@contextmanager
+def shared_registration_dates():
+    """
+        Within this block registration dates are looked up once per user
+        and project, e.g. by the ``REGISTRATION`` periods of several metrics
+        computed over one cohort.  Dates looked up before metric worker
+        processes are forked are shared with the workers.
+    """
+    global _registration_dates
+    outer = _registration_dates
+    if outer is None:
+        _registration_dates = dict()
+    try:
+        yield
+    finally:
+        _registration_dates = outer
+
+
 def get_registration_dates(users, project):
     """
     Method to handle pulling reg dates from project datastores.
@@ -275,6 +365,22 @@ def get_registration_dates(users, project):
         project : str
             project from which to retrieve ids
     """
+    if _registration_dates is None:
+        return _query_registration_dates(users, project)
+
+    dates = _registration_dates.setdefault(project, dict())
+    users = set(str(u) for u in users)
+    missing_users = [u for u in users if u not in dates]
+    if missing_users:
+        dates.update((u, None) for u in missing_users)
+        for row in _query_registration_dates(missing_users, project):
+            dates[str(row[0])] = row
+
+    return [dates[u] for u in users if dates[u] is not None]
+
+
+def _query_registration_dates(users, project):
+    """ Looks up the registration dates of ``users`` """
 
     # Get registration dates from logging table
     reg = query_mod.user_registration_date_logging(users, project, None)
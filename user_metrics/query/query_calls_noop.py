@@ -73,6 +73,12 @@ def edit_count_user_query(users, project, args):
     return []
 edit_count_user_query.__query_name__ = 'edit_count_user_query'
 
+def edit_count_intervals_user_query(users, project, args):
+    """  Obtain rev counts by user bucketed into intervals """
+    return []
+edit_count_intervals_user_query.__query_name__ = \
+    'edit_count_intervals_user_query'
+
 def namespace_edits_rev_query(users, project, args):
     """ Obtain revisions by namespace """
     return []
@@ -82,6 +88,22 @@ def user_registration_date(users, project, args):
     return []
 user_registration_date.__query_name__ = 'user_registration_date'
 
+def user_registration_date_logging(users, project, args):
+    """ Returns user registration date from logging table """
+    return []
+user_registration_date_logging.__query_name__ = \
+    'user_registration_date_logging'
+
+def user_registration_date_user(users, project, args):
+    """ Returns user registration date from user table """
+    return []
+user_registration_date_user.__query_name__ = 'user_registration_date_user'
+
+def revision_frame_query(users, project, args):
+    """ Returns revisions with their page and parent length """
+    return []
+revision_frame_query.__query_name__ = 'revision_frame_query'
+
 query_store = {
     rev_count_query.__query_name__: None,
     live_account_query.__query_name__: None,
@@ -95,8 +117,12 @@ query_store = {
     blocks_user_map_query.__name__: None,
     blocks_user_query.__query_name__: None,
     edit_count_user_query.__query_name__: None,
+    edit_count_intervals_user_query.__query_name__: None,
     namespace_edits_rev_query.__query_name__: None,
     user_registration_date.__query_name__: None,
+    user_registration_date_logging.__query_name__: None,
+    user_registration_date_user.__query_name__: None,
+    revision_frame_query.__query_name__: None,
     }
 
 
@@ -11,10 +11,12 @@ __license__ = "GPL (version 2 or later)"
 import user_metrics.config.settings as conf
 
 from user_metrics.utils import format_mediawiki_timestamp
+import user_metrics.utils.progress as progress
 from user_metrics.etl.data_loader import DataLoader, Connector, ConnectorError
 from MySQLdb import escape_string, ProgrammingError, OperationalError
 from copy import deepcopy
 from datetime import datetime
+from itertools import islice
 from re import sub
 
 from user_metrics.config import logging
@@ -27,6 +29,10 @@ COMP1_TOKEN = '<comparator_1>'
 USERS_TOKEN = '<users>'
 ORDER_TOKEN = '<order>'
 
+# Number of users inserted per statement when adding cohort users
+COHORT_INSERT_CHUNK_SIZE = getattr(conf, '__cohort_insert_chunk_size__',
+                                   5000)
+
 
 class UMQueryCallError(Exception):
     """ Basic exception class for UserMetric types """
@@ -165,6 +171,7 @@ def query_method_deco(f):
             raise UMQueryCallError(__name__ + ' :: ' + str(e))
         results = [row for row in conn._cur_]
         del conn
+        progress.report(queries=1)
         return results
     return wrapper
 
@@ -190,6 +197,7 @@ def rev_count_query(uid, is_survival, namespace, project,
     query = query_store[rev_count_query.__name__] + timestamp_cond
     query = sub_tokens(query, db=escape_var(project), where=ns_cond)
     conn._cur_.execute(query, {'uid': int(uid), 'ts': str(threshold_ts)})
+    progress.report(queries=1)
     try:
         count = int(conn._cur_.fetchone()[0])
     except (IndexError, ValueError):
@@ -257,6 +265,7 @@ def rev_len_query(rev_id, project):
     query = query_store[rev_len_query.__name__]
     query = sub_tokens(query, db=escape_var(project))
     conn._cur_.execute(query, {'parent_rev_id': int(rev_id)})
+    progress.report(queries=1)
     try:
         rev_len = conn._cur_.fetchone()[0]
     except (IndexError, KeyError, ProgrammingError) as e:
@@ -306,6 +315,7 @@ def page_rev_hist_query(rev_id, page_id, n, project, namespace,
         raise UMQueryCallError(__name__ + ' :: ' + str(e))
 
     conn._cur_.execute(query, params)
+    progress.report(queries=1)
     for row in conn._cur_:
         yield row
     del conn
@@ -382,6 +392,20 @@ def edit_count_user_query(users, project, args):
 edit_count_user_query.__query_name__ = 'edit_count_user_query'
 
 
+@query_method_deco
+def edit_count_intervals_user_query(users, project, args):
+    """  Obtain rev counts by user bucketed into intervals of equal length """
+    query = query_store[edit_count_intervals_user_query.__query_name__]
+    try:
+        params = {'start': str(args.date_start), 'end': str(args.date_end),
+                  'interval': int(args.interval)}
+    except (AttributeError, ValueError) as e:
+        raise UMQueryCallError(__name__ + ' :: ' + str(e))
+    return query, params
+edit_count_intervals_user_query.__query_name__ = \
+    'edit_count_intervals_user_query'
+
+
 @query_method_deco
 def namespace_edits_rev_query(users, project, args):
     """ Obtain revisions by namespace """
@@ -521,7 +545,7 @@ insert_api_user.__query_name__ = 'insert_api_user'
 
 def add_cohort_data(cohort, users, project,
                     notes="", owner=1, group=3,
-                    add_meta=True):
+                    add_meta=True, chunk_size=None, callback=None):
     """
         Adds a new cohort to backend.
 
@@ -531,11 +555,25 @@ def add_cohort_data(cohort, users, project,
             cohort : string
                 Name of cohort (must be unique).
 
-            users : list
-                List of user ids to add to cohort.
+            users : iterable
+                User ids to add to cohort.
 
             project : string
                 Project of cohort.
+
+            chunk_size : int
+                Number of users inserted per statement, see
+                ``add_cohort_users``.
+
+            callback : function
+                Called with the number of users inserted so far after each
+                chunk.
+
+        Returns the number of users added.  When ``add_meta`` is set the
+        cohort is created or not at all: if inserting the users fails the
+        ``usertags`` and ``usertags_meta`` rows already committed for the
+        cohort are deleted before ``UMQueryCallError`` is raised, so the
+        upload can simply be retried.
     """
     conn = Connector(instance=conf.__cohort_data_instance__)
     now = format_mediawiki_timestamp(datetime.now())
@@ -572,35 +610,102 @@ def add_cohort_data(cohort, users, project,
         except (ProgrammingError, OperationalError) as e:
             conn._db_.rollback()
             raise UMQueryCallError(__name__ + ' :: ' + str(e))
+    del conn
 
     # add data to ``user_tags``
-    if users:
+    if users is not None:
         # get uid for cohort
         usertag = get_cohort_id(cohort)
+        try:
+            return add_cohort_users(usertag, users, project,
+                                    chunk_size=chunk_size, callback=callback)
+        except UMQueryCallError:
+            if add_meta:
+                _remove_cohort(usertag)
+            raise
+    return 0
+add_cohort_data.__query_name__ = 'add_cohort'
+
+
+def add_cohort_users(usertag, users, project, chunk_size=None,
+                     callback=None):
+    """
+        Inserts users into the cohort with id ``usertag``.  Users are
+        inserted ``chunk_size`` at a time, by default
+        ``COHORT_INSERT_CHUNK_SIZE``, with one multi-row statement and one
+        commit per chunk so that large cohorts do not hold long locks on
+        ``usertags``.  If a chunk fails it is rolled back and
+        ``UMQueryCallError`` is raised; earlier chunks remain committed, see
+        ``add_cohort_data`` for how a new cohort is cleaned up.
 
-        logging.debug(__name__ + ' :: Adding cohort {0} users.'.
-                      format(len(users)))
+        Parameters
+        ~~~~~~~~~~
+
+            usertag : int
+                Cohort id.
+
+            users : iterable
+                User ids to add to cohort.
+
+            project : string
+                Project of cohort.
+
+            callback : function
+                Called with the number of users inserted so far after each
+                chunk.
 
+        Returns the number of users inserted.
+    """
+    chunk_size = int(chunk_size or COHORT_INSERT_CHUNK_SIZE)
+    if chunk_size < 1:
+        raise UMQueryCallError(__name__ + ' :: Chunk size must be positive.')
+
+    conn = Connector(instance=conf.__cohort_data_instance__)
+    ut_query = query_store[add_cohort_data.__query_name__]
+    ut_query = sub_tokens(ut_query, db=conf.__cohort_meta_instance__,
+                          table=conf.__cohort_db__)
+
+    users = iter(users)
+    total = 0
+    while True:
         try:
-            value_list_ut = [('{0}'.format(project),
-                              int(uid),
-                              int(usertag))
-                             for uid in users]
-        except ValueError as e:
+            chunk = [(str(project), int(uid), int(usertag))
+                     for uid in islice(users, chunk_size)]
+        except (TypeError, ValueError) as e:
             raise UMQueryCallError(__name__ + ' :: ' + str(e))
+        if not chunk:
+            break
 
-        ut_query = query_store[add_cohort_data.__query_name__] + '(' + \
-                   ' %s,' * len(value_list_ut)[:-1] + ')'
-        ut_query = sub_tokens(ut_query, db=conf.__cohort_meta_instance__,
-                              table=conf.__cohort_db__)
         try:
-            conn._cur_.execute(ut_query, value_list_ut)
+            conn._cur_.executemany(ut_query, chunk)
             conn._db_.commit()
         except (ProgrammingError, OperationalError) as e:
             conn._db_.rollback()
             raise UMQueryCallError(__name__ + ' :: ' + str(e))
+
+        total += len(chunk)
+        logging.debug(__name__ + ' :: Added {0} users to cohort {1}.'.
+                      format(total, usertag))
+        if callback:
+            callback(total)
     del conn
-add_cohort_data.__query_name__ = 'add_cohort'
+    return total
+
+
+def _remove_cohort(usertag):
+    """
+        Deletes the users and the meta row of a partially added cohort.
+        Failures are only logged so that the error which caused the removal
+        is the one raised to the caller.
+    """
+    logging.error(__name__ + ' :: Removing incomplete cohort {0}.'.
+                  format(usertag))
+    try:
+        delete_usertags(usertag)
+        delete_usertags_meta(usertag)
+    except (KeyError, ConnectorError, UMQueryCallError) as e:
+        logging.error(__name__ + ' :: Could not remove cohort {0}: {1}'.
+                      format(usertag, str(e)))
 
 
 def get_cohort_data(cohort_name):
@@ -722,6 +827,18 @@ def pages_created_query(uid, project, args):
 pages_created_query.__query_name__ = 'pages_created_query'
 
 
+@query_method_deco
+def revision_frame_query(users, project, args):
+    """ Obtain revisions by user with their page and parent length """
+    query = query_store[revision_frame_query.__query_name__]
+    try:
+        params = {'start': str(args.date_start), 'end': str(args.date_end)}
+    except AttributeError as e:
+        raise UMQueryCallError(__name__ + ' :: ' + str(e))
+    return query, params
+revision_frame_query.__query_name__ = 'revision_frame_query'
+
+
 # QUERY DEFINITIONS
 # #################
 
@@ -840,6 +957,19 @@ query_store = {
             AND rev_timestamp < %(end)s
         GROUP BY 1
     """,
+    edit_count_intervals_user_query.__query_name__:
+    """
+        SELECT
+            rev_user,
+            FLOOR(TIMESTAMPDIFF(SECOND, %(start)s, rev_timestamp) /
+                %(interval)s) AS bucket,
+            count(*)
+        FROM <database>.revision
+        WHERE rev_user IN (<users>)
+            AND rev_timestamp >= %(start)s
+            AND rev_timestamp < %(end)s
+        GROUP BY 1, 2
+    """,
     namespace_edits_rev_query.__query_name__:
     """
         SELECT
@@ -905,7 +1035,7 @@ query_store = {
     add_cohort_data.__query_name__:
     """
         INSERT INTO <database>.<table>
-            VALUES
+            VALUES (%s, %s, %s)
     """,
     add_cohort_data.__query_name__ + '_meta':
     """
@@ -955,4 +1085,23 @@ query_store = {
             AND rev_timestamp > %(start)s
             AND rev_timestamp <= %(end)s
     """,
+    revision_frame_query.__query_name__:
+    """
+        SELECT
+            r.rev_user,
+            r.rev_timestamp,
+            r.rev_page,
+            p.page_namespace,
+            r.rev_len,
+            parent.rev_len,
+            r.rev_parent_id
+        FROM <database>.revision AS r
+            JOIN <database>.page AS p
+                ON r.rev_page = p.page_id
+            LEFT JOIN <database>.revision AS parent
+                ON parent.rev_id = r.rev_parent_id
+        WHERE r.rev_user IN (<users>)
+            AND r.rev_timestamp >= %(start)s
+            AND r.rev_timestamp <= %(end)s
+    """,
 }
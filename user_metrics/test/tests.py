@@ -38,6 +38,37 @@ def test_time_to_threshold():
     assert False  # TODO: implement your test here
 
 
+def test_edit_count_intervals():
+    import user_metrics.metrics.user_metric as um
+    import user_metrics.utils.progress as progress
+    from user_metrics.metrics import query_mod
+
+    def edit_count_intervals(users, project, args):
+        assert args.interval == 86400
+        return [(long(user), int(user) % 2, 1) for user in users]
+
+    start = datetime(2013, 1, 1)
+    intervals = [(start + timedelta(days=i), start + timedelta(days=i + 1))
+                 for i in xrange(2)]
+    saved = getattr(query_mod, 'edit_count_intervals_user_query', None)
+    channel = dict()
+    progress.set_channel(channel, 'key')
+    try:
+        # The bucketed counts are reused by the second call
+        with um.shared_results():
+            for query in [edit_count_intervals, lambda *args: []]:
+                query_mod.edit_count_intervals_user_query = query
+                counts = edit_count.EditCount.process_intervals(
+                    intervals, ['1', '2'], group=USER_METRIC_PERIOD_TYPE.INPUT,
+                    k_=1, log_=False)
+        progress.flush()
+    finally:
+        query_mod.edit_count_intervals_user_query = saved
+
+    assert [list(c) for c in counts] == [[[1, 0], [2, 1]], [[1, 1], [2, 0]]]
+    assert progress.get_progress(channel, 'key')['users'] == 4
+
+
 def test_edit_rate():
     assert False  # TODO: implement your test here
 
@@ -234,6 +265,40 @@ def test_connect_to_dbs():
         assert True
 
 
+def test_connect_read_timeout():
+    import user_metrics.etl.data_loader as dl
+
+    # MySQL-python 1.2.x does not accept ``read_timeout``
+    calls = list()
+
+    class DB(object):
+        cursor = close = lambda self: self
+
+    def connect(**kwargs):
+        calls.append(kwargs)
+        if 'read_timeout' in kwargs:
+            raise TypeError("'read_timeout' is an invalid keyword argument")
+        return DB()
+
+    mysql_connect, dl.MySQLdb.connect = dl.MySQLdb.connect, connect
+    supported = dl._read_timeout_supported
+    try:
+        dl._read_timeout_supported = None
+        assert isinstance(dl._connect({'db': 'x', 'read_timeout': 5}), DB)
+        assert dl._read_timeout_supported is False
+        assert calls == [{'db': 'x', 'read_timeout': 5}, {'db': 'x'}]
+
+        # Later connections are made without it
+        del calls[:]
+        conn = dl.Connector.__new__(dl.Connector)
+        instance = dl.projSet.connections.keys()[0]
+        conn.set_connection(instance=instance, retries=1)
+        assert len(calls) == 1 and 'read_timeout' not in calls[0]
+    finally:
+        dl.MySQLdb.connect = mysql_connect
+        dl._read_timeout_supported = supported
+
+
 # API tests
 # =========
 
@@ -250,5 +315,770 @@ def test_recordtype():
     assert False  # TODO: implement your test here
 
 
+def test_progress():
+    import user_metrics.utils.progress as progress
+
+    channel = dict()
+    progress.set_channel(channel, 'key', users_total=4, intervals_total=2)
+    progress.report(users=2, queries=1, force=True)
+    progress.report_interval(['20130101000000', '20130102000000', 1])
+
+    status = progress.get_progress(channel, 'key', partial=True)
+    assert status['users'] == 2 and status['queries'] == 1
+    assert status['intervals'] == 1 and status['fraction'] == 0.5
+    assert len(status['partial']) == 1
+    assert 'partial' not in progress.get_progress(channel, 'key')
+
+
+def test_pool_progress():
+    import user_metrics.utils.multiprocessing_wrapper as mpw
+    import user_metrics.utils.progress as progress
+    from user_metrics.metrics.edit_count import EditCount
+    from user_metrics.metrics.users import USER_METRIC_PERIOD_TYPE
+
+    channel = dict()
+    progress.set_channel(channel, 'key', users_total=25)
+    size, mpw.PROGRESS_TASK_SIZE = mpw.PROGRESS_TASK_SIZE, 10
+    try:
+        # Users are reported by task as the tasks of the pool complete
+        reported = progress.reported('users')
+        assert mpw.build_thread_pool(['1'] * 25, len, 2, [],
+                                     report_users=True) == [2, 2, 2]
+        assert progress.reported('users') - reported == 25
+        assert mpw.build_thread_pool(['1'] * 25, len, 2, []) == [2, 2]
+        assert progress.reported('users') - reported == 25
+
+        # Metrics do not report the users reported by their pools again
+        EditCount(project='enwiki', group=USER_METRIC_PERIOD_TYPE.INPUT).\
+            process([str(u) for u in xrange(25)], k_=2)
+        progress.flush()
+        assert channel['key']['users'] == 50
+        assert progress.get_progress(channel, 'key')['fraction'] == 1.0
+    finally:
+        mpw.PROGRESS_TASK_SIZE = size
+        progress._channel = None
+
+
+def test_time_series_windows():
+    import user_metrics.etl.time_series_process_methods as tspm
+
+    intervals = tspm._get_intervals('20130101000000', '20130105000000', 24)
+    rolling = tspm._get_windows(intervals, tspm.WINDOW_TYPE.ROLLING, 2)
+    cumulative = tspm._get_windows(intervals, tspm.WINDOW_TYPE.CUMULATIVE, 1)
+
+    assert [w[1] for w in rolling] == [i[1] for i in intervals]
+    assert rolling[0] == intervals[0]
+    assert rolling[-1] == (intervals[-2][0], intervals[-1][1])
+    assert all(w[0] == intervals[0][0] for w in cumulative)
+
+
+def test_time_series_progress():
+    from Queue import Queue
+    import user_metrics.etl.time_series_process_methods as tspm
+    import user_metrics.utils.progress as progress
+    from user_metrics.api.engine.request_manager import \
+        format_time_series_rows, req_progress_jobs
+    from user_metrics.etl.aggregator import list_sum_indices
+    from user_metrics.metrics.edit_count import EditCount
+    from user_metrics.metrics.users import USER_METRIC_PERIOD_TYPE
+
+    # Partial results of a cumulative series are keyed as the final ones
+    channel = req_progress_jobs
+    progress.set_channel(channel, 'key')
+    try:
+        rows = tspm.build_time_series(
+            '20130101000000', '20130105000000', 24, EditCount,
+            list_sum_indices, ['1', '2'], window=tspm.WINDOW_TYPE.CUMULATIVE,
+            project='enwiki', group=USER_METRIC_PERIOD_TYPE.INPUT, k_=1,
+            kr_=1)
+        partial = progress.get_progress(channel, 'key', partial=True)
+    finally:
+        progress._channel = None
+        del channel['key']
+    assert len(rows) == 4
+    assert format_time_series_rows(sorted(partial['partial'])) == \
+        format_time_series_rows(rows)
+
+    # Time series workers label their rows in the same way
+    intervals = tspm._get_intervals('20130101000000', '20130104000000', 24)
+    windows = tspm._get_windows(intervals, tspm.WINDOW_TYPE.ROLLING, 2)
+    task_queue, event_queue = Queue(), Queue()
+    for window in windows + [None]:
+        task_queue.put(window)
+    tspm.time_series_worker(task_queue, EditCount, list_sum_indices, ['1'],
+                            event_queue, dict(project='enwiki', k_=1,
+                                              kr_=1),
+                            labels=tspm._get_labels(intervals))
+    labels = [event_queue.get()[1] for window in windows]
+    assert [row[0] for row in labels] == \
+        [str(ts_s) for ts_s, ts_e in intervals]
+
+
+def test_sum_windows():
+    from datetime import datetime
+    import user_metrics.etl.time_series_process_methods as tspm
+    import user_metrics.metrics.user_metric as um
+    from user_metrics.metrics.revision_frame import RevisionFrame, \
+        shared_revision_frame
+    from user_metrics.metrics.users import USER_METRIC_PERIOD_TYPE
+    from user_metrics.metrics.bytes_added import BytesAdded, ba_mean_agg
+
+    # user, timestamp, page, namespace, len, parent len, parent id
+    rows = [(1, '20130101120000', 10, 0, 100, None, 0),
+            (1, '20130102120000', 10, 0, 80, 100, 5),
+            (1, '20130103120000', 11, 0, 50, 20, 7),
+            (2, '20130102000000', 12, 0, 30, 10, 8),
+            (2, '20130104100000', 12, 0, 40, 30, 9)]
+    users = ['1', '2', '3']
+    frame = RevisionFrame.from_rows(rows, 'enwiki', users, '20130101000000',
+                                    '20130105000000')
+    intervals = tspm._get_intervals(datetime(2013, 1, 1),
+                                    datetime(2013, 1, 5), 24)
+    kwargs = dict(project='enwiki', group=USER_METRIC_PERIOD_TYPE.INPUT,
+                  namespace=[0], k_=1, kr_=1)
+
+    # Rolling and cumulative windows are summed from BytesAdded over the
+    # intervals rather than processing each window
+    with shared_revision_frame(frame):
+        for window in [tspm.WINDOW_TYPE.ROLLING,
+                       tspm.WINDOW_TYPE.CUMULATIVE]:
+            windows = tspm._get_windows(intervals, window, 2)
+            summed = tspm._sum_windows(windows, intervals, BytesAdded,
+                                       users, kwargs)
+            assert len(summed) == len(windows)
+            for (start, end), metric_obj in zip(windows, summed):
+                direct = BytesAdded(datetime_start=start, datetime_end=end,
+                                    **kwargs).process(users, **kwargs)
+                assert sorted(map(list, metric_obj)) == \
+                    sorted(map(list, direct))
+
+    # Chunks of users aggregate as the whole cohort
+    def process(chunk):
+        metric_obj = BytesAdded(**kwargs)
+        metric_obj._results = [[user, int(user), 1, 2, 3, 4]
+                               for user in chunk]
+        return [metric_obj]
+
+    cohort = [str(u) for u in xrange(1, 21)]
+    chunk, tspm.USER_CHUNK = tspm.USER_CHUNK, 6
+    try:
+        chunked = tspm._aggregate_chunks(ba_mean_agg, BytesAdded, cohort,
+                                         process)[0]
+    finally:
+        tspm.USER_CHUNK = chunk
+    whole = um.aggregator(ba_mean_agg, process(cohort)[0],
+                          BytesAdded.header())
+    assert chunked.header == whole.header
+    assert all(abs(x - y) < 1e-9 for x, y in zip(chunked.data[1:],
+                                                 whole.data[1:]))
+
+
+def test_partial_aggregates():
+    import user_metrics.etl.aggregator as agg
+    import user_metrics.etl.time_series_process_methods as tspm
+    import user_metrics.metrics.user_metric as um
+    from user_metrics.metrics.bytes_added import BytesAdded, ba_std_agg, \
+        ba_median_agg
+
+    rows = [[u, u * 3, u, u % 4, -u, u % 2] for u in xrange(20)]
+    metric, chunks = BytesAdded(), [BytesAdded(), BytesAdded()]
+    metric._results, chunks[0]._results, chunks[1]._results = \
+        rows, rows[:5], rows[5:]
+
+    states = [agg.partial_aggregate(ba_std_agg, m) for m in chunks]
+    merged = agg.aggregate_partial(ba_std_agg,
+                                   agg.merge_partials(ba_std_agg, states),
+                                   BytesAdded)
+    direct = um.aggregator(ba_std_agg, metric, BytesAdded.header())
+    assert merged.header == direct.header
+    assert all(abs(x - y) < 1e-9 for x, y in zip(merged.data[1:],
+                                                 direct.data[1:]))
+
+    # Medians are merged from quantile sketches
+    state = agg.partial_aggregate(ba_median_agg, chunks[0])
+    assert 'values' not in state['fields'][0]
+    assert 'sketch' in state['fields'][0]
+
+    # Time series cohorts are aggregated over chunks of users
+    def process(users):
+        metric_obj = BytesAdded()
+        metric_obj._results = [rows[int(user)] for user in users]
+        return [metric_obj]
+
+    chunk, tspm.USER_CHUNK = tspm.USER_CHUNK, 6
+    try:
+        chunked = tspm._aggregate_chunks(ba_median_agg, BytesAdded,
+                                         [str(u) for u in xrange(20)],
+                                         process)[0]
+    finally:
+        tspm.USER_CHUNK = chunk
+    whole = agg.aggregate_partial(
+        ba_median_agg, agg.partial_aggregate(ba_median_agg, metric),
+        BytesAdded)
+    assert chunked == whole
+    assert chunked.header == um.aggregator(ba_median_agg, metric,
+                                           BytesAdded.header()).header
+
+
+def test_quantile_sketch():
+    from user_metrics.utils.quantile_sketch import KLLSketch
+
+    sketches = [KLLSketch(k=100, seed=i) for i in xrange(4)]
+    for x in xrange(40000):
+        sketches[x % 4].update(x)
+    merged = reduce(lambda a, b: a.merge(b), sketches)
+
+    assert len(merged) == 40000
+    for fraction in [0.1, 0.5, 0.9]:
+        assert abs(merged.quantile(fraction) - fraction * 40000) < 800
+
+
+def test_columnar_results():
+    import user_metrics.metrics.user_metric as um
+    from user_metrics.metrics.bytes_added import BytesAdded, ba_sum_agg
+
+    rows = [[u, u * 3, u, u % 4, -u, u % 2] for u in xrange(20)] + \
+           [['20', 0, 0, 0, 0, 0]]
+    metric = BytesAdded()
+    metric._results = [row[:] for row in rows]
+    direct = um.aggregator(ba_sum_agg, metric, BytesAdded.header())
+
+    metric.to_columnar()
+    assert list(metric) == rows
+    assert metric._results.column('edit_count').dtype.kind == 'i'
+    assert um.aggregator(ba_sum_agg, metric, BytesAdded.header()) == direct
+
+
+def test_list_sum_by_group():
+    from user_metrics.etl.aggregator import list_sum_by_group, \
+        list_average_by_group
+    from user_metrics.utils.columnar import ColumnarResults
+
+    # Keys keep their type and the order they are first seen in
+    rows = [[u'b', 1, 2.0], [3, 4, 1.0], [u'b', 2, 0.5], ['10', 1, 1.0]]
+    sums = list_sum_by_group(rows, 0)
+    assert sums == [[u'b', 3, 2.5], [3, 4, 1.0], ['10', 1, 1.0]]
+    assert [type(row[0]) for row in sums] == [unicode, int, str]
+    assert list_average_by_group(rows, 0)[0] == [u'b', 1.5, 1.25]
+
+    columnar = ColumnarResults.from_rows([[2, 5], [10, 1], [2, 3]],
+                                         ['user', 'count'])
+    sums = list_sum_by_group(columnar, 0)
+    assert sums == [[2, 8], [10, 1]]
+    assert type(sums[0][0]) is int
+
+
+def test_cohort_members():
+    import user_metrics.api.engine.data as data
+    from datetime import datetime
+
+    touched = str(datetime.now())
+    cohorts = {1: [u'5', u'3', u'1', u'3'], 2: [u'3', u'4', u'5'],
+               3: [u'9']}
+    calls = []
+
+    def get_cohort_users(utm_id):
+        calls.append(utm_id)
+        return iter(cohorts[utm_id])
+
+    get_users = getattr(data.query_mod, 'get_cohort_users', None)
+    data.query_mod.get_cohort_users = get_cohort_users
+    get_touched, data.get_cohort_refresh_datetime = \
+        data.get_cohort_refresh_datetime, lambda utm_id: touched
+    ttl, data.COHORT_TOUCHED_TTL = data.COHORT_TOUCHED_TTL, -1
+    try:
+        assert data.get_users('1&2~3') == [3, 5, 9]
+        data._cohort_members.clear()
+        assert data.get_users('2~1') == [1, 3, 4, 5]
+        assert sorted(calls) == [1, 2, 3]
+    finally:
+        data.query_mod.get_cohort_users = get_users
+        data.get_cohort_refresh_datetime = get_touched
+        data.COHORT_TOUCHED_TTL = ttl
+
+
+def test_raw_data():
+    import os
+    import user_metrics.api.engine.data as data
+    from user_metrics.api.engine.request_meta import RequestMetaFactory
+
+    request_meta = RequestMetaFactory('cohort', None, 'edit_count')
+    request_meta.aggregator = 'mean'
+    results = [[1, 10], [2, 20]]
+    data.set_raw_data(results, request_meta)
+    request_meta.aggregator = 'median'
+    assert data.get_raw_data(request_meta) == results
+
+    # A truncated entry is a cache miss
+    key = data.build_raw_key_signature(request_meta)
+    file_name = data._keyed_file(data.RAW_DATA_DIR, key)
+    with open(file_name, 'r+b') as raw_file:
+        raw_file.truncate(os.path.getsize(file_name) // 2)
+    assert data.get_raw_data(request_meta) is None
+
+    data.set_raw_data(results, request_meta)
+    data.prune_raw_data(max_bytes=0)
+    assert not os.path.exists(file_name)
+    assert data.get_raw_data(request_meta) is None
+
+
+def test_cohort_expressions():
+    from numpy import array
+    from user_metrics.api import MetricsAPIError
+    from user_metrics.api.engine import compile_cohort_expression, \
+        cohort_ids, evaluate_cohorts, check_cohort_expression
+
+    members = {1: array([1, 3, 5]), 2: array([3, 4, 5]), 3: array([9]),
+               4: array([1, 5, 9])}
+    cases = [('1&2~3', [3, 5, 9]), ('1^2', [1]), ('(1~3)^(2&4)', [1, 3, 9]),
+             ('4&(1~3)^2', [1, 9]), ('1&2&4', [5])]
+    for expression, users in cases:
+        terms = compile_cohort_expression(expression)
+        assert evaluate_cohorts(terms, members).tolist() == users
+    assert cohort_ids(compile_cohort_expression('1&(2~1)^2')) == set([1, 2])
+
+    for expression in ['1&', '(1~2', '1)', '&1', '1()']:
+        try:
+            compile_cohort_expression(expression)
+            assert False
+        except MetricsAPIError as e:
+            assert e.error_code == 11
+
+    # Expressions not built of ids and operators are cohort names
+    try:
+        check_cohort_expression('1&')
+        assert False
+    except MetricsAPIError:
+        pass
+    check_cohort_expression('&1')
+    check_cohort_expression('e3_ob2b')
+
+
+def test_read_cohort_ids():
+    from StringIO import StringIO
+    from user_metrics.metrics.users import read_cohort_ids, \
+        MediaWikiUserException
+
+    stream = StringIO('user_id,name\n"12",a\n\n7,b\n12,c\n')
+    assert read_cohort_ids(stream) == [12, 7]
+    assert read_cohort_ids(StringIO('x\t5\nx\t6\n'), column=1) == [5, 6]
+    try:
+        read_cohort_ids(StringIO('1\n2\nthree\n'))
+        assert False
+    except MediaWikiUserException as e:
+        assert 'line 3' in str(e)
+
+
+def test_add_cohort_data_cleanup():
+    import user_metrics.query.query_calls_sql as qcs
+
+    statements, deleted = [], []
+
+    class FakeConnector(object):
+        def __init__(self, **kwargs):
+            self._cur_ = self._db_ = self
+
+        def execute(self, query, params):
+            statements.append(params)
+
+        def executemany(self, query, rows):
+            if len(statements) > 2:
+                raise qcs.OperationalError('lost connection')
+            statements.append(rows)
+
+        def commit(self):
+            pass
+        rollback = commit
+
+    patched = dict(Connector=FakeConnector,
+                   get_cohort_id=lambda cohort: 42,
+                   delete_usertags=lambda tag: deleted.append(('ut', tag)),
+                   delete_usertags_meta=lambda tag:
+                   deleted.append(('utm', tag)))
+    saved = dict((name, getattr(qcs, name)) for name in patched)
+    try:
+        for name, value in patched.iteritems():
+            setattr(qcs, name, value)
+
+        assert qcs.add_cohort_data('c', xrange(1, 4), 'enwiki',
+                                   chunk_size=2) == 3
+        assert not deleted
+
+        del statements[:]
+        try:
+            qcs.add_cohort_data('c', xrange(1, 6), 'enwiki', chunk_size=2)
+            assert False
+        except qcs.UMQueryCallError:
+            pass
+        assert len(statements) == 3
+        assert deleted == [('ut', 42), ('utm', 42)]
+
+        # Users added to an existing cohort are not cleaned up
+        del statements[:], deleted[:]
+        statements.extend([None, None])
+        try:
+            qcs.add_cohort_data('c', xrange(1, 6), 'enwiki', chunk_size=2,
+                                add_meta=False)
+            assert False
+        except qcs.UMQueryCallError:
+            pass
+        assert not deleted
+    finally:
+        for name, value in saved.iteritems():
+            setattr(qcs, name, value)
+
+
+def test_log_iter_parse():
+    import gzip
+    import os
+    from tempfile import mkdtemp
+    from user_metrics.etl.log_parser import LineParseMethods, batches
+
+    path = mkdtemp()
+    for index in xrange(2):
+        log_file = gzip.open(os.path.join(path, 'ct.log.%d.gz' % index), 'wb')
+        log_file.write('header\n')
+        for event in xrange(3):
+            log_file.write('enwiki ev@%d\t2012%d\t0\n' % (index, event))
+        log_file.close()
+
+    records = LineParseMethods.iter_parse(os.path.join(path, 'ct.log.*.gz'),
+                                          LineParseMethods.e3_lm_log_parse,
+                                          header=True)
+    assert not isinstance(records, list)
+    lengths = [len(batch) for batch in batches(records, 4)]
+    assert lengths == [4, 2]
+
+
+def test_log_parallel_parse():
+    import os
+    from tempfile import mkdtemp
+    from user_metrics.etl.log_parser import LineParseMethods, parallel_parse
+
+    path = mkdtemp()
+    for index in xrange(2):
+        with open(os.path.join(path, 'ct.log.%d' % index), 'w') as log_file:
+            log_file.write('header\n')
+            for event in xrange(100):
+                log_file.write('enwiki ev@%d\t%d\t0\n' % (index, event))
+
+    log_files = os.path.join(path, 'ct.log.*')
+    expected = list(LineParseMethods.iter_parse(
+        log_files, LineParseMethods.e3_lm_log_parse, header=True))
+    assert list(parallel_parse(log_files, LineParseMethods.e3_lm_log_parse,
+                               processes=2, header=True,
+                               split_size=100)) == expected
+
+
+def test_table_loader_insert_batch():
+    from user_metrics.etl.table_loader import TableLoader
+
+    class Cursor(object):
+        statements = list()
+
+        def executemany(self, query, rows):
+            self.statements.append((query, rows))
+
+        def close(self):
+            pass
+
+    class DB(Cursor):
+        def commit(self):
+            pass
+
+    loader = TableLoader()
+    loader._cur_, loader._db_ = Cursor(), DB()
+    records = ([i, 'event'] for i in xrange(5))
+    assert loader.insert_batch(records, 'events', columns=['id', 'name'],
+                               batch_size=2) == 5
+    assert [len(rows) for query, rows in Cursor.statements] == [2, 2, 1]
+    assert Cursor.statements[0][0] == \
+        'INSERT INTO events (`id`, `name`) VALUES (%s, %s)'
+
+
+def test_xsv_streaming():
+    import os
+    from tempfile import mkdtemp
+    from user_metrics.etl.data_loader import DataLoader
+
+    path = os.path.join(mkdtemp(), 'rows.tsv.gz')
+    rows = ([i, u'user\xe9 %d' % i, i / 2.0] for i in xrange(1000))
+    assert DataLoader().iter_to_xsv(rows, path, header=['id', 'name',
+                                                        'half']) == 1000
+
+    read = DataLoader().iter_from_xsv(path, header=True,
+                                      types=[int, None, float])
+    assert not isinstance(read, list)
+    read = list(read)
+    assert len(read) == 1000
+    assert read[3] == [3, u'user\xe9 3'.encode('utf-8'), 1.5]
+
+
+def test_wpapi_batched_diffs():
+    import json
+    import os
+    import urlparse
+    from tempfile import mkdtemp
+    from threading import Thread
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from user_metrics.etl.wpapi import WPAPI
+
+    requests = list()
+
+    class StubAPI(BaseHTTPRequestHandler):
+        def do_POST(self):
+            query = urlparse.parse_qs(self.rfile.read(
+                int(self.headers['Content-Length'])))
+            revids = [int(r) for r in query['revids'][0].split('|')]
+            requests.append(revids)
+            if 'content' in query['rvprop'][0]:
+                revisions = [{'revid': r, '*': 'text %d' % r} for r in revids]
+            else:
+                revisions = [{'revid': r, 'diff': {'*': '' if r == 3 else
+                              '<td class="diff-addedline"><div>add %d'
+                              '</div></td>' % r}} for r in revids]
+                # The diff of revision 6 is never computed
+                revisions = [{'revid': r, 'diff': {'notcached': ''}}
+                             if r == 6 else revision
+                             for r, revision in zip(revids, revisions)]
+            body = json.dumps({'query': {'pages': {'1': {
+                'revisions': revisions}}}})
+            self.send_response(200)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer(('127.0.0.1', 0), StubAPI)
+    thread = Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    try:
+        uri = 'http://127.0.0.1:%d/w/api.php' % server.server_port
+        cache_file = os.path.join(mkdtemp(), 'diffs')
+        api = WPAPI(uri, cache_file=cache_file, batch_size=2, rate_limit=0)
+        added = api.getAddeds([1, 2, 3, 4, 5])
+        assert added[1] == 'add 1' and added[3] == 'text 3'
+        assert sorted(len(revids) for revids in requests) == [1, 1, 2, 2]
+
+        del requests[:]
+        assert api.getAddeds([5, 6, 7]) == {5: 'add 5', 7: 'add 7'}
+        assert requests == [[6, 7], [6]]
+        api.close()
+
+        del requests[:]
+        api = WPAPI(uri, cache_file=cache_file)
+        assert api.getAdded(3) == 'text 3' and not requests
+        api.close()
+    finally:
+        server.shutdown()
+
+
+def test_lazy_registry():
+    from user_metrics.utils.registry import LazyRegistry, RegistryError
+    from user_metrics.metrics.blocks import Blocks
+
+    registry = LazyRegistry([('blocks', 'user_metrics.metrics.blocks.Blocks'),
+                             ('bad', 'user_metrics.metrics.blocks.Nothing')])
+    assert 'blocks' in registry and list(registry) == ['blocks', 'bad']
+    assert not registry.is_loaded('blocks')
+    assert registry['blocks'] is Blocks and registry.is_loaded('blocks')
+    try:
+        registry['bad']
+        assert False
+    except RegistryError:
+        pass
+
+
+def test_register_metric():
+    import user_metrics.metrics.user_metric as um
+    from user_metrics.utils.registry import RegistryError
+    import user_metrics.api.engine.request_meta as rm
+    from user_metrics.metrics.threshold import Threshold, \
+        threshold_editors_agg
+
+    assert rm.get_metric_type('threshold') is Threshold
+    assert rm.get_aggregator_type('proportion+threshold') is \
+        threshold_editors_agg
+    assert rm.ParameterMapping.get_params('threshold')[-1].query_var == 'n'
+    assert rm.get_metric_cost('revert_rate') == um.METRIC_COST.EXPENSIVE
+    assert rm.get_metric_cost('threshold') == um.METRIC_COST.CHEAP
+    assert rm.get_agg_key('mean', 'edit_rate') == 'mean+edit_rate'
+    assert rm.get_agg_key('mean', 'threshold') == ''
+    assert rm.get_agg_key('mean', 'nothing') == ''
+
+    # Every declared metric registers under its handle
+    for handle in um.metric_registry:
+        path = um.metric_registry.get_path(handle)
+        metric_class = um.metric_registry[handle]
+        assert metric_class._handle == handle
+        assert metric_class.__module__ + '.' + metric_class.__name__ == path
+    assert um.metric_registry.get_path('threshold') == \
+        um.METRIC_PACKAGE + '.threshold.Threshold'
+
+    # Metrics must be declared before they register
+    try:
+        @um.register_metric('test_metric')
+        class Undeclared(Threshold):
+            pass
+        assert False
+    except RegistryError:
+        pass
+
+    um.metric_registry.declare('test_metric', __name__ + '.TestMetric')
+
+    @um.register_metric('test_metric', query_params=[('n', 'n')],
+                        cost=um.METRIC_COST.EXPENSIVE)
+    class TestMetric(Threshold):
+        pass
+
+    try:
+        assert rm.get_metric_type('test_metric') is TestMetric
+        assert rm.ParameterMapping.get_params('test_metric')[-1].metric_var \
+            == 'n'
+        assert not TestMetric._aggregators
+        assert rm.get_metric_cost('test_metric') == um.METRIC_COST.EXPENSIVE
+    finally:
+        del um.metric_registry._paths['test_metric']
+        del um.metric_registry._objects['test_metric']
+
+
+def test_combined_request():
+    import user_metrics.metrics.users as users_mod
+    import user_metrics.metrics.user_metric as um
+    from user_metrics.api.engine.request_meta import RequestMetaFactory, \
+        get_request_type, request_types, split_request
+    from user_metrics.metrics.edit_count import EditCount
+
+    rm = RequestMetaFactory('cohort', None, 'edit_count,edit_rate')
+    rm.aggregator = 'mean'
+    assert get_request_type(rm) == request_types.combined
+    assert hasattr(rm, 'time_unit')
+    edit_count, edit_rate = split_request(rm)
+    assert edit_count.metric == 'edit_count' and not edit_count.aggregator
+    assert edit_rate.metric == 'edit_rate' and edit_rate.aggregator == 'mean'
+
+    # Registration dates are looked up once per user
+    lookups = list()
+
+    def logging_dates(users, project, conn):
+        lookups.append(sorted(users))
+        return [(u, '20130101000000') for u in users if u != '3']
+
+    query_mod = users_mod.query_mod
+    saved = (query_mod.user_registration_date_logging,
+             query_mod.user_registration_date_user)
+    query_mod.user_registration_date_logging = logging_dates
+    query_mod.user_registration_date_user = lambda users, project, conn: []
+    try:
+        with users_mod.shared_registration_dates():
+            users_mod.get_registration_dates(['1', '2', '3'], 'enwiki')
+            dates = users_mod.get_registration_dates(['2', '3'], 'enwiki')
+        assert lookups == [['1', '2', '3']] and len(dates) == 1
+    finally:
+        query_mod.user_registration_date_logging, \
+            query_mod.user_registration_date_user = saved
+
+    # Metrics processed again with the same parameters reuse their results
+    calls = list()
+
+    class CountedEditCount(EditCount):
+        @um.UserMetric.pre_process_metric_call
+        def process(self, users, **kwargs):
+            calls.append(users)
+            self._results = [[u, 1] for u in users]
+            return self
+
+    with um.shared_results():
+        CountedEditCount(t=24).process([1, 2], log_=False)
+        CountedEditCount(t=24).process([1, 2], log_=False)
+        CountedEditCount(t=48).process([1, 2], log_=False)
+    CountedEditCount(t=24).process([1, 2], log_=False)
+    assert len(calls) == 3
+
+
+def test_revision_frame():
+    import user_metrics.metrics.revision_frame as rf
+    from user_metrics.metrics.revision_frame import RevisionFrame, \
+        shared_revision_frame
+    from user_metrics.metrics.users import USER_METRIC_PERIOD_TYPE, \
+        USER_METRIC_PERIOD_DATA
+    from user_metrics.metrics.edit_count import EditCount
+    from user_metrics.metrics.bytes_added import BytesAdded
+    from user_metrics.metrics.threshold import Threshold
+    from user_metrics.metrics.namespace_of_edits import NamespaceEdits
+    from user_metrics.utils.columnar import ColumnarResults
+    import user_metrics.metrics.user_metric as um
+
+    # user, timestamp, page, namespace, len, parent len, parent id
+    rows = [(1, '20130101120000', 10, 0, 100, None, 0),
+            (1, '20130102120000', 10, 0, 80, 100, 5),
+            (1, '20130103120000', 11, 1, 50, None, 7),
+            (2, '20130101000000', 12, 0, 30, 10, 8),
+            (2, '20130110000000', 12, 0, 40, 30, 9)]
+    frame = RevisionFrame.from_rows(rows, 'enwiki', [3, 2, 1],
+                                    '20130101000000', '20130110000000')
+    users = ['1', '2', '3']
+    params = dict(datetime_start='20130101000000',
+                  datetime_end='20130105000000', project='enwiki',
+                  group=USER_METRIC_PERIOD_TYPE.INPUT)
+
+    assert len(frame) == 5 and list(frame.users) == [1, 2, 3]
+    assert not frame.covers('enwiki', users + ['4'], [])
+    assert not frame.covers('enwiki', users, [USER_METRIC_PERIOD_DATA(
+        '1', '20130101000000', '20130111000000')])
+
+    with shared_revision_frame(frame):
+        assert list(EditCount(**params).process(users)) == \
+            [[1, 3], [2, 1], [3, 0]]
+        assert list(BytesAdded(**params).process(users)) == \
+            [['1', 80, 120, 100, -20, 2], ['2', 20, 20, 20, 0, 1],
+             ['3', 0, 0, 0, 0, 0]]
+        threshold = Threshold(n=2, namespace=[0, 1], **params)
+        assert list(threshold.process(users)) == [[1, 1], [2, 0], [3, 0]]
+
+        # Results computed from the frame are stored as columns directly
+        assert isinstance(threshold._results, ColumnarResults)
+        assert threshold._results.column(1).dtype.kind == 'i'
+        columnar, um.COLUMNAR_RESULTS = um.COLUMNAR_RESULTS, False
+        try:
+            edit_count = EditCount(**params).process(users)
+        finally:
+            um.COLUMNAR_RESULTS = columnar
+        assert edit_count._results == [[1, 3], [2, 1], [3, 0]]
+        namespace_edits = dict(NamespaceEdits(**params).process(users))
+        assert namespace_edits['1']['0'] == 2 and \
+            namespace_edits['1']['1'] == 1 and \
+            namespace_edits['2']['0'] == 1
+
+    # Frames are loaded by chunk of users, and only when first used
+    def chunk_rows(users, project, args):
+        return [row for row in rows if str(row[0]) in users]
+
+    query, chunk = rf.query_mod.revision_frame_query, rf.FRAME_USER_CHUNK
+    rf.query_mod.revision_frame_query, rf.FRAME_USER_CHUNK = chunk_rows, 1
+    try:
+        loads = list()
+
+        def load():
+            loads.append(1)
+            return RevisionFrame.load(users, 'enwiki', '20130101000000',
+                                      '20130110000000')
+
+        with shared_revision_frame(load):
+            assert not loads
+            loaded = rf.get_revision_frame()
+            assert rf.get_revision_frame() is loaded and len(loads) == 1
+        assert rf.get_revision_frame() is None
+        assert len(loaded) == 5 and list(loaded.users) == [1, 2, 3]
+        assert list(loaded.column('parent_len')) == list(
+            frame.column('parent_len'))
+        assert RevisionFrame.load(users, 'enwiki', '20130101000000',
+                                  '20130110000000', max_rows=4) is None
+    finally:
+        rf.query_mod.revision_frame_query, rf.FRAME_USER_CHUNK = query, chunk
+
+
 if __name__ == '__main__':
     test_revert_rate()
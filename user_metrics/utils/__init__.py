@@ -6,6 +6,8 @@ MW_TIMESTAMP_FORMAT = "%Y%m%d%H%M%S"
 from dateutil.parser import parse as date_parse
 from collections import namedtuple, OrderedDict
 from hashlib import sha1
+from os import getpgid, killpg
+from signal import SIGTERM, SIGKILL
 
 
 def format_mediawiki_timestamp(timestamp_repr):
@@ -176,6 +178,27 @@ def terminate_process_with_checks(proc):
         proc.terminate()
 
 
+def terminate_process_group(proc, timeout=5):
+    """
+        Terminates ``proc`` along with all processes in its process group.
+        The group is sent SIGTERM and, if the leader has not exited after
+        ``timeout`` seconds, SIGKILL.  This expects that ``proc`` leads its
+        own process group, otherwise only ``proc`` itself is terminated.
+    """
+    if not proc or not proc.is_alive():
+        return
+    try:
+        if getpgid(proc.pid) != proc.pid:
+            raise OSError()
+        killpg(proc.pid, SIGTERM)
+        proc.join(timeout)
+        killpg(proc.pid, SIGKILL)
+    except OSError:
+        # Not a group leader or the group has already exited
+        terminate_process_with_checks(proc)
+    proc.join(timeout)
+
+
 # Rudimentary Testing
 if __name__ == '__main__':
     t = build_namedtuple(['a', 'b'], [int, str], [1, 's'])
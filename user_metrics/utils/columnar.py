@@ -0,0 +1,179 @@
+"""
+    This module defines a columnar container for metric results.  A
+    ``UserMetric`` stores its results as a list of rows, one Python list per
+    user.  ``ColumnarResults`` instead holds one typed NumPy array per field
+    of the metric header, which for numeric fields costs 8 bytes per value
+    rather than a boxed Python object and a list slot.  Aggregators read the
+    columns directly (see ``user_metrics.etl.aggregator.results_column``)
+    while iteration and indexing still produce rows as lists so that
+    existing callers are unaffected. ::
+
+        >>> results = ColumnarResults.from_rows([[1, 10], [2, 3]],
+                                                ['user_id', 'edit_count'],
+                                                {'integer_fields': [1]})
+        >>> results.column('edit_count')
+        array([10,  3])
+        >>> list(results)
+        [[1, 10], [2, 3]]
+
+    Fields whose values are all of one scalar type are stored in typed
+    arrays, e.g. integer fields declared as floats in the metric's
+    ``_data_model_meta`` are stored as floats.  Fields mixing types or
+    holding non-scalar values, such as the namespace counts of
+    ``NamespaceEdits``, are stored in object arrays.
+"""
+
+__author__ = {
+    "ryan faulkner": "rfaulkner@wikimedia.org"
+}
+__date__ = "2013-06-13"
+__license__ = "GPL (version 2 or later)"
+
+import numpy
+from itertools import izip
+from operator import itemgetter
+
+# Number of rows converted back to lists at a time when iterating
+ITER_CHUNK_SIZE = 4096
+
+# Groups of Python types stored in typed arrays.  Columns mixing types
+# from different groups are stored as objects so that values come back
+# unchanged.
+SCALAR_TYPES = [
+    (bool, numpy.bool_),
+    (int, long, numpy.integer),
+    (float, numpy.floating),
+    (str,),
+    (unicode,),
+]
+
+# NumPy types of the fields declared in ``_data_model_meta``
+FIELD_DTYPES = [
+    ('id_fields', numpy.int64),
+    ('integer_fields', numpy.int64),
+    ('float_fields', numpy.float64),
+    ('boolean_fields', numpy.bool_),
+]
+
+
+class ColumnarResults(object):
+    """
+        Metric results stored as one array per header field.  Build from
+        rows with ``from_rows``.  The container is read only.
+    """
+
+    def __init__(self, header, columns):
+        if len(header) != len(columns) or \
+                len(set(len(column) for column in columns)) > 1:
+            raise ColumnarResultsError('Columns must match the header and '
+                                       'have equal lengths.')
+        self.header = list(header)
+        self._columns = list(columns)
+        self._index = dict((name, i) for i, name in enumerate(self.header))
+
+    @classmethod
+    def from_rows(cls, rows, header, data_model_meta=None):
+        """
+            Builds the columns of ``rows`` for the fields of ``header``.
+            Raises ``ColumnarResultsError`` if a row does not have one value
+            for each field.
+        """
+        rows = rows if isinstance(rows, list) else list(rows)
+        if any(len(row) != len(header) for row in rows):
+            raise ColumnarResultsError('Rows must have one value for each '
+                                       'header field.')
+        return cls.from_columns([map(itemgetter(index), rows)
+                                 for index in xrange(len(header))],
+                                header, data_model_meta)
+
+    @classmethod
+    def from_columns(cls, columns, header, data_model_meta=None):
+        """
+            Builds the results from ``columns``, one sequence of values per
+            field of ``header``.  Typed NumPy arrays are kept without a copy
+            unless the field is declared with a wider type.
+        """
+        meta = data_model_meta or dict()
+        arrays = list()
+        for index, column in enumerate(columns):
+            dtype = None
+            for field_type, field_dtype in FIELD_DTYPES:
+                if index in meta.get(field_type, []):
+                    dtype = field_dtype
+            arrays.append(_build_column(column, dtype))
+        return cls(header, arrays)
+
+    def column(self, key):
+        """
+            Returns the array for the field ``key``, a header name or an
+            index.  The array is not copied and must not be modified.
+        """
+        if not isinstance(key, (int, long)):
+            key = self._index[key]
+        return self._columns[key]
+
+    @property
+    def nbytes(self):
+        """ Bytes held by the column arrays, excluding object values """
+        return sum(column.nbytes for column in self._columns)
+
+    def __len__(self):
+        return len(self._columns[0]) if self._columns else 0
+
+    def __getitem__(self, index):
+        return [column[index].item() if column.dtype != object
+                else column[index] for column in self._columns]
+
+    def __iter__(self):
+        for start in xrange(0, len(self), ITER_CHUNK_SIZE):
+            chunk = [column[start:start + ITER_CHUNK_SIZE].tolist()
+                     for column in self._columns]
+            for row in izip(*chunk):
+                yield list(row)
+
+    def to_rows(self):
+        """ Returns the results as a list of rows """
+        return list(self.__iter__())
+
+
+def _build_column(values, dtype=None):
+    """
+        Converts ``values`` to a typed 1-D array if they are all of one
+        scalar type, cast to ``dtype`` where that is safe, otherwise to an
+        object array holding the values unchanged.
+    """
+    if isinstance(values, numpy.ndarray) and values.dtype != object and \
+            values.ndim == 1:
+        if dtype is not None and \
+                numpy.can_cast(values.dtype, dtype, 'safe'):
+            values = values.astype(dtype, copy=False)
+        return values
+
+    types = set(map(type, values))
+
+    # Booleans are integers to Python but are kept apart from them
+    if bool in types and len(types) > 1:
+        types = None
+
+    for scalar_types in SCALAR_TYPES:
+        if types and all(issubclass(t, scalar_types) for t in types):
+            try:
+                column = numpy.array(values)
+            except (OverflowError, ValueError):
+                break
+            if column.ndim != 1:
+                break
+            if dtype is not None and \
+                    numpy.can_cast(column.dtype, dtype, 'safe'):
+                column = column.astype(dtype)
+            return column
+
+    column = numpy.empty(len(values), dtype=object)
+    column[:] = values
+    return column
+
+
+class ColumnarResultsError(Exception):
+    """ Basic exception class for columnar results """
+    def __init__(self, message="Could not build columnar results."):
+        Exception.__init__(self, message)
@@ -11,25 +11,39 @@
 import multiprocessing as mp
 import multiprocessing.pool as mp_pool
 import math
+from itertools import izip
+
+import user_metrics.utils.progress as progress
 
 __author__ = "ryan faulkner"
 __date__ = "12/12/2012"
 __license__ = "GPL (version 2 or later)"
 
+# Maximum number of users per task of pools reporting progress, so that
+# progress is reported as users are processed rather than once per process
+PROGRESS_TASK_SIZE = 1000
+
 
-def build_thread_pool(data, callback, k, args):
+def build_thread_pool(data, callback, k, args, report_users=False):
     """
         Handles initializing, executing, and cleanup for thread pools. Given
         the iterable ``data`` and a thread count ``k`` partition the data and
         execute ``k`` independent jobs on ``callback`` with ``args`` passed.
         Finally combine the results of each job.
+
+        If ``report_users`` is set ``data`` are users.  They are then split
+        into tasks of at most ``PROGRESS_TASK_SIZE`` users, run by ``k``
+        processes, and the users of each task are reported to the job
+        progress channel as the task completes.
     """
 
     # partition data
-    n = int(math.ceil(float(len(data)) / k))
+    n = int(math.ceil(float(len(data)) / k)) if data else 0
+    if report_users:
+        n = min(n, PROGRESS_TASK_SIZE)
     arg_list = list()
 
-    for i in xrange(k):
+    for i in xrange(int(math.ceil(float(len(data)) / n)) if n else 0):
         arg_list.append([data[i * n: (i + 1) * n], args])
 
     # remove any args with empty revision lists
@@ -37,19 +51,43 @@ def build_thread_pool(data, callback, k, args):
     if not arg_list:
         return []
 
-    pool = NonDaemonicPool(processes=len(arg_list))
+    pool = NonDaemonicPool(processes=min(k, len(arg_list)))
     results = list()
-    # Call worker threads and aggregate results
-    if arg_list:
-        for elem in pool.map(callback, arg_list):
+
+    # Call worker threads and aggregate results.  Ensure the workers are
+    # reclaimed even if the map fails or is interrupted.
+    try:
+        for task, elem in izip(arg_list, pool.imap(ProgressCallback(callback),
+                                                   arg_list)):
+            if report_users:
+                progress.report(users=len(task[0]))
             if hasattr(elem, '__iter__'):
                 results.extend(elem)
             else:
                 results.extend([elem])
-    pool.terminate()
+    finally:
+        pool.terminate()
+        pool.join()
     return results
 
 
+class ProgressCallback(object):
+    """
+        Wraps a pool callback such that job progress reported by the worker
+        is flushed once each task completes.  Pool workers are terminated
+        with the pool and would otherwise drop buffered counts.
+    """
+
+    def __init__(self, callback):
+        self.callback = callback
+
+    def __call__(self, args):
+        try:
+            return self.callback(args)
+        finally:
+            progress.flush()
+
+
 class NoDaemonicProcess(mp.Process):
     """
         Sub-classes multiporcessing.Process always making the 'daemon'
@@ -0,0 +1,202 @@
+"""
+    This module implements a lightweight channel over which API jobs report
+    their progress.  A channel is any shared mapping (typically a
+    ``multiprocessing.Manager`` dict) keyed by request key signature.  The
+    job process binds the channel once with ``set_channel``; every process
+    forked from it (time series workers and metric thread pools) inherits
+    the binding and may call ``report``.  Outside of an API job the channel
+    is unbound and ``report`` does nothing. ::
+
+        >>> import user_metrics.utils.progress as progress
+        >>> progress.set_channel(channel, key, users_total=100)
+        >>> progress.report(users=10, queries=2)
+        >>> progress.get_progress(channel, key)['users']
+        10
+
+    Counts are buffered in the reporting process and pushed to the channel
+    at most once every ``FLUSH_INTERVAL`` seconds, or on ``flush``.
+    Completed time series intervals may be pushed with ``report_interval``
+    so that partial results are available before the job finishes.
+"""
+
+__author__ = {
+    "ryan faulkner": "rfaulkner@wikimedia.org"
+}
+__date__ = "2013-06-03"
+__license__ = "GPL (version 2 or later)"
+
+from user_metrics.config import logging
+
+from multiprocessing import Lock
+from time import time
+
+# Minimum number of seconds between pushes of buffered counts
+FLUSH_INTERVAL = 1.0
+
+# Counters tracked for each job
+PROGRESS_COUNTERS = ['users', 'intervals', 'queries']
+
+# Seconds to wait on the channel lock.  A job terminated while holding
+# the lock would otherwise block every other writer.
+LOCK_TIMEOUT = 2
+
+# Guards read-modify-write of channel entries across processes
+_lock = Lock()
+
+_channel = None
+_key = None
+_pending = dict()
+_last_flush = 0.0
+
+# Counts reported by this process, see ``reported``
+_reported = dict()
+
+
+def set_channel(channel, key, **totals):
+    """
+        Bind ``channel`` for the calling process and its children and
+        initialize the progress entry for ``key``.  Keyword arguments set
+        the expected totals, e.g. ``users_total``.
+    """
+    global _channel, _key, _pending
+    _channel = channel
+    _key = key
+    _pending = dict()
+
+    entry = dict((c, 0) for c in PROGRESS_COUNTERS)
+    entry['started'] = time()
+    entry['partial'] = list()
+    entry.update(totals)
+    _update(lambda e: entry)
+
+
+def set_totals(**totals):
+    """ Set the expected totals for the bound job. """
+    if _channel is not None:
+        _update(lambda e: dict(e, **totals))
+
+
+def report(force=False, **increments):
+    """
+        Increment counters for the bound job, e.g. ``report(users=10)``.
+        Increments are buffered and pushed when ``FLUSH_INTERVAL`` has
+        elapsed since the last push, or immediately if ``force`` is set.
+    """
+    if _channel is None:
+        return
+    for counter, value in increments.iteritems():
+        _pending[counter] = _pending.get(counter, 0) + value
+        _reported[counter] = _reported.get(counter, 0) + value
+    if force or time() - _last_flush > FLUSH_INTERVAL:
+        flush()
+
+
+def reported(counter):
+    """
+        Returns the total of ``counter`` reported by this process, e.g. to
+        tell how many users were reported within a call.
+    """
+    return _reported.get(counter, 0)
+
+
+def report_interval(row):
+    """
+        Record a completed time series interval for the bound job.  ``row``
+        is the interval data as produced by the time series workers.
+    """
+    if _channel is None:
+        return
+    _pending['intervals'] = _pending.get('intervals', 0) + 1
+    increments = _take_pending()
+
+    def add_interval(entry):
+        entry = _apply_increments(entry, increments)
+        entry['partial'] = entry['partial'] + [row]
+        return entry
+    _update(add_interval)
+
+
+def flush():
+    """ Push any buffered counts for the bound job to the channel. """
+    if _channel is None or not _pending:
+        return
+    increments = _take_pending()
+    _update(lambda e: _apply_increments(e, increments))
+
+
+def clear_partial(channel, key):
+    """ Drop the partial results stored for ``key``. """
+    set_fields(channel, key, partial=list())
+
+
+def set_fields(channel, key, **fields):
+    """ Set ``fields`` on the progress entry for ``key`` if it exists. """
+    locked = _lock.acquire(True, LOCK_TIMEOUT)
+    try:
+        if key in channel:
+            channel[key] = dict(channel[key], **fields)
+    finally:
+        if locked:
+            _lock.release()
+
+
+def get_progress(channel, key, partial=False):
+    """
+        Returns the progress of the job for ``key`` as a dict with counters,
+        totals, the elapsed time and an estimate of the remaining time in
+        seconds (``eta``).  Partial results are included only if
+        ``partial`` is set.  Returns None if the job is unknown.
+    """
+    try:
+        entry = dict(channel[key])
+    except KeyError:
+        return None
+
+    entry['elapsed'] = time() - entry['started']
+
+    # Estimate the completed fraction from intervals for time series and
+    # from users otherwise
+    fraction = None
+    for counter in ['intervals', 'users']:
+        total = entry.get(counter + '_total')
+        if total:
+            fraction = min(1.0, float(entry[counter]) / total)
+            break
+
+    entry['fraction'] = fraction
+    if fraction:
+        entry['eta'] = entry['elapsed'] * (1.0 - fraction) / fraction
+    else:
+        entry['eta'] = None
+
+    if not partial:
+        del entry['partial']
+    return entry
+
+
+def _take_pending():
+    global _pending, _last_flush
+    increments = _pending
+    _pending = dict()
+    _last_flush = time()
+    return increments
+
+
+def _apply_increments(entry, increments):
+    entry = dict(entry)
+    for counter, value in increments.iteritems():
+        entry[counter] = entry.get(counter, 0) + value
+    return entry
+
+
+def _update(func):
+    """ Atomically replace the entry of the bound job with func(entry). """
+    locked = _lock.acquire(True, LOCK_TIMEOUT)
+    try:
+        _channel[_key] = func(_channel.get(_key, dict()))
+    except Exception as e:
+        logging.error(__name__ + ' :: Could not update progress for '
+                                 '"{0}": {1}'.format(_key, str(e)))
+    finally:
+        if locked:
+            _lock.release()
@@ -0,0 +1,107 @@
+"""
+    This module defines a registry of named objects that are imported on
+    first use.  Entries are declared with the dotted path of the object so
+    that listing or checking names does not import anything; the module
+    holding an object is imported only when the object is looked up. ::
+
+        >>> from user_metrics.utils.registry import LazyRegistry
+        >>> metrics = LazyRegistry([
+                ('edit_rate', 'user_metrics.metrics.edit_rate.EditRate')])
+        >>> 'edit_rate' in metrics          # nothing imported
+        True
+        >>> metrics['edit_rate']            # imports edit_rate
+        <class 'user_metrics.metrics.edit_rate.EditRate'>
+
+    Objects that are already imported may be added with ``register``.  A
+    registry may also be given a ``loader``, called with the registry before
+    it is first used, which declares its entries without importing them,
+    e.g. by reading the source of the modules that define them.
+"""
+
+__author__ = {
+    "ryan faulkner": "rfaulkner@wikimedia.org"
+}
+__date__ = "2013-06-18"
+__license__ = "GPL (version 2 or later)"
+
+from collections import Mapping, OrderedDict
+from importlib import import_module
+
+
+def import_object(path):
+    """
+        Imports and returns the object at the dotted ``path``, e.g.
+        ``user_metrics.metrics.edit_rate.EditRate``.
+    """
+    module_name, _, attr = path.rpartition('.')
+    try:
+        return getattr(import_module(module_name), attr)
+    except (ImportError, AttributeError, ValueError) as e:
+        raise RegistryError('Could not import "{0}": {1}'.format(path, e))
+
+
+class LazyRegistry(Mapping):
+    """
+        Read only mapping of names to objects declared by dotted path and
+        imported on first lookup.  Iteration, ``len`` and ``in`` do not
+        import anything.
+    """
+
+    def __init__(self, entries=None, loader=None):
+        self._paths = OrderedDict()
+        self._objects = dict()
+        self._loader = loader
+        for name, path in (entries or []):
+            self.declare(name, path)
+
+    def _load(self):
+        """ Call the loader once, before the first use of the registry """
+        if self._loader:
+            loader, self._loader = self._loader, None
+            loader(self)
+
+    def declare(self, name, path):
+        """ Declare ``name`` for the object at the dotted ``path`` """
+        self._paths[name] = path
+        self._objects.pop(name, None)
+
+    def register(self, name, obj):
+        """
+            Add an imported object under ``name``.  A declared path of
+            ``name`` is kept.
+        """
+        self._paths.setdefault(name, None)
+        self._objects[name] = obj
+
+    def is_loaded(self, name):
+        return name in self._objects
+
+    def get_path(self, name):
+        """ Returns the dotted path declared for ``name``, or None """
+        self._load()
+        return self._paths.get(name)
+
+    def __getitem__(self, name):
+        self._load()
+        if name not in self._objects:
+            path = self._paths[name]
+            self._objects[name] = import_object(path)
+        return self._objects[name]
+
+    def __contains__(self, name):
+        self._load()
+        return name in self._paths
+
+    def __iter__(self):
+        self._load()
+        return iter(self._paths)
+
+    def __len__(self):
+        self._load()
+        return len(self._paths)
+
+
+class RegistryError(Exception):
+    """ Basic exception class for registries """
+    def __init__(self, message="Could not load registered object."):
+        Exception.__init__(self, message)